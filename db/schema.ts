@@ -86,7 +86,7 @@ export const alertActionEnum = pgEnum('alert_action', [
 const baseColumns = {
     id: uuid('id').defaultRandom().primaryKey(),
     createdAt: timestamp('created_at').defaultNow().notNull(),
-    updatedAt: timestamp('updated_at').defaultNow().notNull(),
+    updatedAt: timestamp('updated_at').defaultNow().$onUpdate(() => new Date()).notNull(),
     isDeleted: boolean('is_deleted').default(false).notNull(),
 };
 
@@ -14,12 +14,103 @@ class Settings(BaseSettings):
     aws_region: str = "us-east-1"
     aws_s3_bucket: str = ""
     
+    # Textract
+    textract_backend: str = "aws"  # "aws", or "stub" for local runs/tests without AWS
+    textract_max_concurrent_jobs: int = 4  # Async text-detection jobs in flight across the service
+    textract_poll_initial_seconds: float = 1.0  # First poll delay, doubled per poll up to the max
+    textract_poll_max_seconds: float = 10.0
+    textract_timeout_seconds: float = 300.0
+    textract_sns_topic_arn: str = ""  # Completion notifications (SNS topic -> SQS queue) instead of polling
+    textract_sns_role_arn: str = ""
+    textract_sqs_queue_url: str = ""
+    
     # OpenAI
     openai_api_key: str = ""
+    openai_model: str = "gpt-4-turbo-preview"
+    openai_max_concurrency: int = 4  # In-flight LLM calls across the whole service
+    openai_requests_per_minute: int = 500  # Keep in line with the account's rate-limit tier
+    openai_tokens_per_minute: int = 150000
+    openai_max_retries: int = 5  # Retries on 429 / 5xx / connection errors
+    openai_timeout_seconds: float = 120.0
+    openai_structured_outputs: bool = True  # json_schema response formats; JSON mode on models without them
+    
+    # LLM prompt size: extracted text is compacted, then cut to a per-type token budget
+    prompt_compaction_enabled: bool = True  # Drop repeated page headers/footers, empty table columns, whitespace
+    prompt_token_budget_purchase_order: int = 4000
+    prompt_token_budget_invoice: int = 4000
+    prompt_token_budget_milestone: int = 4000
+    prompt_token_budget_shipment: int = 4000  # Per call; longer shipment texts are parsed in concurrent chunks
+    
+    # Extraction worker pools
+    extraction_io_workers: int = 16  # Threads for blocking boto3 (S3/Textract) calls
+    extraction_cpu_workers: int = 0  # Processes for PDF/Excel/Word parsing (0 = CPU count)
+    extraction_queue_size: int = 32  # Tasks allowed to wait per pool before callers block
+    extraction_queue_timeout_seconds: float = 30.0  # Give up waiting for a pool slot after this
+    pdf_pages_per_task: int = 4  # Minimum PDF pages per parallel extraction task
+    pdf_ocr_enabled: bool = True  # OCR pages without a text layer (scans) with Textract
+    pdf_ocr_max_pages: int = 50  # Cap on pages rendered and OCR'd per document
+    pdf_ocr_resolution: int = 200  # DPI for rendering pages sent to OCR
+    shipment_chunk_chars: int = 12000  # Max chunk size for shipments over prompt_token_budget_shipment (shrunk to fit it)
+    table_parser_min_confidence: float = 0.8  # Spreadsheet tables parsed below this go to the LLM instead
+    excel_max_rows: int = 100000  # Rows streamed per sheet (0 = no limit)
+    excel_sheets: str = ""  # Comma-separated sheet names to read (empty = all sheets)
+    
+    # Document downloads (pooled S3/HTTP clients, streamed into temp-file buffers)
+    download_max_bytes: int = 200 * 1024 * 1024  # Larger documents are rejected (0 = no limit)
+    download_part_bytes: int = 8 * 1024 * 1024  # Objects larger than one part are fetched as ranged GETs
+    download_max_concurrent_parts: int = 4  # Ranged GETs in flight per document
+    download_max_connections: int = 32  # HTTP keep-alive pool and S3 connection pool size
+    download_timeout_seconds: float = 60.0
+    document_buffer_dir: str = ""  # Temp files shared with parser processes (empty = system temp dir; /dev/shm keeps them in RAM)
+    upload_max_bytes: int = 100 * 1024 * 1024  # Uploaded files above this are rejected with 413 (0 = no limit)
+    
+    # Extraction cache (content-hash keyed, local disk)
+    extraction_cache_enabled: bool = True
+    extraction_cache_dir: str = "/tmp/extraction-cache"
+    extraction_cache_max_bytes: int = 512 * 1024 * 1024  # Evict least recently used entries past this size
+    
+    # Extraction jobs (async submit / poll / webhook)
+    extraction_jobs_dir: str = "/tmp/extraction-jobs"  # SQLite job store and pending uploads
+    extraction_job_workers: int = 4  # Jobs processed concurrently
+    extraction_job_priorities: str = "shipment:0,purchase_order:1,invoice:1,milestone:2"  # Lower runs first
+    extraction_job_retention_hours: int = 72  # Finished jobs are purged after this
+    extraction_job_max_attempts: int = 3  # Jobs interrupted this often (worker crash/OOM) fail instead of rerunning
+    extraction_job_callback_secret: str = ""  # Signs webhook bodies (X-Signature: sha256=...) when set
+    extraction_job_callback_hosts: str = ""  # Comma-separated hosts callbacks may target (empty = any public address)
+    
+    # Batch extraction: per-stage concurrency shared by the documents of one batch
+    extraction_batch_max_documents: int = 200
+    extraction_batch_download_concurrency: int = 8
+    extraction_batch_text_concurrency: int = 4
+    extraction_batch_parse_concurrency: int = 4  # LLM calls are additionally capped by openai_max_concurrency
     
     # Database
     database_url: str = ""
     
+    # Database connection pool (KPI engine)
+    db_pool_size: int = 10
+    db_max_overflow: int = 5
+    db_pool_timeout: float = 10.0  # Seconds to wait for a free connection
+    db_pool_recycle: int = 1800  # Seconds before a connection is replaced
+    db_pool_pre_ping: bool = True
+    db_pool_warmup: int = 6  # Connections opened at startup (0 disables)
+    db_statement_cache_size: int = 100  # Prepared statements kept per connection (0 disables)
+    
+    # KPI daily rollups
+    kpi_rollups_enabled: bool = False
+    kpi_rollup_max_staleness_seconds: int = 300  # Older rollups fall back to live queries
+    kpi_rollup_refresh_interval_seconds: int = 60  # Background incremental refresh (0 disables)
+    
+    # KPI result cache
+    kpi_cache_enabled: bool = True
+    kpi_cache_ttl_seconds: int = 60
+    kpi_cache_max_entries: int = 2048
+    kpi_cache_max_bytes: int = 64 * 1024 * 1024
+    kpi_cache_redis_url: str = ""  # Optional shared backend (redis:// or rediss://)
+    
+    # KPI query tracing
+    kpi_slow_query_ms: float = 500  # Log queries slower than this with their params (0 disables)
+    
     # Service
     debug: bool = True
     allowed_origins: str = "http://localhost:3000"
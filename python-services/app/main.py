@@ -2,12 +2,31 @@
 Infradyn Python Services - FastAPI Application
 AI Extraction, KPI Engine, Report Generation
 """
-from fastapi import FastAPI
+import asyncio
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager, suppress
 
 from app.config import get_settings
 from app.routers import extraction, health, kpi
+from app.services import kpi_tracing
+from app.services.downloader import get_downloader
+from app.services.executors import get_executors
+from app.services.extraction_jobs import get_job_queue
+from app.services.text_compaction import warm_tokenizer
+from app.services.textract import get_textract_engine
+
+
+async def refresh_kpi_rollups_periodically(interval_seconds: int):
+    """Keep KPI rollups incrementally up to date in the background"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await kpi.get_kpi_service().rollups.refresh_all()
+        except Exception as e:
+            print(f"⚠️ KPI rollup refresh failed: {e}")
 
 
 @asynccontextmanager
@@ -15,9 +34,46 @@ async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
     print("🚀 Infradyn Python Services starting...")
+    settings = get_settings()
+    
+    # Warm the KPI connection pool so the first dashboard request doesn't pay for TLS handshakes
+    if settings.database_url and settings.db_pool_warmup > 0:
+        try:
+            warmed = await kpi.get_kpi_service().warm_up(settings.db_pool_warmup)
+            print(f"🔥 KPI connection pool warmed: {warmed} connections")
+        except Exception as e:
+            print(f"⚠️ KPI connection pool warm-up failed: {e}")
+    
+    rollup_task = None
+    if settings.database_url and settings.kpi_rollups_enabled and settings.kpi_rollup_refresh_interval_seconds > 0:
+        rollup_task = asyncio.create_task(
+            refresh_kpi_rollups_periodically(settings.kpi_rollup_refresh_interval_seconds)
+        )
+    
+    # Load the prompt tokenizer (its BPE file may need fetching) before the first extraction
+    if not await asyncio.to_thread(warm_tokenizer, settings.openai_model):
+        print(f"⚠️ No tokenizer for {settings.openai_model}, prompt budgets use estimated token counts")
+    
+    # Open the shared download connection pools before any extraction runs
+    await get_downloader().start()
+    
+    # Resume extraction jobs left over from the previous run
+    await get_job_queue().start()
+    
     yield
     # Shutdown
     print("👋 Infradyn Python Services shutting down...")
+    await get_job_queue().stop()
+    if rollup_task:
+        rollup_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await rollup_task
+    if kpi.get_kpi_service.cache_info().currsize:
+        await kpi.get_kpi_service().engine.dispose()
+    if get_downloader.cache_info().currsize:
+        await get_downloader().close()
+    if get_executors.cache_info().currsize:
+        get_executors().shutdown()
 
 
 # Create FastAPI app
@@ -42,6 +98,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def kpi_server_timing(request: Request, call_next):
+    """Trace KPI requests and report per-family query time in a Server-Timing header"""
+    if not request.url.path.startswith("/api/kpi"):
+        return await call_next(request)
+    trace = kpi_tracing.start_trace()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+# Single-file upload endpoints; the multipart body is only parsed after this check
+UPLOAD_PATHS = ("/api/extraction/upload", "/api/extraction/jobs/upload")
+# Allowance for multipart boundaries and the other form fields
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """
+    Answer 413 from Content-Length before an oversized upload is received.
+    Starlette spools the whole multipart body to disk before the endpoint
+    runs, so this is the only point where the size bounds what gets written:
+    bodies without a Content-Length (chunked transfer) are refused with 411,
+    and the server never reads past the declared length.
+    """
+    max_bytes = settings.upload_max_bytes
+    if max_bytes and request.method == "POST" and request.url.path in UPLOAD_PATHS:
+        length = request.headers.get("content-length", "")
+        if not length.isdigit():
+            return JSONResponse(
+                status_code=411,
+                content={"detail": "Uploads must declare a Content-Length"},
+            )
+        if int(length) > max_bytes + UPLOAD_FORM_OVERHEAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload is larger than the {max_bytes / 1024 / 1024:.0f} MB limit"},
+            )
+    return await call_next(request)
+
+
 # Include routers
 app.include_router(health.router, tags=["Health"])
 app.include_router(extraction.router, prefix="/api/extraction", tags=["AI Extraction"])
@@ -57,3 +156,26 @@ async def root():
         "status": "operational",
         "docs": "/docs"
     }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: KPI query histograms plus cache, pool and extraction worker gauges"""
+    gauges = {
+        f"kpi_cache_{name}": value
+        for name, value in kpi.get_kpi_cache().stats().items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+    if kpi.get_kpi_service.cache_info().currsize:
+        gauges.update({
+            f"kpi_pool_{name}": value
+            for name, value in kpi.get_kpi_service().pool_stats().items()
+        })
+    if get_executors.cache_info().currsize:
+        for pool, stats in get_executors().stats().items():
+            gauges.update({f"extraction_{pool}_pool_{name}": value for name, value in stats.items()})
+    if get_textract_engine.cache_info().currsize:
+        gauges.update({f"textract_{name}": value for name, value in get_textract_engine().stats().items()})
+    if get_downloader.cache_info().currsize:
+        gauges.update({f"download_{name}": value for name, value in get_downloader().stats().items()})
+    return kpi_tracing.metrics.render(gauges)
@@ -2,12 +2,31 @@
 AI Extraction Router
 Endpoints for document extraction (PO, Invoices, etc.)
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from functools import partial
 from typing import Optional, List
 from enum import Enum
 
+from app.config import get_settings
 from app.services.ai_extraction import AIExtractionService
+from app.services.document_buffer import DocumentBuffer
+from app.services.extraction_batch import BatchDocument, iter_batch_ndjson
+from app.services.extraction_cache import get_extraction_cache
+from app.services.extraction_jobs import CallbackURLError, get_job_queue
+from app.services.extraction_schemas import (  # noqa: F401 (re-exported)
+    ExtractedBOQItem,
+    ExtractedInvoiceData,
+    ExtractedInvoiceLineItem,
+    ExtractedMilestone,
+    ExtractedMilestoneSchedule,
+    ExtractedPOData,
+    ExtractedShipmentData,
+    ExtractedShipmentItem,
+    ExtractedShipmentPackage,
+)
+from app.services.upload_ingest import UnsupportedUploadError, UploadTooLargeError, ingest_upload
 
 router = APIRouter()
 
@@ -26,95 +45,6 @@ class DocumentType(str, Enum):
     SHIPMENT = "shipment"
 
 
-class ExtractedMilestone(BaseModel):
-    title: str
-    description: Optional[str] = None
-    expected_date: Optional[str] = None
-    payment_percentage: float
-
-
-class ExtractedBOQItem(BaseModel):
-    item_number: str
-    description: str
-    unit: str
-    quantity: float
-    unit_price: float
-    total_price: float
-
-
-class ExtractedPOData(BaseModel):
-    po_number: Optional[str] = None
-    vendor_name: Optional[str] = None
-    date: Optional[str] = None
-    total_value: Optional[float] = None
-    currency: Optional[str] = None
-    scope: Optional[str] = None
-    payment_terms: Optional[str] = None
-    incoterms: Optional[str] = None
-    retention_percentage: Optional[float] = None
-    milestones: List[ExtractedMilestone] = []
-    boq_items: List[ExtractedBOQItem] = []
-    confidence: float = 0.0
-    raw_text: Optional[str] = None
-
-
-class ExtractedInvoiceData(BaseModel):
-    invoice_number: Optional[str] = None
-    vendor_name: Optional[str] = None
-    date: Optional[str] = None
-    due_date: Optional[str] = None
-    total_amount: Optional[float] = None
-    currency: Optional[str] = None
-    line_items: List[dict] = []
-    tax_amount: Optional[float] = None
-    subtotal: Optional[float] = None
-    confidence: float = 0.0
-
-
-class ExtractedShipmentPackage(BaseModel):
-    package_no: str
-    length_m: Optional[float] = None
-    quantity: int = 0
-    total_area_m2: Optional[float] = None
-    gross_weight_kg: Optional[float] = None
-
-
-class ExtractedShipmentItem(BaseModel):
-    article_number: str
-    description: str
-    quantity: float = 0
-    unit: str = ""
-    unit_price: Optional[float] = None
-    total_price: Optional[float] = None
-    weight_kg: Optional[float] = None
-    hs_code: Optional[str] = None
-    country_of_origin: Optional[str] = None
-    delivery_note: Optional[str] = None
-    packages: List[ExtractedShipmentPackage] = []
-
-
-class ExtractedShipmentData(BaseModel):
-    order_number: Optional[str] = None
-    project: Optional[str] = None
-    invoice_number: Optional[str] = None
-    invoice_date: Optional[str] = None
-    supplier_name: Optional[str] = None
-    customer_name: Optional[str] = None
-    delivery_conditions: Optional[str] = None
-    delivery_address: Optional[str] = None
-    origin: Optional[str] = None
-    destination: Optional[str] = None
-    currency: Optional[str] = None
-    total_excl_vat: Optional[float] = None
-    total_incl_vat: Optional[float] = None
-    vat_percentage: Optional[float] = None
-    total_gross_weight_kg: Optional[float] = None
-    total_net_weight_kg: Optional[float] = None
-    items: List[ExtractedShipmentItem] = []
-    confidence: float = 0.0
-    raw_text: Optional[str] = None
-
-
 class ExtractionRequest(BaseModel):
     file_url: str
     document_type: DocumentType = DocumentType.PURCHASE_ORDER
@@ -126,6 +56,37 @@ class ExtractionResponse(BaseModel):
     error: Optional[str] = None
 
 
+class BatchExtractionRequest(BaseModel):
+    documents: List[ExtractionRequest] = Field(..., min_length=1)
+
+
+class ExtractionJobRequest(ExtractionRequest):
+    callback_url: Optional[str] = None  # Receives the finished job as a POST
+
+
+class ExtractionJobResponse(BaseModel):
+    job_id: str
+    status: str
+    document_type: str
+    file_url: Optional[str] = None
+    filename: Optional[str] = None
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    data: Optional[dict] = None
+    error: Optional[str] = None
+
+
+async def _ingest_upload(file: UploadFile) -> DocumentBuffer:
+    """Stream an upload into a document buffer; 413 when too large, 415 when not a supported document"""
+    try:
+        return await ingest_upload(file, get_settings().upload_max_bytes)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedUploadError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+
 # ============================================================================
 # ENDPOINTS
 # ============================================================================
@@ -171,27 +132,18 @@ async def extract_uploaded_file(
     
     Accepts: PDF, DOCX, XLSX, PNG, JPG
     """
+    document = await _ingest_upload(file)
     try:
-        content = await file.read()
-        filename = file.filename or "document"
-        
-        # Use specialized shipment extractor for better results on large docs
-        if document_type == DocumentType.SHIPMENT:
-            result = await extraction_service.extract_shipment_from_bytes(
-                content, filename
-            )
-        else:
-            result = await extraction_service.extract_from_bytes(
-                content, filename, document_type.value
-            )
-        
-        return result
-        
+        return await extraction_service.extract_from_buffer(
+            document, file.filename or "document", document_type.value
+        )
     except Exception as e:
         return ExtractionResponse(
             success=False,
             error=str(e)
         )
+    finally:
+        document.close()
 
 
 @router.post("/milestones", response_model=ExtractionResponse)
@@ -208,3 +160,102 @@ async def extract_milestones_only(request: ExtractionRequest):
             success=False,
             error=str(e)
         )
+
+
+@router.get("/cache/stats")
+async def extraction_cache_stats():
+    """Hit/miss counters and disk usage of the extraction cache"""
+    return get_extraction_cache().stats()
+
+
+@router.post("/jobs", response_model=ExtractionJobResponse, status_code=202)
+async def submit_extraction_job(request: ExtractionJobRequest):
+    """
+    Queue extraction of a document URL and return immediately
+    
+    Poll GET /jobs/{job_id} or pass callback_url to be notified on completion.
+    """
+    try:
+        return await get_job_queue().submit_url(
+            request.file_url, request.document_type.value, request.callback_url
+        )
+    except CallbackURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/jobs/upload", response_model=ExtractionJobResponse, status_code=202)
+async def submit_extraction_upload_job(
+    file: UploadFile = File(...),
+    document_type: DocumentType = Form(DocumentType.PURCHASE_ORDER),
+    callback_url: Optional[str] = Form(None)
+):
+    """Queue extraction of an uploaded file and return immediately"""
+    document = await _ingest_upload(file)
+    try:
+        return await get_job_queue().submit_upload(
+            document, file.filename or "document", document_type.value, callback_url
+        )
+    except CallbackURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        document.close()
+
+
+@router.get("/jobs/{job_id}", response_model=ExtractionJobResponse)
+async def get_extraction_job(job_id: str):
+    """Job status, plus the extracted data once completed"""
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def _check_batch_size(count: int) -> None:
+    max_documents = get_settings().extraction_batch_max_documents
+    if count > max_documents:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {max_documents} documents")
+
+
+@router.post("/batch")
+async def extract_batch(request: BatchExtractionRequest):
+    """
+    Extract many document URLs in one call
+    
+    Streams NDJSON, one line per document as it finishes (use `index` to match
+    lines to the request order).
+    """
+    _check_batch_size(len(request.documents))
+    documents = [
+        BatchDocument(index=index, document_type=document.document_type.value, file_url=document.file_url)
+        for index, document in enumerate(request.documents)
+    ]
+    return StreamingResponse(
+        iter_batch_ndjson(extraction_service, documents),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.post("/batch/upload")
+async def extract_batch_upload(
+    files: List[UploadFile] = File(...),
+    document_types: List[DocumentType] = Form(...)
+):
+    """
+    Extract many uploaded files in one call
+    
+    Pass one document_types value per file, or a single value for all of them.
+    Streams NDJSON like /batch.
+    """
+    _check_batch_size(len(files))
+    if len(document_types) not in (1, len(files)):
+        raise HTTPException(status_code=400, detail="Provide one document type per file, or a single one for all")
+    
+    types = document_types * len(files) if len(document_types) == 1 else document_types
+    documents = [
+        BatchDocument(index=index, document_type=document_type.value, filename=file.filename, open=partial(ingest_upload, file, get_settings().upload_max_bytes))
+        for index, (file, document_type) in enumerate(zip(files, types))
+    ]
+    return StreamingResponse(
+        iter_batch_ndjson(extraction_service, documents),
+        media_type="application/x-ndjson"
+    )
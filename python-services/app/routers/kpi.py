@@ -3,15 +3,19 @@ KPI Router
 API endpoints for KPI calculations
 """
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
 from datetime import date
 from functools import lru_cache
 
 from app.services.kpi_service import KPIService
+from app.services.kpi_cache import KPICache, create_kpi_cache
+from app.services.scurve import iter_ndjson
+from app.serialization import ORJSONResponse
 
 
-router = APIRouter(tags=["kpi"])
+router = APIRouter(tags=["kpi"], default_response_class=ORJSONResponse)
 
 
 # Request models
@@ -22,27 +26,73 @@ class KPIRequest(BaseModel):
     date_to: Optional[date] = None
 
 
+class SCurveRequest(KPIRequest):
+    granularity: Literal["day", "week", "month"] = "month"
+    # Downsample to at most this many points (LTTB); omit for every bucket
+    max_points: Optional[int] = Field(None, ge=3)
+
+
+class KPIScope(BaseModel):
+    organization_id: str
+    project_id: Optional[str] = None
+
+
+class KPIBatchRequest(BaseModel):
+    scopes: List[KPIScope] = Field(..., min_length=1, max_length=500)
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+class RollupRefreshRequest(BaseModel):
+    # Omit to incrementally refresh every organization that already has rollups
+    organization_id: Optional[str] = None
+    full: bool = False
+
+
+class CacheInvalidationRequest(BaseModel):
+    organization_id: str
+    # Entity types written (purchase_order, invoice, milestone, ncr, shipment, supplier);
+    # empty invalidates every KPI category for the organization
+    entity_types: List[str] = []
+
+
 # Lazy-load KPI service (only create when needed)
 @lru_cache()
 def get_kpi_service() -> KPIService:
     return KPIService()
 
 
+@lru_cache()
+def get_kpi_cache() -> KPICache:
+    return create_kpi_cache()
+
+
 @router.post("/dashboard")
-async def get_dashboard_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+async def get_dashboard_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
     """
     Get all dashboard KPIs in one optimized call
     """
     try:
         print(f"[KPI] Dashboard request: org={request.organization_id}, proj={request.project_id}")
-        kpis = await kpi_service.get_dashboard_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
-            date_from=request.date_from,
-            date_to=request.date_to
+        kpis = await kpi_cache.get_or_compute(
+            "dashboard",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_dashboard_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
         print(f"[KPI] Dashboard success")
-        return {"success": True, "data": kpis}
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         import traceback
         print(f"[KPI] Dashboard error: {e}")
@@ -50,106 +100,283 @@ async def get_dashboard_kpis(request: KPIRequest, kpi_service: KPIService = Depe
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/financial")
-async def get_financial_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
-    """Get Financial KPIs"""
+@router.post("/dashboard/batch")
+async def get_dashboard_kpis_batch(request: KPIBatchRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+    """
+    Get dashboard KPIs for many organization/project scopes in one call.
+    Returns a map keyed by "<organization_id>:<project_id>" ("*" for a whole organization).
+    """
     try:
-        kpis = await kpi_service.get_financial_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
+        print(f"[KPI] Dashboard batch request: {len(request.scopes)} scopes")
+        results = await kpi_service.get_dashboard_kpis_batch(
+            scopes=[(scope.organization_id, scope.project_id) for scope in request.scopes],
             date_from=request.date_from,
             date_to=request.date_to
         )
-        return {"success": True, "data": kpis}
+        data = {
+            f"{scope.organization_id}:{scope.project_id or '*'}": kpis
+            for scope, kpis in zip(request.scopes, results)
+        }
+        return ORJSONResponse({"success": True, "data": data})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/financial")
+async def get_financial_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
+    """Get Financial KPIs"""
+    try:
+        kpis = await kpi_cache.get_or_compute(
+            "financial",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_financial_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
+        )
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/progress")
-async def get_progress_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+async def get_progress_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
     """Get Progress KPIs"""
     try:
-        kpis = await kpi_service.get_progress_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
-            date_from=request.date_from,
-            date_to=request.date_to
+        kpis = await kpi_cache.get_or_compute(
+            "progress",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_progress_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
-        return {"success": True, "data": kpis}
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/quality")
-async def get_quality_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+async def get_quality_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
     """Get Quality KPIs"""
     try:
-        kpis = await kpi_service.get_quality_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
-            date_from=request.date_from,
-            date_to=request.date_to
+        kpis = await kpi_cache.get_or_compute(
+            "quality",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_quality_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
-        return {"success": True, "data": kpis}
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/suppliers")
-async def get_supplier_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+async def get_supplier_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
     """Get Supplier KPIs"""
     try:
-        kpis = await kpi_service.get_supplier_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
-            date_from=request.date_from,
-            date_to=request.date_to
+        kpis = await kpi_cache.get_or_compute(
+            "suppliers",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_supplier_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
-        return {"success": True, "data": kpis}
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/payments")
-async def get_payment_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+async def get_payment_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
     """Get Payment KPIs"""
     try:
-        kpis = await kpi_service.get_payment_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
-            date_from=request.date_from,
-            date_to=request.date_to
+        kpis = await kpi_cache.get_or_compute(
+            "payments",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_payment_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
-        return {"success": True, "data": kpis}
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/logistics")
-async def get_logistics_kpis(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+async def get_logistics_kpis(
+    request: KPIRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
     """Get Logistics KPIs"""
     try:
-        kpis = await kpi_service.get_logistics_kpis(
-            organization_id=request.organization_id,
-            project_id=request.project_id,
-            date_from=request.date_from,
-            date_to=request.date_to
+        kpis = await kpi_cache.get_or_compute(
+            "logistics",
+            request.organization_id,
+            request.project_id,
+            request.date_from,
+            request.date_to,
+            lambda: kpi_service.get_logistics_kpis(
+                organization_id=request.organization_id,
+                project_id=request.project_id,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
-        return {"success": True, "data": kpis}
+        return ORJSONResponse({"success": True, "data": kpis})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/scurve")
-async def get_scurve_data(request: KPIRequest, kpi_service: KPIService = Depends(get_kpi_service)):
-    """Get S-Curve data for charts"""
-    try:
-        data = await kpi_service.get_scurve_data(
+async def _get_scurve_points(request: SCurveRequest, kpi_service: KPIService, kpi_cache: KPICache):
+    return await kpi_cache.get_or_compute(
+        "scurve",
+        request.organization_id,
+        request.project_id,
+        request.date_from,
+        request.date_to,
+        lambda: kpi_service.get_scurve_data(
             organization_id=request.organization_id,
             project_id=request.project_id,
             date_from=request.date_from,
-            date_to=request.date_to
-        )
-        return {"success": True, "data": data}
+            date_to=request.date_to,
+            granularity=request.granularity,
+            max_points=request.max_points
+        ),
+        variant=f"{request.granularity}:{request.max_points or ''}"
+    )
+
+
+@router.post("/scurve")
+async def get_scurve_data(
+    request: SCurveRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
+    """Get S-Curve data for charts"""
+    try:
+        data = await _get_scurve_points(request, kpi_service, kpi_cache)
+        return ORJSONResponse({"success": True, "data": data})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/scurve/stream")
+async def stream_scurve_data(
+    request: SCurveRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
+    """Stream S-Curve points as NDJSON, one point per line"""
+    try:
+        data = await _get_scurve_points(request, kpi_service, kpi_cache)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(iter_ndjson(data), media_type="application/x-ndjson")
+
+
+@router.post("/cache/invalidate")
+async def invalidate_kpi_cache(
+    request: CacheInvalidationRequest,
+    kpi_service: KPIService = Depends(get_kpi_service),
+    kpi_cache: KPICache = Depends(get_kpi_cache)
+):
+    """
+    Invalidate cached KPIs for an organization.
+    Called by the Next.js app after PO, invoice, milestone, NCR or shipment writes.
+    Affected rollups are invalidated too, so recomputed KPIs are read live
+    until the next rollup refresh.
+    """
+    try:
+        categories = await kpi_cache.invalidate(request.organization_id, request.entity_types)
+        rollups_invalidated = False
+        if kpi_service.rollups is not None:
+            rollups_invalidated = await kpi_service.rollups.invalidate(request.organization_id, request.entity_types)
+        return ORJSONResponse({
+            "success": True,
+            "data": {"invalidated": categories, "rollupsInvalidated": rollups_invalidated},
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/cache/stats")
+async def get_kpi_cache_stats(kpi_cache: KPICache = Depends(get_kpi_cache)):
+    """KPI cache hit/miss/eviction counters"""
+    return ORJSONResponse({"success": True, "data": kpi_cache.stats()})
+
+
+@router.get("/pool/stats")
+async def get_pool_stats(kpi_service: KPIService = Depends(get_kpi_service)):
+    """Database connection pool occupancy and wait-time metrics"""
+    return ORJSONResponse({"success": True, "data": kpi_service.pool_stats()})
+
+
+@router.post("/rollups/refresh")
+async def refresh_kpi_rollups(request: RollupRefreshRequest, kpi_service: KPIService = Depends(get_kpi_service)):
+    """
+    Build or incrementally refresh the daily KPI rollups.
+    The first refresh for an organization performs a full build.
+    """
+    if kpi_service.rollups is None:
+        raise HTTPException(status_code=400, detail="KPI rollups are disabled (KPI_ROLLUPS_ENABLED)")
+    try:
+        if request.organization_id:
+            data = [await kpi_service.rollups.refresh(request.organization_id, full=request.full)]
+        else:
+            data = await kpi_service.rollups.refresh_all()
+        return ORJSONResponse({"success": True, "data": data})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,77 @@
+"""
+Serialization helpers
+Centralized Decimal/NumPy conversion and orjson-backed JSON responses
+"""
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence
+
+import orjson
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+
+def as_float(value: Any, default: float = 0) -> float:
+    """Decimal/numeric DB value to float, treating NULL and zero alike"""
+    return float(value) if value else default
+
+
+def as_int(value: Any, default: int = 0) -> int:
+    """Count-like DB value to int, treating NULL as the default"""
+    return int(value) if value is not None else default
+
+
+def records_frame(
+    rows: Sequence[Any],
+    columns: List[str],
+    float_columns: Sequence[str] = (),
+    str_columns: Sequence[str] = ()
+) -> pd.DataFrame:
+    """
+    Build a DataFrame from DB rows with numeric columns converted in bulk,
+    so Decimal never reaches per-row code
+    """
+    df = pd.DataFrame.from_records(list(rows), columns=columns)
+    conversions: Dict[str, Any] = {column: float for column in float_columns}
+    conversions.update({column: str for column in str_columns})
+    return df.astype(conversions) if conversions else df
+
+
+def to_records(df: pd.DataFrame, rename: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    """Emit DataFrame rows as plain dicts (native Python scalars)"""
+    if rename:
+        df = df[list(rename)].rename(columns=rename)
+    return df.to_dict("records")
+
+
+def _default(value: Any) -> Any:
+    # orjson handles datetime, date, UUID, dataclasses and numpy natively
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to JSON bytes with orjson"""
+    return orjson.dumps(
+        content,
+        default=_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+def loads(payload: Any) -> Any:
+    return orjson.loads(payload)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson. Returning it directly from a route
+    also skips FastAPI's jsonable_encoder pass over the payload.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
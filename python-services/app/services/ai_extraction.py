@@ -2,21 +2,115 @@
 AI Extraction Service
 Handles OCR (AWS Textract) and GPT parsing for document extraction
 """
-import io
-import re
-import json
+import copy
+import math
 import asyncio
-from typing import Optional, Dict, Any, List
+import time
+from contextlib import aclosing, nullcontext
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from pathlib import Path
 
-import boto3
-import httpx
-from openai import OpenAI
-import pdfplumber
-from docx import Document as DocxDocument
-import openpyxl
-
 from app.config import get_settings
+from app.services import document_parsers
+from app.services.document_buffer import DocumentBuffer
+from app.services.downloader import get_downloader
+from app.services.executors import get_executors
+from app.services.extraction_cache import content_hash, get_extraction_cache
+from app.services.extraction_schemas import LLM_EXCLUDED_FIELDS, LLM_ITEM_PATHS, LLM_RESPONSE_MODELS
+from app.services.json_stream import StreamingJSONParser, TruncatedResponseError, strict_json_schema
+from app.services.llm_client import get_llm_client
+from app.services.shipment_chunking import header_context, merge_shipment_parts, split_shipment_text
+from app.services.text_compaction import compact_text, count_tokens, fit_to_budget
+from app.services.textract import get_textract_engine
+
+
+EXCEL_EXTENSIONS = [".xlsx", ".xls"]
+WORD_EXTENSIONS = [".docx", ".doc"]
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+
+# Bump a document type's version whenever its prompt template changes so
+# cached parse results are recomputed (extracted text stays cached)
+PROMPT_VERSIONS = {
+    "purchase_order": "3",
+    "invoice": "3",
+    "milestone": "3",
+    "shipment": "4",
+}
+
+# Spreadsheets are first parsed from their table structure, without the LLM
+STRUCTURED_PARSER_VERSIONS = {
+    "purchase_order": "table-parser-1",
+    "invoice": "table-parser-1",
+    "milestone": "excel-structure-1",
+    "shipment": "table-parser-1",
+}
+
+# Shipment chunks are not made smaller than this to fit the token budget
+MIN_SHIPMENT_CHUNK_CHARS = 2000
+
+# Results returned when the LLM call or its JSON fails; never cached
+PARSE_FALLBACKS: Dict[str, Any] = {
+    "purchase_order": {
+        "po_number": None,
+        "vendor_name": None,
+        "date": None,
+        "total_value": None,
+        "currency": None,
+        "milestones": [],
+        "boq_items": [],
+        "confidence": 0.0
+    },
+    "invoice": {
+        "invoice_number": None,
+        "vendor_name": None,
+        "total_amount": None,
+        "confidence": 0.0
+    },
+    "milestone": [],
+    "shipment": {
+        "order_number": None,
+        "supplier_name": None,
+        "customer_name": None,
+        "items": [],
+        "confidence": 0.0
+    },
+}
+
+PARSE_ERROR_LABELS = {
+    "purchase_order": "GPT parsing error",
+    "invoice": "GPT invoice parsing error",
+    "milestone": "GPT milestone parsing error",
+    "shipment": "GPT shipment parsing error",
+}
+
+
+class UnsupportedDocumentError(ValueError):
+    """Raised when no text extractor handles a file type"""
+
+
+@dataclass
+class StageLimits:
+    """
+    Per-stage concurrency caps shared by every document in a batch, so
+    downloads, text extraction and LLM parsing overlap across documents
+    """
+    download: asyncio.Semaphore
+    text: asyncio.Semaphore
+    parse: asyncio.Semaphore
+
+
+def _document_hash(document: DocumentBuffer) -> str:
+    """Content hash read through the buffer's mmap, without copying the document"""
+    if document.content_hash:
+        return document.content_hash
+    with document.view() as view:
+        return content_hash(view)
+
+
+def _stage(limits: Optional[StageLimits], name: str) -> Any:
+    """Context manager holding a slot of the named stage (no-op without limits)"""
+    return getattr(limits, name) if limits else nullcontext()
 
 
 class AIExtractionService:
@@ -34,26 +128,42 @@ class AIExtractionService:
     def __init__(self):
         settings = get_settings()
         
-        # AWS Textract client
-        self.textract = boto3.client(
-            "textract",
-            region_name=settings.aws_region,
-            aws_access_key_id=settings.aws_access_key_id,
-            aws_secret_access_key=settings.aws_secret_access_key,
-        )
+        # AWS Textract engine (async jobs, shared job limit)
+        self.textract = get_textract_engine()
         
-        # S3 client for fetching files
-        self.s3 = boto3.client(
-            "s3",
-            region_name=settings.aws_region,
-            aws_access_key_id=settings.aws_access_key_id,
-            aws_secret_access_key=settings.aws_secret_access_key,
-        )
+        # Pooled S3/HTTP clients for fetching files
+        self.downloader = get_downloader()
+        
+        # OpenAI client (async, rate limited and shared across the service)
+        self.llm = get_llm_client()
         
-        # OpenAI client
-        self.openai = OpenAI(api_key=settings.openai_api_key)
+        # Worker pools: blocking boto3 calls go to threads, parsing to processes
+        self.executors = get_executors()
+        
+        # Content-hash cache for extracted text and parsed results
+        self.cache = get_extraction_cache()
         
         self.s3_bucket = settings.aws_s3_bucket
+        self.pdf_pages_per_task = settings.pdf_pages_per_task
+        self.pdf_ocr_enabled = settings.pdf_ocr_enabled
+        self.pdf_ocr_max_pages = settings.pdf_ocr_max_pages
+        self.pdf_ocr_resolution = settings.pdf_ocr_resolution
+        self.shipment_chunk_chars = settings.shipment_chunk_chars
+        self.table_parser_min_confidence = settings.table_parser_min_confidence
+        self.excel_max_rows = settings.excel_max_rows
+        self.excel_sheets = [name for name in settings.excel_sheets.split(",") if name.strip()] or None
+        self.prompt_compaction_enabled = settings.prompt_compaction_enabled
+        self.prompt_token_budgets = {
+            "purchase_order": settings.prompt_token_budget_purchase_order,
+            "invoice": settings.prompt_token_budget_invoice,
+            "milestone": settings.prompt_token_budget_milestone,
+            "shipment": settings.prompt_token_budget_shipment,
+        }
+        # Structured-output schemas the LLM's JSON must follow, per document type
+        self.response_schemas = {
+            document_type: strict_json_schema(model, exclude=LLM_EXCLUDED_FIELDS)
+            for document_type, model in LLM_RESPONSE_MODELS.items()
+        }
     
     # =========================================================================
     # PUBLIC METHODS
@@ -61,212 +171,386 @@ class AIExtractionService:
     
     async def extract_purchase_order(self, file_url: str) -> Dict[str, Any]:
         """Extract structured PO data from a file URL"""
-        try:
-            # Get file extension
-            ext = self._get_extension(file_url)
-            
-            # Extract raw text based on file type
-            if ext in [".xlsx", ".xls"]:
-                raw_text = await self._extract_excel(file_url)
-            elif ext in [".docx", ".doc"]:
-                raw_text = await self._extract_word(file_url)
-            elif ext == ".pdf":
-                raw_text = await self._extract_pdf(file_url)
-            elif ext in [".png", ".jpg", ".jpeg"]:
-                raw_text = await self._extract_image(file_url)
-            else:
-                return {"success": False, "error": f"Unsupported file type: {ext}"}
-            
-            if not raw_text:
-                return {"success": False, "error": "Could not extract text from document"}
-            
-            # Parse with GPT
-            parsed_data = await self._parse_po_with_gpt(raw_text)
-            parsed_data["raw_text"] = raw_text[:5000]  # Include truncated raw text
-            
-            return {"success": True, "data": parsed_data}
-            
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        return await self.extract_from_url(file_url, "purchase_order")
     
     async def extract_invoice(self, file_url: str) -> Dict[str, Any]:
         """Extract structured invoice data from a file URL"""
-        try:
-            ext = self._get_extension(file_url)
-            
-            if ext in [".xlsx", ".xls"]:
-                raw_text = await self._extract_excel(file_url)
-            elif ext in [".docx", ".doc"]:
-                raw_text = await self._extract_word(file_url)
-            elif ext == ".pdf":
-                raw_text = await self._extract_pdf(file_url)
-            elif ext in [".png", ".jpg", ".jpeg"]:
-                raw_text = await self._extract_image(file_url)
-            else:
-                return {"success": False, "error": f"Unsupported file type: {ext}"}
-            
-            if not raw_text:
-                return {"success": False, "error": "Could not extract text from document"}
-            
-            parsed_data = await self._parse_invoice_with_gpt(raw_text)
-            parsed_data["raw_text"] = raw_text[:5000]
-            
-            return {"success": True, "data": parsed_data}
-            
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        return await self.extract_from_url(file_url, "invoice")
     
     async def extract_milestones(self, file_url: str) -> Dict[str, Any]:
         """Extract milestone schedule from a file"""
-        try:
-            ext = self._get_extension(file_url)
-            
-            # Excel is preferred for milestones
-            if ext in [".xlsx", ".xls"]:
-                milestones = await self._extract_milestones_from_excel(file_url)
-            elif ext == ".pdf":
-                raw_text = await self._extract_pdf(file_url)
-                milestones = await self._parse_milestones_with_gpt(raw_text)
-            else:
-                return {"success": False, "error": f"Unsupported file type for milestones: {ext}"}
-            
-            return {"success": True, "data": {"milestones": milestones}}
-            
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        return await self.extract_from_url(file_url, "milestone")
     
     async def extract_shipment(self, file_url: str) -> Dict[str, Any]:
         """
         Extract structured shipment/packing list data from a file URL.
         Optimized for large multi-page documents with parallel page extraction.
         """
-        try:
-            ext = self._get_extension(file_url)
-            
-            if ext == ".pdf":
-                raw_text = await self._extract_pdf_parallel(file_url)
-            elif ext in [".xlsx", ".xls"]:
-                raw_text = await self._extract_excel(file_url)
-            elif ext in [".docx", ".doc"]:
-                raw_text = await self._extract_word(file_url)
-            elif ext in [".png", ".jpg", ".jpeg"]:
-                raw_text = await self._extract_image(file_url)
-            else:
-                return {"success": False, "error": f"Unsupported file type: {ext}"}
-            
-            if not raw_text:
-                return {"success": False, "error": "Could not extract text from document"}
-            
-            parsed_data = await self._parse_shipment_with_gpt(raw_text)
-            parsed_data["raw_text"] = raw_text[:5000]
-            
-            return {"success": True, "data": parsed_data}
-            
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        return await self.extract_from_url(file_url, "shipment")
     
     async def extract_shipment_from_bytes(self, content: bytes, filename: str) -> Dict[str, Any]:
         """
         Extract shipment data from raw file bytes (for direct uploads).
         Uses parallel page extraction for PDFs.
         """
-        try:
-            ext = Path(filename).suffix.lower()
-            
-            if ext == ".pdf":
-                raw_text = self._extract_pdf_pages_from_bytes(content)
-            elif ext in [".xlsx", ".xls"]:
-                raw_text = self._extract_excel_from_bytes(content)
-            elif ext in [".docx", ".doc"]:
-                raw_text = self._extract_word_from_bytes(content)
-            else:
-                return {"success": False, "error": f"Unsupported file type: {ext}"}
-            
-            if not raw_text:
-                return {"success": False, "error": "Could not extract text from document"}
-            
-            parsed_data = await self._parse_shipment_with_gpt(raw_text)
-            parsed_data["raw_text"] = raw_text[:5000]
-            
-            return {"success": True, "data": parsed_data}
-            
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        return await self.extract_from_bytes(content, filename, "shipment")
     
     async def extract_from_bytes(
         self, 
         content: bytes, 
         filename: str, 
-        document_type: str
+        document_type: str,
+        limits: Optional[StageLimits] = None
+    ) -> Dict[str, Any]:
+        """Extract from raw file bytes"""
+        try:
+            document = await self.executors.run_io(DocumentBuffer.from_bytes, content, Path(filename).suffix.lower())
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        try:
+            return await self.extract_from_buffer(document, filename, document_type, limits=limits)
+        finally:
+            document.close()
+    
+    async def extract_from_buffer(
+        self,
+        document: DocumentBuffer,
+        filename: str,
+        document_type: str,
+        limits: Optional[StageLimits] = None
     ) -> Dict[str, Any]:
-        """Extract from raw file bytes (for uploads)"""
+        """Extract from a document buffer (uploads); the caller keeps ownership of the buffer"""
+        if document_type not in PROMPT_VERSIONS:
+            return {"success": False, "error": f"Unknown document type: {document_type}"}
+        
         try:
-            ext = Path(filename).suffix.lower()
+            # Buffers from upload ingest carry the sniffed type as their suffix
+            ext = document.extension or Path(filename).suffix.lower()
+            return await self._run_pipeline(document, ext, document_type, limits=limits)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    async def extract_from_url(
+        self,
+        file_url: str,
+        document_type: str,
+        limits: Optional[StageLimits] = None
+    ) -> Dict[str, Any]:
+        """Fetch a document by URL and run it through the extraction pipeline"""
+        if document_type not in PROMPT_VERSIONS:
+            return {"success": False, "error": f"Unknown document type: {document_type}"}
+        
+        try:
+            ext = self._get_extension(file_url)
             
-            # Extract text based on file type
-            if ext in [".xlsx", ".xls"]:
-                raw_text = self._extract_excel_from_bytes(content)
-            elif ext in [".docx", ".doc"]:
-                raw_text = self._extract_word_from_bytes(content)
-            elif ext == ".pdf":
-                raw_text = self._extract_pdf_from_bytes(content)
-            else:
+            # Excel is preferred for milestones
+            if document_type == "milestone" and ext not in EXCEL_EXTENSIONS and ext != ".pdf":
+                return {"success": False, "error": f"Unsupported file type for milestones: {ext}"}
+            if ext not in EXCEL_EXTENSIONS + WORD_EXTENSIONS + IMAGE_EXTENSIONS + [".pdf"]:
                 return {"success": False, "error": f"Unsupported file type: {ext}"}
             
-            if not raw_text:
-                return {"success": False, "error": "Could not extract text from document"}
+            async with _stage(limits, "download"):
+                document = await self._download_file(file_url)
+            try:
+                result = await self._run_pipeline(document, ext, document_type, file_url=file_url, limits=limits)
+            finally:
+                document.close()
             
-            # Parse based on document type
-            if document_type == "purchase_order":
-                parsed_data = await self._parse_po_with_gpt(raw_text)
-            elif document_type == "invoice":
-                parsed_data = await self._parse_invoice_with_gpt(raw_text)
-            elif document_type == "milestone":
-                milestones = await self._parse_milestones_with_gpt(raw_text)
-                parsed_data = {"milestones": milestones}
-            elif document_type == "shipment":
-                parsed_data = await self._parse_shipment_with_gpt(raw_text)
-            else:
-                return {"success": False, "error": f"Unknown document type: {document_type}"}
-            
-            parsed_data["raw_text"] = raw_text[:5000]
-            return {"success": True, "data": parsed_data}
+            if document_type == "milestone" and result.get("success"):
+                result["data"].pop("raw_text", None)
+            return result
             
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    # =========================================================================
+    # PIPELINE: fetch -> extract text -> parse
+    # =========================================================================
+    
+    async def _run_pipeline(
+        self,
+        document: DocumentBuffer,
+        ext: str,
+        document_type: str,
+        file_url: Optional[str] = None,
+        limits: Optional[StageLimits] = None
+    ) -> Dict[str, Any]:
+        """
+        Extract text and parse it, reusing cached results for identical bytes.
+        A cached parse skips everything; a cached text skips download-side
+        extraction (pdfplumber/Textract) and only re-runs the LLM.
+        """
+        document_hash = await self.executors.run_io(_document_hash, document)
+        
+        # Spreadsheets are read from their table structure first (milestone
+        # schedules only when fetched by URL, uploads always went to GPT)
+        structured = ext in EXCEL_EXTENSIONS and (document_type != "milestone" or file_url is not None)
+        # Extraction and prompt settings are part of the version so a config
+        # change never serves results produced under the old settings
+        prompt_version = (
+            f"{PROMPT_VERSIONS[document_type]}:{self._prompt_settings(document_type)}:{self._text_settings(ext)}"
+        )
+        if structured:
+            prompt_version = (
+                f"{STRUCTURED_PARSER_VERSIONS[document_type]}:min={self.table_parser_min_confidence}/{prompt_version}"
+            )
+        
+        cached = await self.cache.get_parsed(document_hash, document_type, prompt_version, self.llm.model)
+        if cached is not None:
+            print(f"[Extraction Cache] Hit: {document_type} {document_hash[:12]}")
+            return {"success": True, "data": cached}
+        
+        if structured:
+            async with _stage(limits, "text"):
+                data = await self._parse_structured(document, document_type)
+            if data is not None:
+                await self.cache.set_parsed(document_hash, document_type, prompt_version, self.llm.model, data)
+                return {"success": True, "data": data}
+            # No recognisable table (or low confidence), fall back to GPT parsing
+        
+        async with _stage(limits, "text"):
+            raw_text = await self._get_text(document, ext, document_type, document_hash, file_url)
+        if not raw_text:
+            return {"success": False, "error": "Could not extract text from document"}
+        
+        async with _stage(limits, "parse"):
+            parsed, parsed_ok = await self._parse(raw_text, document_type)
+        data = {"milestones": parsed} if document_type == "milestone" else parsed
+        data["raw_text"] = raw_text[:5000]  # Include truncated raw text
+        
+        if parsed_ok:
+            await self.cache.set_parsed(document_hash, document_type, prompt_version, self.llm.model, data)
+        return {"success": True, "data": data}
+    
+    async def _parse_structured(self, document: DocumentBuffer, document_type: str) -> Optional[Dict[str, Any]]:
+        """Parse a spreadsheet from its table layout; None means use the LLM instead"""
+        if document_type == "milestone":
+            try:
+                milestones = await self.executors.run_cpu(
+                    document_parsers.extract_excel_milestones, document.path, self.excel_sheets, self.excel_max_rows
+                )
+            except Exception as e:
+                print(f"Excel milestone extraction error: {e}")
+                return {"milestones": []}
+            return {"milestones": milestones} if milestones is not None else None
+        
+        try:
+            table = await self.executors.run_cpu(
+                document_parsers.extract_excel_table, document.path, document_type, self.excel_sheets, self.excel_max_rows
+            )
+        except Exception as e:
+            print(f"[Table Parser] {document_type} failed: {e}")
+            return None
+        
+        if table is None:
+            return None
+        if table["confidence"] < self.table_parser_min_confidence:
+            print(f"[Table Parser] {document_type}: confidence {table['confidence']} too low, using GPT")
+            return None
+        
+        print(f"[Table Parser] {document_type}: {table['rows']} rows from sheet '{table['sheet']}', confidence {table['confidence']}")
+        return table["data"]
+    
+    async def _get_text(
+        self,
+        document: DocumentBuffer,
+        ext: str,
+        document_type: str,
+        document_hash: str,
+        file_url: Optional[str] = None
+    ) -> Optional[str]:
+        """Text extraction stage, cached per document hash and extractor variant"""
+        # Shipment PDFs keep page markers; only S3-backed files can use whole-document Textract
+        paged = document_type == "shipment"
+        variant = f"{ext}:{'pages' if paged else 'plain'}:{self._text_settings(ext)}:{'s3' if file_url else 'bytes'}"
+        
+        cached = await self.cache.get_text(document_hash, variant)
+        if cached is not None:
+            return cached
+        
+        text, complete = await self._extract_text(document, ext, paged=paged, file_url=file_url)
+        if text and complete:
+            await self.cache.set_text(document_hash, variant, text)
+        return text
+    
+    def _text_settings(self, ext: str) -> str:
+        """Settings that change the text extracted from this file type (cache key part)"""
+        if ext in EXCEL_EXTENSIONS:
+            return f"sheets={','.join(self.excel_sheets or [])};rows={self.excel_max_rows}"
+        if ext == ".pdf":
+            ocr_pages = self.pdf_ocr_max_pages if self.pdf_ocr_enabled else 0
+            return f"ocr={ocr_pages}@{self.pdf_ocr_resolution}"
+        return ""
+    
+    def _prompt_settings(self, document_type: str) -> str:
+        """Settings that change the LLM prompt built for this document type (cache key part)"""
+        settings = f"compact={int(self.prompt_compaction_enabled)};budget={self.prompt_token_budgets[document_type]}"
+        if document_type == "shipment":
+            settings += f";chunk={self.shipment_chunk_chars}"
+        return settings
+    
+    async def _extract_text(
+        self,
+        document: DocumentBuffer,
+        ext: str,
+        paged: bool = False,
+        file_url: Optional[str] = None
+    ) -> Tuple[Optional[str], bool]:
+        """
+        Extract raw text based on file type; returns (text, whether it is
+        complete). Text missing pages whose OCR failed is used but not cached,
+        so the transient failure is retried next time.
+        """
+        if ext in EXCEL_EXTENSIONS:
+            return await self._extract_excel(document), True
+        if ext in WORD_EXTENSIONS:
+            return await self._extract_word(document), True
+        if ext == ".pdf":
+            return await self._extract_pdf(document, file_url=file_url, paged=paged)
+        if ext in IMAGE_EXTENSIONS:
+            return await self._extract_image(document, file_url), True
+        raise UnsupportedDocumentError(f"Unsupported file type: {ext}")
+    
+    async def _parse(self, raw_text: str, document_type: str) -> Tuple[Any, bool]:
+        """
+        LLM parse stage; returns (parsed data, whether parsing succeeded).
+        A reply cut off mid-JSON keeps its complete part, flagged as truncated
+        and not counted as a success (so it is never cached).
+        """
+        parsers = {
+            "purchase_order": self._parse_po_with_gpt,
+            "invoice": self._parse_invoice_with_gpt,
+            "milestone": self._parse_milestones_with_gpt,
+            "shipment": self._parse_shipment_with_gpt,
+        }
+        try:
+            text = await self._compact(raw_text, document_type)
+            parsed = await parsers[document_type](text)
+            return parsed, not (isinstance(parsed, dict) and parsed.get("truncated"))
+        except TruncatedResponseError as e:
+            print(f"{PARSE_ERROR_LABELS[document_type]}: {e}, salvaged {e.items} complete items")
+            return self._salvage(e.partial, document_type), False
+        except Exception as e:
+            print(f"{PARSE_ERROR_LABELS[document_type]}: {e}")
+            return copy.deepcopy(PARSE_FALLBACKS[document_type]), False
+    
+    def _salvage(self, partial: Any, document_type: str) -> Any:
+        """Fallback result filled in with whatever a truncated reply completed"""
+        fallback = copy.deepcopy(PARSE_FALLBACKS[document_type])
+        if document_type == "milestone":
+            milestones = partial.get("milestones") if isinstance(partial, dict) else partial
+            return milestones if isinstance(milestones, list) else fallback
+        if not isinstance(partial, dict):
+            return {**fallback, "truncated": True}
+        return {**fallback, **partial, "truncated": True}
+    
+    async def _compact(self, raw_text: str, document_type: str) -> str:
+        """Prompt compaction stage (process pool); raw_text itself is returned to callers unchanged"""
+        if not self.prompt_compaction_enabled:
+            return raw_text
+        text = await self.executors.run_cpu(compact_text, raw_text)
+        print(f"[Prompt Compaction] {document_type}: {len(raw_text)} -> {len(text)} chars")
+        return text
+    
+    def _fit_prompt_text(self, text: str, document_type: str) -> str:
+        """Document text cut to the document type's token budget"""
+        budget = self.prompt_token_budgets[document_type]
+        fitted = fit_to_budget(text, budget, self.llm.model)
+        if len(fitted) < len(text):
+            print(
+                f"[Prompt Compaction] {document_type}: {count_tokens(text, self.llm.model)} tokens "
+                f"cut to the {budget} token budget"
+            )
+        return fitted
+    
     # =========================================================================
     # TEXT EXTRACTION METHODS
     # =========================================================================
     
-    async def _extract_pdf(self, file_url: str) -> Optional[str]:
+    async def _extract_pdf(
+        self,
+        document: DocumentBuffer,
+        file_url: Optional[str] = None,
+        paged: bool = False
+    ) -> Tuple[Optional[str], bool]:
         """
-        Extract text from PDF.
+        Extract text from PDF; returns (text, whether every OCR'd page succeeded).
         Strategy:
-        1. Try pdfplumber first (fast, works well for native text PDFs)
-        2. If text is too short (<500 chars), fall back to Textract (better for scanned docs)
+        1. pdfplumber on every page in parallel (fast, works well for native text PDFs);
+           each page is classified by its text layer
+        2. Pages with little or no text (scans inside otherwise native PDFs) are
+           rendered and OCR'd with Textract, then merged back in page order
+        3. Fully scanned documents in S3 go to a single async Textract job
+           first, with per-page OCR when that job yields nothing
+        paged=True keeps per-page markers for large shipment documents.
         """
         try:
-            content = await self._download_file(file_url)
-            
-            # Try pdfplumber first
-            text = self._extract_pdf_from_bytes(content)
-            
-            # If pdfplumber got reasonable text, use it
-            if text and len(text.strip()) > 500:
-                print(f"[PDF Extract] pdfplumber succeeded: {len(text)} chars")
-                return text
-            
-            # Fallback to Textract for scanned/image PDFs
-            print(f"[PDF Extract] pdfplumber got {len(text) if text else 0} chars, falling back to Textract")
-            return await self._extract_pdf_with_textract(file_url)
+            pages, total_pages, scanned = await self._read_pdf_pages(document)
+        except Exception as e:
+            print(f"PDF extraction error: {e}")
+            # Unreadable for pdfplumber, Textract may still cope with it
+            return (await self._extract_pdf_with_textract(file_url) if file_url else None), True
+        
+        try:
+            complete = True
+            if scanned and self.pdf_ocr_enabled:
+                if len(scanned) == total_pages and file_url:
+                    print(f"[PDF Extract] No text layer on any of {total_pages} pages, falling back to Textract")
+                    text = await self._extract_pdf_with_textract(file_url)
+                    if text:
+                        return text, True
+                    print("[PDF Extract] Textract job returned no text, OCR'ing pages instead")
+                
+                ocr_pages = scanned[:self.pdf_ocr_max_pages]
+                print(f"[PDF Extract] OCR for {len(ocr_pages)}/{total_pages} pages without a text layer")
+                for page_idx, page_text in (await self._ocr_pdf_pages(document, ocr_pages)).items():
+                    if page_text is None:
+                        complete = False
+                    elif len(page_text) > len(pages.get(page_idx) or ""):
+                        pages[page_idx] = page_text
+            
+            text = self._assemble_pdf_text(pages, total_pages, paged)
+            print(f"[PDF Extract] {len(text)} chars from {total_pages} pages")
+            return text, complete
             
         except Exception as e:
             print(f"PDF extraction error: {e}")
-            return None
+            return None, False
+    
+    async def _ocr_pdf_pages(self, document: DocumentBuffer, page_indices: List[int]) -> Dict[int, Optional[str]]:
+        """
+        Render only the given pages and OCR them with Textract's synchronous
+        API (image bytes, so uploads without an S3 copy work too). Rendering
+        runs in batches on the process pool; each batch is sent to OCR as soon
+        as it is ready. Pages whose OCR failed map to None.
+        """
+        async def ocr_page(page_idx: int, image: bytes) -> Tuple[int, Optional[str]]:
+            try:
+                lines = await self.textract.detect_lines({"Bytes": image})
+                return page_idx, "\n".join(lines)
+            except Exception as e:
+                print(f"[PDF OCR] Page {page_idx + 1} failed: {e}")
+                return page_idx, None
+        
+        render_tasks = [
+            asyncio.ensure_future(self.executors.run_cpu(
+                document_parsers.render_pdf_pages,
+                document.path, page_indices[start:start + self.pdf_pages_per_task], self.pdf_ocr_resolution
+            ))
+            for start in range(0, len(page_indices), self.pdf_pages_per_task)
+        ]
+        ocr_tasks = []
+        try:
+            for rendered in asyncio.as_completed(render_tasks):
+                for page_idx, image in await rendered:
+                    ocr_tasks.append(asyncio.ensure_future(ocr_page(page_idx, image)))
+            return dict(await asyncio.gather(*ocr_tasks))
+        finally:
+            for task in render_tasks + ocr_tasks:
+                task.cancel()
     
     async def _extract_pdf_with_textract(self, file_url: str) -> Optional[str]:
-        """Extract text from PDF using AWS Textract async API"""
+        """Extract text from PDF using the AWS Textract async API"""
         try:
             from urllib.parse import urlparse
             parsed = urlparse(file_url)
@@ -276,196 +560,96 @@ class AIExtractionService:
             bucket = hostname_parts[0]
             s3_key = parsed.path.lstrip("/")
             
-            print(f"[Textract] Starting async extraction: {bucket}/{s3_key}")
-            
-            # Start async job
-            start_response = self.textract.start_document_text_detection(
-                DocumentLocation={
-                    "S3Object": {
-                        "Bucket": bucket,
-                        "Name": s3_key
-                    }
-                }
-            )
-            
-            job_id = start_response["JobId"]
-            print(f"[Textract] Job started: {job_id}")
-            
-            # Poll for completion (max 2 minutes)
-            max_attempts = 60
-            for attempt in range(max_attempts):
-                await asyncio.sleep(2)  # Wait 2 seconds between polls
-                
-                get_response = self.textract.get_document_text_detection(JobId=job_id)
-                status = get_response["JobStatus"]
-                
-                if status == "SUCCEEDED":
-                    # Collect all text blocks
-                    all_blocks = get_response.get("Blocks", [])
-                    
-                    # Handle pagination
-                    next_token = get_response.get("NextToken")
-                    while next_token:
-                        page_response = self.textract.get_document_text_detection(
-                            JobId=job_id, NextToken=next_token
-                        )
-                        all_blocks.extend(page_response.get("Blocks", []))
-                        next_token = page_response.get("NextToken")
-                    
-                    # Extract lines of text
-                    lines = [
-                        block["Text"]
-                        for block in all_blocks
-                        if block["BlockType"] == "LINE"
-                    ]
-                    
-                    text = "\n".join(lines)
-                    print(f"[Textract] Extracted {len(text)} chars from {len(all_blocks)} blocks")
-                    return text
-                    
-                elif status == "FAILED":
-                    print("[Textract] Job failed")
-                    return None
-                    
-                if attempt % 10 == 0:
-                    print(f"[Textract] Still processing... ({attempt * 2}s elapsed)")
-            
-            print("[Textract] Job timed out")
-            return None
+            text = await self.textract.extract_text(bucket, s3_key)
+            if text:
+                print(f"[Textract] Extracted {len(text)} chars")
+            return text
             
         except Exception as e:
             print(f"[Textract] Error: {e}")
             return None
     
-    def _extract_pdf_from_bytes(self, content: bytes) -> Optional[str]:
-        """Extract text from PDF bytes using pdfplumber"""
-        try:
-            with pdfplumber.open(io.BytesIO(content)) as pdf:
-                text_parts = []
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(page_text)
-                return "\n\n".join(text_parts)
-        except Exception as e:
-            print(f"PDF bytes extraction error: {e}")
-            return None
-    
-    def _extract_pdf_pages_from_bytes(self, content: bytes) -> Optional[str]:
+    async def _iter_pdf_pages(self, document: DocumentBuffer) -> AsyncIterator[Tuple[int, int, Optional[str], bool]]:
         """
-        Extract text from PDF bytes page-by-page.
-        Optimized for large shipment documents (15-20+ pages).
-        Returns combined text from all pages with page markers.
+        Extract PDF pages in parallel on the process pool.
+        Page ranges are split across workers and each (page index, total pages,
+        text, needs OCR) is yielded as soon as its range finishes, so pages
+        arrive out of order.
         """
+        total_pages = await self.executors.run_cpu(document_parsers.count_pdf_pages, document.path)
+        
+        # Small ranges stream back sooner; cap the task count at 2x the workers
+        # so one large document can't fill the whole pool queue
+        pages_per_task = max(
+            self.pdf_pages_per_task,
+            math.ceil(total_pages / (self.executors.cpu.workers * 2))
+        )
+        tasks = [
+            asyncio.ensure_future(self.executors.run_cpu(
+                document_parsers.extract_pdf_page_range,
+                document.path, start, min(start + pages_per_task, total_pages)
+            ))
+            for start in range(0, total_pages, pages_per_task)
+        ]
         try:
-            with pdfplumber.open(io.BytesIO(content)) as pdf:
-                total_pages = len(pdf.pages)
-                print(f"[PDF Pages] Extracting {total_pages} pages")
-                
-                text_parts = []
-                for idx, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(f"--- Page {idx + 1}/{total_pages} ---\n{page_text}")
-                
-                combined = "\n\n".join(text_parts)
-                print(f"[PDF Pages] Extracted {len(combined)} chars from {total_pages} pages")
-                return combined
-        except Exception as e:
-            print(f"PDF pages extraction error: {e}")
-            return None
+            for finished in asyncio.as_completed(tasks):
+                for page_idx, page_text, needs_ocr in await finished:
+                    yield page_idx, total_pages, page_text, needs_ocr
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _read_pdf_pages(self, document: DocumentBuffer) -> Tuple[Dict[int, Optional[str]], int, List[int]]:
+        """Text of every page, the page count and the (sorted) pages that need OCR"""
+        pages: Dict[int, Optional[str]] = {}
+        scanned = []
+        total_pages = 0
+        async for page_idx, total_pages, page_text, needs_ocr in self._iter_pdf_pages(document):
+            pages[page_idx] = page_text
+            if needs_ocr:
+                scanned.append(page_idx)
+        return pages, total_pages, sorted(scanned)
     
-    async def _extract_pdf_parallel(self, file_url: str) -> Optional[str]:
+    @staticmethod
+    def _assemble_pdf_text(pages: Dict[int, Optional[str]], total_pages: int, paged: bool = False) -> str:
         """
-        Extract text from a PDF with parallel page processing.
-        Strategy:
-        1. Download PDF bytes
-        2. Extract text page-by-page with page markers
-        3. If pdfplumber yields < 500 chars, fall back to Textract
+        Join page texts in page order. paged=True adds page markers, used for
+        large shipment documents (15-20+ pages) so the parser can split them.
         """
-        try:
-            content = await self._download_file(file_url)
-            text = self._extract_pdf_pages_from_bytes(content)
-            
-            if text and len(text.strip()) > 500:
-                print(f"[PDF Parallel] pdfplumber succeeded: {len(text)} chars")
-                return text
-            
-            print(f"[PDF Parallel] pdfplumber got {len(text) if text else 0} chars, falling back to Textract")
-            return await self._extract_pdf_with_textract(file_url)
-            
-        except Exception as e:
-            print(f"PDF parallel extraction error: {e}")
-            return None
-    
-    async def _extract_word(self, file_url: str) -> Optional[str]:
-        """Extract text from Word document"""
-        try:
-            content = await self._download_file(file_url)
-            return self._extract_word_from_bytes(content)
-        except Exception as e:
-            print(f"Word extraction error: {e}")
-            return None
-    
-    def _extract_word_from_bytes(self, content: bytes) -> Optional[str]:
-        """Extract text from Word document bytes"""
-        try:
-            doc = DocxDocument(io.BytesIO(content))
-            paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-            return "\n".join(paragraphs)
-        except Exception as e:
-            print(f"Word bytes extraction error: {e}")
-            return None
+        if paged:
+            return "\n\n".join(
+                f"--- Page {idx + 1}/{total_pages} ---\n{pages[idx]}"
+                for idx in sorted(pages)
+                if pages[idx]
+            )
+        return "\n\n".join(pages[idx] for idx in sorted(pages) if pages[idx])
     
-    async def _extract_excel(self, file_url: str) -> Optional[str]:
-        """Extract text from Excel file"""
-        try:
-            content = await self._download_file(file_url)
-            return self._extract_excel_from_bytes(content)
-        except Exception as e:
-            print(f"Excel extraction error: {e}")
-            return None
+    async def _extract_word(self, document: DocumentBuffer) -> Optional[str]:
+        """Extract text from a Word document (in the process pool)"""
+        return await self.executors.run_cpu(document_parsers.extract_word_text, document.path)
     
-    def _extract_excel_from_bytes(self, content: bytes) -> Optional[str]:
-        """Extract text from Excel bytes"""
-        try:
-            wb = openpyxl.load_workbook(io.BytesIO(content), data_only=True)
-            text_parts = []
-            
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                text_parts.append(f"=== Sheet: {sheet_name} ===")
-                
-                for row in sheet.iter_rows():
-                    row_values = [str(cell.value) if cell.value else "" for cell in row]
-                    if any(row_values):
-                        text_parts.append(" | ".join(row_values))
-            
-            return "\n".join(text_parts)
-        except Exception as e:
-            print(f"Excel bytes extraction error: {e}")
-            return None
+    async def _extract_excel(self, document: DocumentBuffer) -> Optional[str]:
+        """Extract text from an Excel workbook (in the process pool)"""
+        return await self.executors.run_cpu(
+            document_parsers.extract_excel_text, document.path, self.excel_sheets, self.excel_max_rows
+        )
     
-    async def _extract_image(self, file_url: str) -> Optional[str]:
-        """Extract text from image using AWS Textract"""
+    async def _extract_image(self, document: DocumentBuffer, file_url: Optional[str] = None) -> Optional[str]:
+        """Extract text from image using AWS Textract (from S3, or the image bytes for uploads)"""
         try:
-            # Parse S3 key from URL
-            s3_key = self._parse_s3_key(file_url)
-            
-            response = self.textract.detect_document_text(
-                Document={
+            if file_url:
+                # Parse S3 key from URL
+                s3_key = self._parse_s3_key(file_url)
+                textract_document = {
                     "S3Object": {
                         "Bucket": self.s3_bucket,
                         "Name": s3_key
                     }
                 }
-            )
+            else:
+                textract_document = {"Bytes": await self.executors.run_io(document.read)}
             
-            # Extract text blocks
-            lines = []
-            for block in response.get("Blocks", []):
-                if block["BlockType"] == "LINE":
-                    lines.append(block.get("Text", ""))
+            lines = await self.textract.detect_lines(textract_document)
             
             return "\n".join(lines)
             
@@ -477,9 +661,45 @@ class AIExtractionService:
     # GPT PARSING METHODS
     # =========================================================================
     
+    async def _chat_json(self, system_prompt: str, prompt: str, max_tokens: int, document_type: str) -> Any:
+        """
+        Stream a schema-constrained JSON completion, parsing it as it arrives.
+        Raises TruncatedResponseError (carrying the complete part) when the
+        reply stops before its JSON does.
+        """
+        started = time.monotonic()
+        first_item_at: List[float] = []
+        
+        def on_item(path: Tuple[str, ...], item: Any) -> None:
+            if not first_item_at:
+                first_item_at.append(time.monotonic() - started)
+        
+        parser = StreamingJSONParser(item_paths=LLM_ITEM_PATHS[document_type], on_item=on_item)
+        # aclosing: a parser error mid-stream releases the LLM slot and connection right away
+        async with aclosing(self.llm.stream_json(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            schema_name=f"{document_type}_extraction",
+            schema=self.response_schemas[document_type],
+        )) as deltas:
+            async for delta in deltas:
+                parser.feed(delta)
+        
+        if first_item_at:
+            print(
+                f"[LLM Stream] {document_type}: first of {parser.items} items after "
+                f"{first_item_at[0] * 1000:.0f} ms, complete after {(time.monotonic() - started) * 1000:.0f} ms"
+            )
+        return parser.result()
+    
     async def _parse_po_with_gpt(self, raw_text: str) -> Dict[str, Any]:
         """Parse raw text into structured PO data using GPT-4"""
         
+        fitted_text = self._fit_prompt_text(raw_text, "purchase_order")
+        
         prompt = f"""Analyze this Purchase Order document and extract structured data.
 Return a JSON object with these fields (use null for missing values):
 
@@ -515,43 +735,21 @@ Return a JSON object with these fields (use null for missing values):
 }}
 
 Document text:
-{raw_text[:15000]}
+{fitted_text}
 """
         
-        try:
-            response = self.openai.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are a document extraction assistant. Always respond with valid JSON only. No explanations or markdown."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=4000,
-            )
-            
-            content = response.choices[0].message.content
-            # Clean markdown code blocks if present
-            content = re.sub(r'^```json\s*', '', content)
-            content = re.sub(r'\s*```$', '', content)
-            
-            return json.loads(content)
-            
-        except Exception as e:
-            print(f"GPT parsing error: {e}")
-            return {
-                "po_number": None,
-                "vendor_name": None,
-                "date": None,
-                "total_value": None,
-                "currency": None,
-                "milestones": [],
-                "boq_items": [],
-                "confidence": 0.0
-            }
+        return await self._chat_json(
+            "You are a document extraction assistant. Always respond with valid JSON only. No explanations or markdown.",
+            prompt,
+            max_tokens=4000,
+            document_type="purchase_order",
+        )
     
     async def _parse_invoice_with_gpt(self, raw_text: str) -> Dict[str, Any]:
         """Parse raw text into structured invoice data"""
         
+        fitted_text = self._fit_prompt_text(raw_text, "invoice")
+        
         prompt = f"""Analyze this Invoice document and extract structured data.
 Return a JSON object with these fields (use null for missing values):
 
@@ -576,82 +774,120 @@ Return a JSON object with these fields (use null for missing values):
 }}
 
 Document text:
-{raw_text[:15000]}
+{fitted_text}
 """
         
-        try:
-            response = self.openai.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are a document extraction assistant. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=4000,
-            )
-            
-            content = response.choices[0].message.content
-            content = re.sub(r'^```json\s*', '', content)
-            content = re.sub(r'\s*```$', '', content)
-            
-            return json.loads(content)
-            
-        except Exception as e:
-            print(f"GPT invoice parsing error: {e}")
-            return {
-                "invoice_number": None,
-                "vendor_name": None,
-                "total_amount": None,
-                "confidence": 0.0
-            }
+        return await self._chat_json(
+            "You are a document extraction assistant. Always respond with valid JSON only.",
+            prompt,
+            max_tokens=4000,
+            document_type="invoice",
+        )
     
     async def _parse_milestones_with_gpt(self, raw_text: str) -> List[Dict[str, Any]]:
         """Parse raw text into milestone list"""
         
+        fitted_text = self._fit_prompt_text(raw_text, "milestone")
+        
         prompt = f"""Extract payment milestones from this document.
-Return a JSON array of milestones:
+Return a JSON object with the list of milestones:
 
-[
-    {{
-        "title": "string",
-        "description": "string or null",
-        "expected_date": "YYYY-MM-DD or null",
-        "payment_percentage": number (should sum to 100)
-    }}
-]
+{{
+    "milestones": [
+        {{
+            "title": "string",
+            "description": "string or null",
+            "expected_date": "YYYY-MM-DD or null",
+            "payment_percentage": number (should sum to 100)
+        }}
+    ]
+}}
 
 Document text:
-{raw_text[:15000]}
+{fitted_text}
 """
         
-        try:
-            response = self.openai.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are a document extraction assistant. Always respond with valid JSON array only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=2000,
-            )
-            
-            content = response.choices[0].message.content
-            content = re.sub(r'^```json\s*', '', content)
-            content = re.sub(r'\s*```$', '', content)
-            
-            return json.loads(content)
-            
-        except Exception as e:
-            print(f"GPT milestone parsing error: {e}")
-            return []
+        parsed = await self._chat_json(
+            "You are a document extraction assistant. Always respond with valid JSON only.",
+            prompt,
+            max_tokens=2000,
+            document_type="milestone",
+        )
+        # JSON mode without a schema may still answer with the bare array
+        return parsed if isinstance(parsed, list) else parsed.get("milestones") or []
     
     async def _parse_shipment_with_gpt(self, raw_text: str) -> Dict[str, Any]:
         """
         Parse raw text from a packing list / commercial invoice into structured
         shipment data using GPT-4. Handles multilingual docs (Swedish, English, etc.).
+        Long documents are split at page/article boundaries, parsed concurrently
+        and merged, so nothing past the single-call limit is dropped.
+        Whether to chunk is decided by the text's token count against the
+        shipment prompt budget, so no single call has to cut its text.
         """
-        # Use up to 30k chars for large shipment docs
-        truncated_text = raw_text[:30000]
+        budget = self.prompt_token_budgets["shipment"]
+        if count_tokens(raw_text, self.llm.model) <= budget:
+            return await self._parse_shipment_chunk(raw_text)
+        
+        chunks = self._shipment_chunks(raw_text, budget)
+        context = header_context(raw_text)
+        print(f"[Shipment Parse] {len(raw_text)} chars in {len(chunks)} chunks")
+        
+        results = await asyncio.gather(*[
+            self._parse_shipment_chunk(chunk, context=context, part=(idx + 1, len(chunks)))
+            for idx, chunk in enumerate(chunks)
+        ], return_exceptions=True)
+        parts = [result for result in results if not isinstance(result, BaseException)]
+        failures = [result for result in results if isinstance(result, BaseException)]
+        if not parts:
+            raise failures[0]
+        
+        merged = merge_shipment_parts(parts)
+        if failures:
+            # Keep the chunks that parsed (and were paid for); the failed ones' items are missing
+            print(f"[Shipment Parse] {len(failures)}/{len(chunks)} chunks failed: {failures[0]}")
+            merged["chunks"] = len(chunks)
+            merged["failed_chunks"] = len(failures)
+            merged["truncated"] = True
+            merged["confidence"] = min(merged["confidence"], 0.5)
+        return merged
+    
+    def _shipment_chunks(self, raw_text: str, budget: int) -> List[str]:
+        """Chunks of at most shipment_chunk_chars, made smaller until each fits the token budget"""
+        max_chars = self.shipment_chunk_chars
+        while True:
+            chunks = split_shipment_text(raw_text, max_chars)
+            if max_chars <= MIN_SHIPMENT_CHUNK_CHARS or all(
+                count_tokens(chunk, self.llm.model) <= budget for chunk in chunks
+            ):
+                return chunks
+            max_chars = max(MIN_SHIPMENT_CHUNK_CHARS, max_chars // 2)
+    
+    async def _parse_shipment_chunk(
+        self,
+        text: str,
+        context: Optional[str] = None,
+        part: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Single shipment parse call; `part` and `context` are set for chunks of a long document.
+        Text that still had to be cut to the token budget flags the result as truncated.
+        """
+        fitted = self._fit_prompt_text(text, "shipment")
+        text_cut = len(fitted) < len(text)
+        text = fitted
+        if part:
+            document_text = f"""This is part {part[0]} of {part[1]} of a longer document.
+The document header is repeated for context: use it for the header fields, but
+extract items and packages ONLY from the part text.
+
+Document header (context only):
+{context}
+
+Part text:
+{text}"""
+        else:
+            document_text = f"Document text:\n{text}"
         
         prompt = f"""You are analyzing a shipping/packing list document (may be in any language including Swedish, German, Finnish, English).
 Extract ALL structured data and return a JSON object.
@@ -706,123 +942,42 @@ Return this exact JSON structure:
     "confidence": number between 0 and 1
 }}
 
-Document text:
-{truncated_text}
+{document_text}
 """
         
         try:
-            response = self.openai.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a logistics document extraction specialist. "
-                            "You handle multilingual documents (Swedish, German, Finnish, English). "
-                            "Always respond with valid JSON only. No explanations or markdown. "
-                            "Extract as many items and packages as possible from the document."
-                        )
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
+            parsed = await self._chat_json(
+                (
+                    "You are a logistics document extraction specialist. "
+                    "You handle multilingual documents (Swedish, German, Finnish, English). "
+                    "Always respond with valid JSON only. No explanations or markdown. "
+                    "Extract as many items and packages as possible from the document."
+                ),
+                prompt,
                 max_tokens=4000,  # Stay within model's 4096 completion token limit
+                document_type="shipment",
             )
-            
-            content = response.choices[0].message.content
-            content = re.sub(r'^```json\s*', '', content)
-            content = re.sub(r'\s*```$', '', content)
-            
-            return json.loads(content)
-            
-        except Exception as e:
-            print(f"GPT shipment parsing error: {e}")
-            return {
-                "order_number": None,
-                "supplier_name": None,
-                "customer_name": None,
-                "items": [],
-                "confidence": 0.0
-            }
-    
-    async def _extract_milestones_from_excel(self, file_url: str) -> List[Dict[str, Any]]:
-        """
-        Extract milestones directly from Excel structure
-        Looks for common patterns in milestone schedules
-        """
-        try:
-            content = await self._download_file(file_url)
-            wb = openpyxl.load_workbook(io.BytesIO(content), data_only=True)
-            
-            milestones = []
-            sheet = wb.active
-            
-            # Find header row
-            header_row = None
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=1, max_row=10)):
-                values = [str(cell.value).lower() if cell.value else "" for cell in row]
-                if any("milestone" in v or "payment" in v or "description" in v for v in values):
-                    header_row = row_idx + 1
-                    break
-            
-            if not header_row:
-                # Fall back to GPT parsing
-                raw_text = self._extract_excel_from_bytes(content)
-                return await self._parse_milestones_with_gpt(raw_text)
-            
-            # Parse data rows
-            for row in sheet.iter_rows(min_row=header_row + 1):
-                values = [cell.value for cell in row]
-                
-                # Skip empty rows
-                if not any(values):
-                    continue
-                
-                # Try to extract milestone data (flexible column mapping)
-                milestone = {}
-                for idx, val in enumerate(values):
-                    if val is None:
-                        continue
-                    val_str = str(val).strip()
-                    
-                    # Title (first text column)
-                    if not milestone.get("title") and isinstance(val, str) and len(val) > 3:
-                        milestone["title"] = val_str
-                    # Percentage (number between 0-100)
-                    elif isinstance(val, (int, float)) and 0 < val <= 100:
-                        if "payment_percentage" not in milestone:
-                            milestone["payment_percentage"] = float(val)
-                    # Date
-                    elif hasattr(val, "strftime"):
-                        if "expected_date" not in milestone:
-                            milestone["expected_date"] = val.strftime("%Y-%m-%d")
-                
-                if milestone.get("title") and milestone.get("payment_percentage"):
-                    milestones.append({
-                        "title": milestone.get("title", ""),
-                        "description": None,
-                        "expected_date": milestone.get("expected_date"),
-                        "payment_percentage": milestone.get("payment_percentage", 0)
-                    })
-            
-            return milestones
-            
-        except Exception as e:
-            print(f"Excel milestone extraction error: {e}")
-            return []
-    
-    # =========================================================================
-    # HELPER METHODS
-    # =========================================================================
+        except TruncatedResponseError as e:
+            # Keep the items completed before the cut; the merged result is flagged
+            label = f"part {part[0]}/{part[1]}" if part else "document"
+            print(f"[Shipment Parse] {label} truncated, salvaged {e.items} complete items")
+            parsed = self._salvage(e.partial, "shipment")
+        
+        if text_cut:
+            # Items past the cut were never sent to the LLM
+            confidence = parsed.get("confidence")
+            parsed["confidence"] = min(confidence, 0.5) if isinstance(confidence, (int, float)) else 0.0
+            parsed["truncated"] = True
+        return parsed
     
-    async def _download_file(self, file_url: str) -> bytes:
-        """Download file from URL (S3 or direct HTTP)"""
+    async def _download_file(self, file_url: str) -> DocumentBuffer:
+        """Download file from URL (S3 or direct HTTP) into a document buffer"""
+        ext = self._get_extension(file_url)
         # Check if it's an S3 URL (either s3:// or https://*.s3.*.amazonaws.com)
         if file_url.startswith("s3://"):
             # Parse S3 URL: s3://bucket/key
             s3_key = self._parse_s3_key(file_url)
-            response = self.s3.get_object(Bucket=self.s3_bucket, Key=s3_key)
-            return response["Body"].read()
+            return await self.downloader.download_s3(self.s3_bucket, s3_key, ext)
         elif "s3." in file_url and "amazonaws.com" in file_url:
             # HTTPS S3 URL: https://bucket.s3.region.amazonaws.com/key
             # Extract bucket and key from URL
@@ -838,14 +993,10 @@ Document text:
             
             print(f"[S3 Download] Bucket: {bucket}, Key: {s3_key}")
             
-            response = self.s3.get_object(Bucket=bucket, Key=s3_key)
-            return response["Body"].read()
+            return await self.downloader.download_s3(bucket, s3_key, ext)
         else:
             # Regular HTTP download (for presigned URLs or external files)
-            async with httpx.AsyncClient() as client:
-                response = await client.get(file_url)
-                response.raise_for_status()
-                return response.content
+            return await self.downloader.download_http(file_url, ext)
     
     def _get_extension(self, file_url: str) -> str:
         """Get file extension from URL"""
@@ -0,0 +1,147 @@
+"""
+Document Buffer
+One copy of a document per extraction: the bytes live in a temp file that
+parser processes open by path, and in-process readers (hashing, sniffing)
+see it through a read-only mmap instead of a bytes copy
+"""
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional, BinaryIO
+
+from app.config import get_settings
+
+
+# Copy size when filling a buffer from a file-like object (uploads)
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class DocumentBuffer:
+    """
+    Temp-file backed document
+
+    - created empty and filled with write_at()/write() (downloads write ranged
+      parts straight into it), or from bytes / a stream / an existing file
+    - `path` is what crosses process boundaries: workers open the file
+      themselves, so nothing is pickled
+    - view() maps the file read-only; close() unmaps it and deletes the file
+      unless the buffer only borrows it (open_path)
+    """
+
+    def __init__(self, path: str, owned: bool = True):
+        self.path = path
+        self.owned = owned
+        self.size = os.path.getsize(path)
+        # SHA-256, when it was computed while the buffer was filled (uploads)
+        self.content_hash: Optional[str] = None
+        self._file: Optional[BinaryIO] = None
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, suffix: str = "") -> "DocumentBuffer":
+        """Empty buffer open for writing; keep the document's extension in `suffix` (openpyxl checks it)"""
+        directory = get_settings().document_buffer_dir or None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="document-", suffix=suffix, dir=directory)
+        buffer = cls(path)
+        buffer._file = os.fdopen(fd, "r+b")
+        return buffer
+
+    @classmethod
+    def from_bytes(cls, content: bytes, suffix: str = "") -> "DocumentBuffer":
+        buffer = cls.create(suffix)
+        try:
+            buffer.write(content)
+            return buffer.seal()
+        except BaseException:
+            buffer.close()
+            raise
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, suffix: str = "") -> "DocumentBuffer":
+        """Copy a file-like object (e.g. an upload's spooled file) in chunks"""
+        buffer = cls.create(suffix)
+        try:
+            shutil.copyfileobj(stream, buffer._file, COPY_CHUNK_BYTES)
+            return buffer.seal()
+        except BaseException:
+            buffer.close()
+            raise
+
+    @classmethod
+    def open_path(cls, path: str) -> "DocumentBuffer":
+        """Borrow an existing file; close() leaves it in place"""
+        return cls(path, owned=False)
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.path)[1].lower()
+
+    def write(self, data: bytes) -> None:
+        self.write_at(self.size, data)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        """Write at an offset; safe from several threads (ranged parts arrive out of order)"""
+        with self._lock:
+            self._file.seek(offset)
+            self._file.write(data)
+            self.size = max(self.size, offset + len(data))
+
+    def seal(self) -> "DocumentBuffer":
+        """Finish writing; the buffer is read-only from here on"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self
+
+    def view(self) -> memoryview:
+        """Read-only zero-copy view of the contents (release it before close())"""
+        if self.size == 0:
+            return memoryview(b"")
+        if self._map is None:
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)
+
+    def read(self) -> bytes:
+        """Copy of the contents, for callers that need real bytes"""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def persist(self, path: str) -> None:
+        """Move the file to `path` (a rename on the same filesystem) and stop owning it"""
+        self.seal()
+        shutil.move(self.path, path)
+        self.path = path
+        self.owned = False
+
+    def rename_suffix(self, suffix: str) -> None:
+        """Change the file's extension once the real document type is known"""
+        path = os.path.splitext(self.path)[0] + suffix
+        os.replace(self.path, path)
+        self.path = path
+
+    def close(self) -> None:
+        self.seal()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A view is still exported; the map is freed with it
+                pass
+            self._map = None
+        if self.owned:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> "DocumentBuffer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
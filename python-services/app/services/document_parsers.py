@@ -0,0 +1,254 @@
+"""
+Document Parsers
+CPU-bound text extraction, kept at module level so it can run in worker processes.
+Documents are passed as a file path (a DocumentBuffer's temp file, opened by
+each worker) or, for small in-process callers, as bytes.
+"""
+import io
+from itertools import islice
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Union, BinaryIO
+
+import pdfplumber
+from docx import Document as DocxDocument
+import openpyxl
+
+from app.services import table_parser
+
+
+# Pages with fewer characters than this have no usable text layer
+OCR_MIN_PAGE_CHARS = 50
+# Pages mostly covered by images with only a little text (stamps, page headers) are scans too
+OCR_IMAGE_COVERAGE = 0.5
+OCR_SPARSE_PAGE_CHARS = 300
+
+DocumentSource = Union[str, bytes]
+
+
+def _open_source(source: DocumentSource) -> Union[str, BinaryIO]:
+    """Paths are opened by the parser library itself, which reads only what it needs"""
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def count_pdf_pages(source: DocumentSource) -> int:
+    """Number of pages in a PDF (parses the page tree only)"""
+    with pdfplumber.open(_open_source(source)) as pdf:
+        return len(pdf.pages)
+
+
+def page_needs_ocr(text: Optional[str], image_coverage: float) -> bool:
+    """Classify a page as scanned from its text layer and how much of it is images"""
+    chars = len((text or "").strip())
+    if chars < OCR_MIN_PAGE_CHARS:
+        return True
+    return image_coverage >= OCR_IMAGE_COVERAGE and chars < OCR_SPARSE_PAGE_CHARS
+
+
+def _image_coverage(page: Any) -> float:
+    page_area = float(page.width * page.height)
+    if not page_area:
+        return 0.0
+    covered = sum(
+        max(0.0, image["x1"] - image["x0"]) * max(0.0, image["bottom"] - image["top"])
+        for image in page.images
+    )
+    return min(1.0, covered / page_area)
+
+
+def extract_pdf_page_range(source: DocumentSource, start: int, end: int) -> List[Tuple[int, Optional[str], bool]]:
+    """
+    Extract text for pages [start, end) of a PDF.
+    Each worker opens the document itself; returns (page index, text,
+    needs OCR) for every page.
+    """
+    results = []
+    with pdfplumber.open(_open_source(source), pages=list(range(start + 1, end + 1))) as pdf:
+        for offset, page in enumerate(pdf.pages):
+            text = page.extract_text()
+            results.append((start + offset, text, page_needs_ocr(text, _image_coverage(page))))
+            # Drop the parsed layout objects as we go, large pages hold a lot of them
+            page.close()
+    return results
+
+
+def render_pdf_pages(source: DocumentSource, page_indices: List[int], resolution: int = 200) -> List[Tuple[int, bytes]]:
+    """Render selected pages (0-based) to grayscale PNG for OCR"""
+    rendered = []
+    with pdfplumber.open(_open_source(source), pages=[idx + 1 for idx in page_indices]) as pdf:
+        for idx, page in zip(page_indices, pdf.pages):
+            image = page.to_image(resolution=resolution).original.convert("L")
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+            rendered.append((idx, buffer.getvalue()))
+            page.close()
+    return rendered
+
+
+def extract_word_text(source: DocumentSource) -> Optional[str]:
+    """Extract text from a Word document"""
+    try:
+        doc = DocxDocument(_open_source(source))
+        paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+        return "\n".join(paragraphs)
+    except Exception as e:
+        print(f"Word bytes extraction error: {e}")
+        return None
+
+
+def open_workbook(source: DocumentSource) -> Any:
+    """
+    Open a workbook in read-only mode: rows are streamed from the sheet XML
+    instead of building the full cell model, so memory stays flat on 50k+ row
+    sheets. Callers must close() it.
+    """
+    return openpyxl.load_workbook(_open_source(source), read_only=True, data_only=True)
+
+
+def iter_sheets(wb: Any, sheets: Optional[List[str]] = None) -> Iterator[Tuple[str, Any]]:
+    """(name, worksheet) pairs in workbook order, limited to `sheets` (case-insensitive) when given"""
+    wanted = {name.strip().lower() for name in sheets} if sheets else None
+    for sheet_name in wb.sheetnames:
+        if wanted is None or sheet_name.lower() in wanted:
+            yield sheet_name, wb[sheet_name]
+
+
+def iter_rows(sheet: Any, max_rows: Optional[int] = None) -> Iterator[Tuple[Any, ...]]:
+    """Row values of a sheet, stopping after max_rows (None or 0 = no limit)"""
+    rows = sheet.iter_rows(values_only=True)
+    return islice(rows, max_rows) if max_rows else rows
+
+
+def extract_excel_text(
+    source: DocumentSource,
+    sheets: Optional[List[str]] = None,
+    max_rows: Optional[int] = None
+) -> Optional[str]:
+    """Extract text from an Excel workbook"""
+    try:
+        wb = open_workbook(source)
+    except Exception as e:
+        print(f"Excel bytes extraction error: {e}")
+        return None
+
+    try:
+        text_parts = []
+        for sheet_name, sheet in iter_sheets(wb, sheets):
+            text_parts.append(f"=== Sheet: {sheet_name} ===")
+
+            row_count = 0
+            for row in iter_rows(sheet, max_rows):
+                row_count += 1
+                row_values = [str(value) if value else "" for value in row]
+                if any(row_values):
+                    text_parts.append(" | ".join(row_values))
+
+            if max_rows and row_count >= max_rows:
+                print(f"[Excel] Sheet '{sheet_name}' truncated at {max_rows} rows")
+
+        return "\n".join(text_parts)
+    except Exception as e:
+        print(f"Excel bytes extraction error: {e}")
+        return None
+    finally:
+        wb.close()
+
+
+def extract_excel_milestones(
+    source: DocumentSource,
+    sheets: Optional[List[str]] = None,
+    max_rows: Optional[int] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Extract milestones directly from Excel structure.
+    Looks for common patterns in milestone schedules; returns None when no
+    header row is recognised so the caller can fall back to GPT parsing.
+    Reads the active sheet unless `sheets` names others.
+    """
+    wb = open_workbook(source)
+    try:
+        if sheets:
+            selected = next(iter_sheets(wb, sheets), None)
+            sheet = selected[1] if selected else wb.active
+        else:
+            sheet = wb.active
+        rows = iter_rows(sheet, max_rows)
+
+        # Find header row within the first 10 rows; stop reading if there is none
+        header_found = False
+        for row in islice(rows, 10):
+            values = [str(value).lower() if value else "" for value in row]
+            if any("milestone" in v or "payment" in v or "description" in v for v in values):
+                header_found = True
+                break
+
+        if not header_found:
+            return None
+
+        # Parse data rows (the rest of the same stream)
+        milestones = []
+        for values in rows:
+            # Skip empty rows
+            if not any(values):
+                continue
+
+            # Try to extract milestone data (flexible column mapping)
+            milestone = {}
+            for val in values:
+                if val is None:
+                    continue
+                val_str = str(val).strip()
+
+                # Title (first text column)
+                if not milestone.get("title") and isinstance(val, str) and len(val) > 3:
+                    milestone["title"] = val_str
+                # Percentage (number between 0-100)
+                elif isinstance(val, (int, float)) and 0 < val <= 100:
+                    if "payment_percentage" not in milestone:
+                        milestone["payment_percentage"] = float(val)
+                # Date
+                elif hasattr(val, "strftime"):
+                    if "expected_date" not in milestone:
+                        milestone["expected_date"] = val.strftime("%Y-%m-%d")
+
+            if milestone.get("title") and milestone.get("payment_percentage"):
+                milestones.append({
+                    "title": milestone.get("title", ""),
+                    "description": None,
+                    "expected_date": milestone.get("expected_date"),
+                    "payment_percentage": milestone.get("payment_percentage", 0)
+                })
+
+        return milestones
+    finally:
+        wb.close()
+
+
+def extract_excel_table(
+    source: DocumentSource,
+    document_type: str,
+    sheets: Optional[List[str]] = None,
+    max_rows: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Parse the best-matching sheet of a workbook with the table parser.
+    Returns {"data", "confidence", "sheet", "rows"} or None when no sheet has
+    a recognisable header for the document type.
+    """
+    wb = open_workbook(source)
+    try:
+        best = None
+        for sheet_name, sheet in iter_sheets(wb, sheets):
+            table = table_parser.parse_table(iter_rows(sheet, max_rows), document_type)
+            if table and (best is None or (table["confidence"], len(table["items"])) > (best[1]["confidence"], len(best[1]["items"]))):
+                best = (sheet_name, table)
+    finally:
+        wb.close()
+
+    if best is None:
+        return None
+    sheet_name, table = best
+    return {
+        "data": table_parser.build_document(document_type, table),
+        "confidence": table["confidence"],
+        "sheet": sheet_name,
+        "rows": len(table["items"]),
+    }
@@ -0,0 +1,221 @@
+"""
+Document Downloader
+Streams S3 objects and HTTP files into document buffers through process-wide
+pooled clients; objects bigger than one part are fetched as concurrent ranged GETs
+"""
+import asyncio
+import re
+from functools import lru_cache
+from typing import Optional, Dict, Any, Awaitable, Callable
+
+import boto3
+import httpx
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from app.config import get_settings
+from app.services.document_buffer import DocumentBuffer
+from app.services.executors import get_executors
+
+
+# Read size for streamed bodies; also the most a single download holds in memory per part
+CHUNK_BYTES = 256 * 1024
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+class DownloadTooLargeError(ValueError):
+    """Raised when a document exceeds download_max_bytes"""
+
+
+class Downloader:
+    """
+    Shared download clients
+
+    - one pooled httpx.AsyncClient (keep-alive, HTTP timeouts) and one boto3 S3
+      client sized to the I/O pool, so repeated downloads reuse TLS connections
+    - bodies are streamed in chunks straight into a DocumentBuffer's temp
+      file, never held whole in memory
+    - the first request asks for one part; when the response shows a larger
+      object the remaining parts are fetched concurrently
+    - documents above `max_bytes` are rejected as soon as their size is known
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        self.max_bytes = settings.download_max_bytes
+        self.part_bytes = settings.download_part_bytes
+        self.max_concurrent_parts = settings.download_max_concurrent_parts
+        self.timeout = settings.download_timeout_seconds
+        self.max_connections = settings.download_max_connections
+        self.s3 = boto3.client(
+            "s3",
+            region_name=settings.aws_region,
+            aws_access_key_id=settings.aws_access_key_id,
+            aws_secret_access_key=settings.aws_secret_access_key,
+            config=Config(max_pool_connections=max(settings.extraction_io_workers, self.max_connections)),
+        )
+        self._http: Optional[httpx.AsyncClient] = None
+        self.downloads = 0
+        self.bytes_downloaded = 0
+        self.ranged_downloads = 0
+        self.rejected = 0
+
+    async def start(self) -> None:
+        """Open the HTTP connection pool (called from the app lifespan)"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                follow_redirects=True,
+            )
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def download_s3(self, bucket: str, key: str, suffix: str = "") -> DocumentBuffer:
+        buffer = await get_executors().run_io(DocumentBuffer.create, suffix)
+        try:
+            executors = get_executors()
+            total = await executors.run_io(self._get_s3_part, buffer, bucket, key, 0)
+            await self._fetch_remaining_parts(
+                total,
+                buffer.size,
+                lambda start, end: executors.run_io(self._get_s3_part, buffer, bucket, key, start, end),
+            )
+            return self._finish(buffer, total)
+        except BaseException:
+            buffer.close()
+            raise
+
+    async def download_http(self, url: str, suffix: str = "") -> DocumentBuffer:
+        if self._http is None:
+            # Outside the app (scripts, job replays before startup)
+            await self.start()
+        buffer = await get_executors().run_io(DocumentBuffer.create, suffix)
+        try:
+            total = await self._get_http_part(buffer, url, 0)
+            await self._fetch_remaining_parts(
+                total,
+                buffer.size,
+                lambda start, end: self._get_http_part(buffer, url, start, end),
+            )
+            return self._finish(buffer, total)
+        except BaseException:
+            buffer.close()
+            raise
+
+    async def _fetch_remaining_parts(
+        self,
+        total: int,
+        received: int,
+        fetch_part: Callable[[int, int], Awaitable[int]]
+    ) -> None:
+        """Fetch bytes received..total in parts, at most max_concurrent_parts requests in flight"""
+        if received >= total:
+            return
+        self.ranged_downloads += 1
+        slots = asyncio.Semaphore(self.max_concurrent_parts)
+
+        async def fetch(start: int) -> None:
+            async with slots:
+                await fetch_part(start, min(start + self.part_bytes, total) - 1)
+
+        tasks = [asyncio.ensure_future(fetch(start)) for start in range(received, total, self.part_bytes)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _get_s3_part(
+        self,
+        buffer: DocumentBuffer,
+        bucket: str,
+        key: str,
+        start: int,
+        end: Optional[int] = None
+    ) -> int:
+        """Blocking ranged GetObject streamed into the buffer; returns the object's total size"""
+        end = start + self.part_bytes - 1 if end is None else end
+        try:
+            response = self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+        except ClientError as e:
+            # Ranges are unsatisfiable on empty objects
+            if start == 0 and e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return 0
+            raise
+
+        total = self._total_size(response.get("ContentRange"), response.get("ContentLength", 0))
+        self._check_size(total)
+        offset = start
+        for chunk in response["Body"].iter_chunks(CHUNK_BYTES):
+            buffer.write_at(offset, chunk)
+            offset += len(chunk)
+        return total
+
+    async def _get_http_part(self, buffer: DocumentBuffer, url: str, start: int, end: Optional[int] = None) -> int:
+        """Ranged GET streamed into the buffer; servers ignoring Range send the whole body instead"""
+        end = start + self.part_bytes - 1 if end is None else end
+        async with self._http.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as response:
+            if response.status_code == 416 and start == 0:
+                return 0
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                length = int(response.headers.get("Content-Length", 0))
+                total = self._total_size(response.headers.get("Content-Range"), length)
+            elif start == 0:
+                # Full body: no ranged fetch, but still streamed and size-checked
+                total = int(response.headers.get("Content-Length", 0))
+            else:
+                raise httpx.HTTPError(f"Range request for {url} returned {response.status_code}")
+            self._check_size(total)
+
+            offset = start
+            async for chunk in response.aiter_bytes(CHUNK_BYTES):
+                buffer.write_at(offset, chunk)
+                offset += len(chunk)
+                # Content-Length may be missing or wrong on a full body
+                self._check_size(offset)
+
+        return total if response.status_code == 206 else offset
+
+    @staticmethod
+    def _total_size(content_range: Optional[str], content_length: int) -> int:
+        match = CONTENT_RANGE.match(content_range or "")
+        return int(match.group(3)) if match else content_length
+
+    def _check_size(self, size: int) -> None:
+        if self.max_bytes and size > self.max_bytes:
+            self.rejected += 1
+            raise DownloadTooLargeError(
+                f"Document is {size / 1024 / 1024:.1f} MB, above the {self.max_bytes / 1024 / 1024:.0f} MB limit"
+            )
+
+    def _finish(self, buffer: DocumentBuffer, total: int) -> DocumentBuffer:
+        if buffer.size != total:
+            raise IOError(f"Incomplete download: {buffer.size} of {total} bytes")
+        buffer.seal()
+        self.downloads += 1
+        self.bytes_downloaded += total
+        return buffer
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "downloads": self.downloads,
+            "bytesDownloaded": self.bytes_downloaded,
+            "rangedDownloads": self.ranged_downloads,
+            "rejected": self.rejected,
+        }
+
+
+@lru_cache()
+def get_downloader() -> Downloader:
+    """Process-wide downloader so every extraction shares the connection pools"""
+    return Downloader()
@@ -0,0 +1,124 @@
+"""
+Execution Layer
+Worker pools that keep blocking SDK calls and CPU-bound parsing off the event loop
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, Optional
+
+from app.config import get_settings
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """Raised when a pool's queue stays full for longer than the queue timeout"""
+
+
+class BoundedExecutor:
+    """
+    Executor with a bounded queue.
+
+    At most `workers + queue_size` tasks are admitted at once; further callers
+    wait for a slot (backpressure) and give up with ExecutorSaturatedError
+    after `queue_timeout` seconds instead of piling up unbounded work.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Executor], workers: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(workers + queue_size)
+        self.submitted = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+    @property
+    def executor(self) -> Executor:
+        # Created lazily so importing the app doesn't spawn worker processes
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) on the pool once a queue slot is free"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ExecutorSaturatedError(f"{self.name} pool is saturated, try again later")
+
+        self.submitted += 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queueSize": self.queue_size,
+            "inFlight": self.in_flight,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+        }
+
+
+class ExtractionExecutors:
+    """
+    Thread pool for I/O-bound SDK calls (boto3 S3/Textract) and process pool
+    for CPU-bound document parsing (pdfplumber, openpyxl, python-docx)
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        cpu_workers = settings.extraction_cpu_workers or os.cpu_count() or 1
+
+        self.io = BoundedExecutor(
+            "io",
+            partial(ThreadPoolExecutor, max_workers=settings.extraction_io_workers, thread_name_prefix="extraction-io"),
+            workers=settings.extraction_io_workers,
+            queue_size=settings.extraction_queue_size,
+            queue_timeout=settings.extraction_queue_timeout_seconds,
+        )
+        # spawn: forking a process that is running an event loop and threads is unsafe
+        self.cpu = BoundedExecutor(
+            "cpu",
+            partial(ProcessPoolExecutor, max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn")),
+            workers=cpu_workers,
+            queue_size=settings.extraction_queue_size,
+            queue_timeout=settings.extraction_queue_timeout_seconds,
+        )
+
+    async def run_io(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking I/O call (e.g. a boto3 request) on the thread pool"""
+        return await self.io.run(fn, *args, **kwargs)
+
+    async def run_cpu(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a CPU-bound, picklable module-level function on the process pool"""
+        return await self.cpu.run(fn, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        self.io.shutdown()
+        self.cpu.shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"io": self.io.stats(), "cpu": self.cpu.stats()}
+
+
+@lru_cache()
+def get_executors() -> ExtractionExecutors:
+    """Process-wide pools shared by every extraction request"""
+    return ExtractionExecutors()
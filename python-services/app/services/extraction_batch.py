@@ -0,0 +1,89 @@
+"""
+Batch Extraction
+Runs many documents through the download -> text -> parse pipeline at once.
+Every document is its own task and each stage has its own concurrency cap, so
+while one document is being parsed by the LLM the next ones are already being
+downloaded and extracted; throughput is bounded by the slowest stage.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, AsyncIterator, Awaitable, Callable
+
+from app.config import get_settings
+from app.serialization import dumps
+from app.services.ai_extraction import AIExtractionService, StageLimits
+from app.services.document_buffer import DocumentBuffer
+
+
+@dataclass
+class BatchDocument:
+    """One document of a batch: a URL, or an upload buffered lazily in the download stage"""
+    index: int
+    document_type: str
+    file_url: Optional[str] = None
+    filename: Optional[str] = None
+    open: Optional[Callable[[], Awaitable[DocumentBuffer]]] = None
+
+
+def stage_limits() -> StageLimits:
+    settings = get_settings()
+    return StageLimits(
+        download=asyncio.Semaphore(settings.extraction_batch_download_concurrency),
+        text=asyncio.Semaphore(settings.extraction_batch_text_concurrency),
+        parse=asyncio.Semaphore(settings.extraction_batch_parse_concurrency),
+    )
+
+
+async def run_batch(
+    service: AIExtractionService,
+    documents: List[BatchDocument]
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield one result per document, in completion order"""
+    limits = stage_limits()
+
+    async def process(document: BatchDocument) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            if document.file_url is not None:
+                result = await service.extract_from_url(document.file_url, document.document_type, limits=limits)
+            else:
+                async with limits.download:
+                    buffer = await document.open()
+                try:
+                    result = await service.extract_from_buffer(
+                        buffer, document.filename or "document", document.document_type, limits=limits
+                    )
+                finally:
+                    buffer.close()
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+
+        return {
+            "index": document.index,
+            "document_type": document.document_type,
+            "file_url": document.file_url,
+            "filename": document.filename,
+            "success": result.get("success", False),
+            "data": result.get("data"),
+            "error": result.get("error"),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    tasks = [asyncio.create_task(process(document)) for document in documents]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        # Client went away mid-stream: don't keep extracting for nobody
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_batch_ndjson(
+    service: AIExtractionService,
+    documents: List[BatchDocument]
+) -> AsyncIterator[bytes]:
+    """Batch results as NDJSON lines, flushed as each document finishes"""
+    async for result in run_batch(service, documents):
+        yield dumps(result) + b"\n"
@@ -0,0 +1,203 @@
+"""
+Extraction Cache
+Content-addressed cache for extracted text and parsed results
+"""
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.config import get_settings
+from app.services.executors import get_executors
+
+
+def content_hash(content: bytes) -> str:
+    """SHA-256 of the document bytes"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class DiskCacheBackend:
+    """
+    Local disk backend. Entries are files under <directory>/<namespace>/,
+    recency is tracked with mtime and the oldest entries are evicted once the
+    directory grows past max_bytes. Blocking; call it from a worker thread.
+    """
+
+    name = "disk"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._entries())
+        self.evictions = 0
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        path = self._path(namespace, key)
+        try:
+            payload = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # Touch so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def set(self, namespace: str, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        path = self._path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write then rename so readers (and other workers) never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        try:
+            # An overwrite replaces the old file, whose bytes are already counted
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        self._bytes += len(payload) - replaced
+        if self._bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until 90% of the budget is free"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+    def _entries(self) -> List[Tuple[Path, int, float]]:
+        entries = []
+        for path in self.directory.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix != ".tmp":
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _path(self, namespace: str, key: str) -> Path:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / namespace / digest[:2] / digest
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "bytes": self._bytes,
+            "maxBytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class ExtractionCache:
+    """
+    Two-stage extraction cache
+
+    - text:   document hash + text extractor variant -> extracted raw text
+    - parsed: document hash + document type + prompt version + model -> result
+    A prompt or model change therefore only re-runs the LLM stage.
+    """
+
+    def __init__(self, backend: Any, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = {"text": 0, "parsed": 0}
+        self.misses = {"text": 0, "parsed": 0}
+        self.errors = 0
+
+    async def get_text(self, document_hash: str, variant: str) -> Optional[str]:
+        payload = await self._get("text", f"{document_hash}:{variant}")
+        return payload.decode() if payload is not None else None
+
+    async def set_text(self, document_hash: str, variant: str, text: str) -> None:
+        await self._set("text", f"{document_hash}:{variant}", text.encode())
+
+    async def get_parsed(
+        self,
+        document_hash: str,
+        document_type: str,
+        prompt_version: str,
+        model: str
+    ) -> Optional[Dict[str, Any]]:
+        payload = await self._get("parsed", f"{document_hash}:{document_type}:{prompt_version}:{model}")
+        return json.loads(payload) if payload is not None else None
+
+    async def set_parsed(
+        self,
+        document_hash: str,
+        document_type: str,
+        prompt_version: str,
+        model: str,
+        data: Dict[str, Any]
+    ) -> None:
+        await self._set(
+            "parsed",
+            f"{document_hash}:{document_type}:{prompt_version}:{model}",
+            json.dumps(data).encode()
+        )
+
+    async def _get(self, namespace: str, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        try:
+            payload = await get_executors().run_io(self.backend.get, namespace, key)
+        except Exception as e:
+            # The cache is an optimisation, never fail an extraction because of it
+            self.errors += 1
+            print(f"[Extraction Cache] Read error: {e}")
+            return None
+        if payload is None:
+            self.misses[namespace] += 1
+        else:
+            self.hits[namespace] += 1
+        return payload
+
+    async def _set(self, namespace: str, key: str, payload: bytes) -> None:
+        if not self.enabled:
+            return
+        try:
+            await get_executors().run_io(self.backend.set, namespace, key, payload)
+        except Exception as e:
+            self.errors += 1
+            print(f"[Extraction Cache] Write error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            **self.backend.stats(),
+        }
+
+
+@lru_cache()
+def get_extraction_cache() -> ExtractionCache:
+    """Build the extraction cache from settings"""
+    settings = get_settings()
+    backend = DiskCacheBackend(
+        settings.extraction_cache_dir,
+        max_bytes=settings.extraction_cache_max_bytes,
+    )
+    return ExtractionCache(backend, enabled=settings.extraction_cache_enabled)
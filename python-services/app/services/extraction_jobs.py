@@ -0,0 +1,418 @@
+"""
+Extraction Jobs
+Asynchronous extraction: submit returns a job id, a bounded worker pool runs
+jobs by document-type priority, and state is persisted in SQLite so queued
+work survives restarts
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import itertools
+import json
+import socket
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Set, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from app.config import get_settings
+from app.services.ai_extraction import AIExtractionService
+from app.services.document_buffer import DocumentBuffer
+from app.services.executors import get_executors
+
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Webhook delivery attempts before giving up
+CALLBACK_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS extraction_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    file_url TEXT,
+    filename TEXT,
+    upload_path TEXT,
+    callback_url TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS extraction_jobs_status_idx ON extraction_jobs (status, priority, created_at);
+"""
+
+
+class CallbackURLError(ValueError):
+    """Raised when a callback URL is not an http(s) URL on an allowed, public host"""
+
+
+def validate_callback_url(url: str, allowed_hosts: List[str]) -> None:
+    """
+    Reject callback URLs the server must not POST results to: non-http(s)
+    schemes, and hosts resolving to private, loopback, link-local or other
+    non-public addresses (internal services, cloud metadata). With an
+    allowlist only the listed hosts are accepted. Blocking (DNS lookup).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise CallbackURLError("callback_url must be an http(s) URL")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise CallbackURLError(f"callback_url host {host} is not allowed")
+        return
+
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        raise CallbackURLError(f"callback_url host {host} cannot be resolved: {e}")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise CallbackURLError(f"callback_url host {host} resolves to a non-public address")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def parse_priorities(value: str) -> Dict[str, int]:
+    """Parse "shipment:0,invoice:1" into {"shipment": 0, "invoice": 1}"""
+    priorities = {}
+    for entry in value.split(","):
+        if ":" in entry:
+            document_type, priority = entry.split(":", 1)
+            priorities[document_type.strip()] = int(priority)
+    return priorities
+
+
+class JobStore:
+    """
+    SQLite-backed job table. Blocking; call it from a worker thread.
+    One shared connection guarded by a lock keeps writes serialised.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def insert(self, job: Dict[str, Any]) -> None:
+        columns = ", ".join(job)
+        placeholders = ", ".join(f":{name}" for name in job)
+        with self._lock:
+            self._conn.execute(f"INSERT INTO extraction_jobs ({columns}) VALUES ({placeholders})", job)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE extraction_jobs SET {assignments} WHERE id = :id",
+                {**fields, "id": job_id}
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM extraction_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def requeue_unfinished(self, max_attempts: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Reset jobs interrupted by a crash and return (jobs waiting to run, jobs
+        failed now). A job that has already been started max_attempts times
+        probably takes the worker down with it, so it is failed instead.
+        """
+        with self._lock:
+            abandoned = [dict(row) for row in self._conn.execute(
+                "SELECT * FROM extraction_jobs WHERE status = ? AND attempts >= ?",
+                (RUNNING, max_attempts)
+            ).fetchall()]
+            finished_at = _now()
+            for job in abandoned:
+                job.update(
+                    status=FAILED,
+                    error=f"Extraction was interrupted {job['attempts']} times, giving up",
+                    finished_at=finished_at,
+                )
+                self._conn.execute(
+                    "UPDATE extraction_jobs SET status = :status, error = :error, finished_at = :finished_at "
+                    "WHERE id = :id",
+                    job
+                )
+            self._conn.execute(
+                "UPDATE extraction_jobs SET status = ?, started_at = NULL WHERE status = ?",
+                (QUEUED, RUNNING)
+            )
+            rows = self._conn.execute(
+                "SELECT * FROM extraction_jobs WHERE status = ? ORDER BY priority, created_at",
+                (QUEUED,)
+            ).fetchall()
+        return [dict(row) for row in rows], abandoned
+
+    def release(self, job_ids: List[str]) -> None:
+        """Requeue jobs stopped by a clean shutdown without counting the attempt"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE extraction_jobs SET status = ?, started_at = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE id = ? AND status = ?",
+                [(QUEUED, job_id, RUNNING) for job_id in job_ids]
+            )
+
+    def purge_finished(self, before: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM extraction_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (COMPLETED, FAILED, before)
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM extraction_jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+
+class ExtractionJobQueue:
+    """
+    Priority job queue in front of AIExtractionService
+
+    - submit_url / submit_upload persist the job and return immediately
+    - `workers` tasks pull jobs in (priority, submission) order
+    - jobs left queued or running at shutdown are picked up again on start();
+      one interrupted max_attempts times (it crashes the worker) is failed
+    - an optional callback URL receives the finished job as a POST
+    """
+
+    def __init__(self, service: AIExtractionService):
+        settings = get_settings()
+        self.service = service
+        self.directory = Path(settings.extraction_jobs_dir)
+        self.uploads = self.directory / "uploads"
+        self.uploads.mkdir(parents=True, exist_ok=True)
+        self.store = JobStore(str(self.directory / "jobs.sqlite3"))
+        self.workers = settings.extraction_job_workers
+        self.priorities = parse_priorities(settings.extraction_job_priorities)
+        self.retention = timedelta(hours=settings.extraction_job_retention_hours)
+        self.callback_secret = settings.extraction_job_callback_secret
+        self.callback_hosts = [
+            host.strip().lower() for host in settings.extraction_job_callback_hosts.split(",") if host.strip()
+        ]
+        self.max_attempts = settings.extraction_job_max_attempts
+        self._queue: "asyncio.PriorityQueue" = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._running: Set[str] = set()
+
+    async def start(self) -> None:
+        """Purge expired jobs, re-enqueue unfinished ones and start the workers"""
+        if self._tasks:
+            return
+        executors = get_executors()
+        purged = await executors.run_io(
+            self.store.purge_finished, (datetime.now(timezone.utc) - self.retention).isoformat()
+        )
+        pending, abandoned = await executors.run_io(self.store.requeue_unfinished, self.max_attempts)
+        for job in pending:
+            self._enqueue(job["id"], job["priority"])
+        if pending or purged or abandoned:
+            print(f"[Extraction Jobs] Resumed {len(pending)} jobs, failed {len(abandoned)} abandoned, purged {purged}")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks += [asyncio.create_task(self._finish(job)) for job in abandoned]
+
+    async def stop(self) -> None:
+        """Stop the workers; interrupted jobs are requeued for the next start without using up an attempt"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._running:
+            await get_executors().run_io(self.store.release, list(self._running))
+            self._running.clear()
+
+    async def submit_url(
+        self,
+        file_url: str,
+        document_type: str,
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self._submit(document_type, callback_url, file_url=file_url)
+
+    async def submit_upload(
+        self,
+        document: DocumentBuffer,
+        filename: str,
+        document_type: str,
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self._submit(document_type, callback_url, filename=filename, document=document)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await get_executors().run_io(self.store.get, job_id)
+        return self._serialize(job) if job else None
+
+    async def _submit(
+        self,
+        document_type: str,
+        callback_url: Optional[str],
+        file_url: Optional[str] = None,
+        filename: Optional[str] = None,
+        document: Optional[DocumentBuffer] = None
+    ) -> Dict[str, Any]:
+        executors = get_executors()
+        if callback_url:
+            await executors.run_io(validate_callback_url, callback_url, self.callback_hosts)
+        
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "document_type": document_type,
+            "priority": self.priorities.get(document_type, max(self.priorities.values(), default=0) + 1),
+            "file_url": file_url,
+            "filename": filename,
+            "upload_path": None,
+            "callback_url": callback_url,
+            "created_at": _now(),
+        }
+
+        if document is not None:
+            # Uploads are kept on disk so the job can be replayed after a restart
+            upload_path = self.uploads / f"{job_id}{document.extension}"
+            await executors.run_io(document.persist, str(upload_path))
+            job["upload_path"] = str(upload_path)
+
+        await executors.run_io(self.store.insert, job)
+        self._enqueue(job_id, job["priority"])
+        return self._serialize(job)
+
+    def _enqueue(self, job_id: str, priority: int) -> None:
+        self._queue.put_nowait((priority, next(self._sequence), job_id))
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"[Extraction Jobs] Job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        executors = get_executors()
+        job = await executors.run_io(self.store.get, job_id)
+        if job is None or job["status"] != QUEUED:
+            return
+
+        await executors.run_io(
+            self.store.update, job_id,
+            status=RUNNING, started_at=_now(), attempts=job["attempts"] + 1
+        )
+        self._running.add(job_id)
+        try:
+            result = await self._extract(job)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        # Left in place when cancelled, so stop() can release the job
+        self._running.discard(job_id)
+
+        fields = {"finished_at": _now()}
+        if result.get("success"):
+            fields.update(status=COMPLETED, result=json.dumps(result.get("data")), error=None)
+        else:
+            fields.update(status=FAILED, result=None, error=result.get("error"))
+        await executors.run_io(self.store.update, job_id, **fields)
+        await self._finish(job)
+
+    async def _finish(self, job: Dict[str, Any]) -> None:
+        """Drop a finished job's upload and notify its callback URL"""
+        executors = get_executors()
+        if job["upload_path"]:
+            await executors.run_io(Path(job["upload_path"]).unlink, missing_ok=True)
+
+        if job["callback_url"]:
+            finished = await executors.run_io(self.store.get, job["id"])
+            await self._send_callback(job["callback_url"], self._serialize(finished))
+
+    async def _extract(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        document_type = job["document_type"]
+        if job["upload_path"]:
+            document = DocumentBuffer.open_path(job["upload_path"])
+            try:
+                return await self.service.extract_from_buffer(document, job["filename"] or "document", document_type)
+            finally:
+                document.close()
+        return await self.service.extract_from_url(job["file_url"], document_type)
+
+    async def _send_callback(self, callback_url: str, payload: Dict[str, Any]) -> None:
+        """POST the finished job to the caller, retrying transient failures"""
+        try:
+            # Checked again at delivery: the host's DNS may have changed since submit
+            await get_executors().run_io(validate_callback_url, callback_url, self.callback_hosts)
+        except CallbackURLError as e:
+            print(f"[Extraction Jobs] Callback not sent: {e}")
+            return
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.callback_secret:
+            signature = hmac.new(self.callback_secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Signature"] = f"sha256={signature}"
+
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            for attempt in range(CALLBACK_ATTEMPTS):
+                try:
+                    response = await client.post(callback_url, content=body, headers=headers)
+                    if response.status_code < 500:
+                        return
+                    print(f"[Extraction Jobs] Callback {callback_url} returned {response.status_code}")
+                except httpx.HTTPError as e:
+                    print(f"[Extraction Jobs] Callback {callback_url} failed: {e}")
+                if attempt + 1 < CALLBACK_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+
+    @staticmethod
+    def _serialize(job: Dict[str, Any]) -> Dict[str, Any]:
+        result = job.get("result")
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "document_type": job["document_type"],
+            "file_url": job.get("file_url"),
+            "filename": job.get("filename"),
+            "created_at": job.get("created_at"),
+            "started_at": job.get("started_at"),
+            "finished_at": job.get("finished_at"),
+            "data": json.loads(result) if result else None,
+            "error": job.get("error"),
+        }
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await get_executors().run_io(self.store.counts)
+        return {"workers": self.workers, "pending": self._queue.qsize(), **counts}
+
+
+@lru_cache()
+def get_job_queue() -> ExtractionJobQueue:
+    """Process-wide job queue, started from the app lifespan"""
+    return ExtractionJobQueue(AIExtractionService())
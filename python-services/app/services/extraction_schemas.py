@@ -0,0 +1,137 @@
+"""
+Extraction Schemas
+Pydantic models of the structured data extracted from each document type.
+They document the API's `data` payloads and are what the LLM is asked to
+fill: their JSON schemas are sent as structured-output response formats.
+Where the LLM schema is stricter than the public payload it gets its own
+subclass, so the response contract stays as lenient as before.
+"""
+from typing import Optional, List
+
+from pydantic import BaseModel
+
+
+class ExtractedMilestone(BaseModel):
+    title: str
+    description: Optional[str] = None
+    expected_date: Optional[str] = None
+    payment_percentage: float
+
+
+class ExtractedMilestoneSchedule(BaseModel):
+    milestones: List[ExtractedMilestone] = []
+
+
+class ExtractedBOQItem(BaseModel):
+    item_number: str
+    description: str
+    unit: str
+    quantity: float
+    unit_price: float
+    total_price: float
+
+
+class ExtractedPOData(BaseModel):
+    po_number: Optional[str] = None
+    vendor_name: Optional[str] = None
+    date: Optional[str] = None
+    total_value: Optional[float] = None
+    currency: Optional[str] = None
+    scope: Optional[str] = None
+    payment_terms: Optional[str] = None
+    incoterms: Optional[str] = None
+    retention_percentage: Optional[float] = None
+    milestones: List[ExtractedMilestone] = []
+    boq_items: List[ExtractedBOQItem] = []
+    confidence: float = 0.0
+    raw_text: Optional[str] = None
+
+
+class ExtractedInvoiceLineItem(BaseModel):
+    description: str
+    quantity: Optional[float] = None
+    unit_price: Optional[float] = None
+    amount: float
+
+
+class ExtractedInvoiceData(BaseModel):
+    invoice_number: Optional[str] = None
+    vendor_name: Optional[str] = None
+    date: Optional[str] = None
+    due_date: Optional[str] = None
+    total_amount: Optional[float] = None
+    currency: Optional[str] = None
+    line_items: List[dict] = []
+    tax_amount: Optional[float] = None
+    subtotal: Optional[float] = None
+    confidence: float = 0.0
+
+
+# What the LLM is asked to fill; the response model keeps line items free-form
+class ExtractedInvoiceLLMData(ExtractedInvoiceData):
+    line_items: List[ExtractedInvoiceLineItem] = []
+
+
+class ExtractedShipmentPackage(BaseModel):
+    package_no: str
+    length_m: Optional[float] = None
+    quantity: int = 0
+    total_area_m2: Optional[float] = None
+    gross_weight_kg: Optional[float] = None
+
+
+class ExtractedShipmentItem(BaseModel):
+    article_number: str
+    description: str
+    quantity: float = 0
+    unit: str = ""
+    unit_price: Optional[float] = None
+    total_price: Optional[float] = None
+    weight_kg: Optional[float] = None
+    hs_code: Optional[str] = None
+    country_of_origin: Optional[str] = None
+    delivery_note: Optional[str] = None
+    packages: List[ExtractedShipmentPackage] = []
+
+
+class ExtractedShipmentData(BaseModel):
+    order_number: Optional[str] = None
+    project: Optional[str] = None
+    invoice_number: Optional[str] = None
+    invoice_date: Optional[str] = None
+    supplier_name: Optional[str] = None
+    customer_name: Optional[str] = None
+    delivery_conditions: Optional[str] = None
+    delivery_address: Optional[str] = None
+    origin: Optional[str] = None
+    destination: Optional[str] = None
+    currency: Optional[str] = None
+    total_excl_vat: Optional[float] = None
+    total_incl_vat: Optional[float] = None
+    vat_percentage: Optional[float] = None
+    total_gross_weight_kg: Optional[float] = None
+    total_net_weight_kg: Optional[float] = None
+    items: List[ExtractedShipmentItem] = []
+    confidence: float = 0.0
+    raw_text: Optional[str] = None
+
+
+# Model the LLM fills for each document type (milestone schedules are wrapped
+# in an object because structured outputs need an object at the root)
+LLM_RESPONSE_MODELS = {
+    "purchase_order": ExtractedPOData,
+    "invoice": ExtractedInvoiceLLMData,
+    "milestone": ExtractedMilestoneSchedule,
+    "shipment": ExtractedShipmentData,
+}
+
+# Filled in by the service, never by the LLM
+LLM_EXCLUDED_FIELDS = ["raw_text"]
+
+# Arrays whose elements are surfaced one by one while a response streams in
+LLM_ITEM_PATHS = {
+    "purchase_order": [("milestones", "*"), ("boq_items", "*")],
+    "invoice": [("line_items", "*")],
+    "milestone": [("milestones", "*")],
+    "shipment": [("items", "*")],
+}
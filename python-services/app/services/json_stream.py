@@ -0,0 +1,229 @@
+"""
+Streaming JSON
+Incremental parser for LLM completions consumed as a stream: complete array
+items are surfaced as soon as they close, and a response cut off mid-way can
+be salvaged up to its last complete value. Also builds the strict JSON schemas
+sent as structured-output response formats.
+"""
+import copy
+import json
+from dataclasses import dataclass, field
+from typing import Optional, Any, Callable, Dict, List, Sequence, Set, Tuple, Type
+
+from pydantic import BaseModel
+
+
+WHITESPACE = " \t\r\n"
+SCALAR_END = WHITESPACE + ",]}"
+
+# A path of object keys from the root; "*" stands for any array element
+ItemPath = Tuple[str, ...]
+
+
+class TruncatedResponseError(ValueError):
+    """The completion ended before its JSON did; `partial` holds what could be salvaged"""
+
+    def __init__(self, message: str, partial: Any = None, items: int = 0):
+        super().__init__(message)
+        self.partial = partial
+        self.items = items
+
+
+@dataclass
+class _Frame:
+    kind: str  # "{" or "["
+    path: ItemPath
+    start: int
+    item: bool  # An element of a tracked array (or inside one)
+    expect: str = "value"  # object: key/colon/value/comma; array: value/comma
+    key: Optional[str] = None
+
+
+@dataclass
+class StreamingJSONParser:
+    """
+    Feed completion deltas with feed(). Elements of the arrays named by
+    `item_paths` (e.g. ("items", "*")) are passed to `on_item` as soon as they
+    close. Leading/trailing prose or markdown fences around the JSON value
+    are ignored.
+    """
+    item_paths: Sequence[ItemPath] = ()
+    on_item: Optional[Callable[[ItemPath, Any], None]] = None
+    text: str = ""
+    items: int = 0
+    _pos: int = 0
+    _started: bool = False
+    _done: bool = False
+    _stack: List[_Frame] = field(default_factory=list)
+    _in_string: bool = False
+    _escape: bool = False
+    _token_start: int = -1
+    _scalar: bool = False
+    _safe: Tuple[int, str] = (0, "")
+    _root_start: int = 0
+    _result_end: int = -1
+
+    def __post_init__(self) -> None:
+        self._item_paths: Set[ItemPath] = {tuple(path) for path in self.item_paths}
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: str) -> None:
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text) and not self._done:
+            self._step(text[self._pos])
+            self._pos += 1
+
+    def result(self) -> Any:
+        """The complete value; raises TruncatedResponseError (with a salvaged partial) if it is unfinished"""
+        if self._done:
+            return json.loads(self.text[self._root_start:self._result_end])
+        raise TruncatedResponseError(
+            "Response ended before the JSON was complete", partial=self.salvage(), items=self.items
+        )
+
+    def salvage(self) -> Any:
+        """Everything up to the last complete value, with open containers closed (None if nothing usable)"""
+        end, closers = self._safe
+        if not self._started or not end:
+            return None
+        try:
+            return json.loads(self.text[self._root_start:end] + closers)
+        except ValueError:
+            return None
+
+    # -------------------------------------------------------------------------
+
+    def _step(self, char: str) -> None:
+        pos = self._pos
+        if not self._started:
+            if char in "{[":
+                self._started = True
+                self._root_start = pos
+                self._open(char, pos)
+            return
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                self._end_string(pos + 1)
+            return
+
+        if self._scalar:
+            if char not in SCALAR_END:
+                return
+            self._scalar = False
+            self._end_value(pos)
+
+        if char in WHITESPACE:
+            return
+        frame = self._stack[-1]
+
+        if char == '"':
+            self._in_string = True
+            self._token_start = pos
+        elif char in "{[":
+            self._open(char, pos)
+        elif char in "}]":
+            self._close(pos)
+        elif char == ":":
+            frame.expect = "value"
+        elif char == ",":
+            frame.expect = "key" if frame.kind == "{" else "value"
+        else:
+            self._scalar = True
+            self._token_start = pos
+
+    def _open(self, kind: str, pos: int) -> None:
+        path = self._child_path()
+        parent_item = bool(self._stack) and self._stack[-1].item
+        self._stack.append(_Frame(
+            kind=kind,
+            path=path,
+            start=pos,
+            item=parent_item or path in self._item_paths,
+            expect="key" if kind == "{" else "value",
+        ))
+        self._mark_safe(pos + 1)
+
+    def _close(self, pos: int) -> None:
+        frame = self._stack.pop()
+        if frame.path in self._item_paths:
+            item = json.loads(self.text[frame.start:pos + 1])
+            self.items += 1
+            if self.on_item:
+                self.on_item(frame.path[:-1], item)
+        self._end_value(pos + 1)
+
+    def _end_string(self, end: int) -> None:
+        frame = self._stack[-1]
+        if frame.kind == "{" and frame.expect == "key":
+            frame.key = json.loads(self.text[self._token_start:end])
+            frame.expect = "colon"
+            return
+        self._end_value(end)
+
+    def _end_value(self, end: int) -> None:
+        if not self._stack:
+            self._finish(end)
+            return
+        self._stack[-1].expect = "comma"
+        self._mark_safe(end)
+
+    def _finish(self, end: int) -> None:
+        self._done = True
+        self._result_end = end
+
+    def _child_path(self) -> ItemPath:
+        if not self._stack:
+            return ()
+        frame = self._stack[-1]
+        return frame.path + ((frame.key or "",) if frame.kind == "{" else ("*",))
+
+    def _mark_safe(self, end: int) -> None:
+        # Inside a tracked array element nothing is safe until the element closes,
+        # so salvage never returns half an item
+        if any(frame.item for frame in self._stack):
+            return
+        closers = "".join("}" if frame.kind == "{" else "]" for frame in reversed(self._stack))
+        self._safe = (end, closers)
+
+
+def strict_json_schema(model: Type[BaseModel], exclude: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    JSON schema of a pydantic model in the form structured outputs require:
+    every property required (optional ones stay nullable), no additional
+    properties, no defaults or titles. Top-level fields in `exclude` are left out.
+    """
+    schema = copy.deepcopy(model.model_json_schema())
+    for name in exclude:
+        schema.get("properties", {}).pop(name, None)
+    return _strict(schema)
+
+
+def _strict(node: Any) -> Any:
+    if isinstance(node, list):
+        return [_strict(value) for value in node]
+    if not isinstance(node, dict):
+        return node
+
+    strict: Dict[str, Any] = {}
+    for key, value in node.items():
+        if key in ("default", "title"):
+            continue
+        if key in ("properties", "$defs"):
+            # Keyed by field/definition name, which may itself be "title"
+            strict[key] = {name: _strict(schema) for name, schema in value.items()}
+        else:
+            strict[key] = _strict(value)
+    if "properties" in strict:
+        strict["required"] = list(strict["properties"])
+        strict["additionalProperties"] = False
+    return strict
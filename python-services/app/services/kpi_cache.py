@@ -0,0 +1,289 @@
+"""
+KPI Result Cache
+Versioned, invalidation-aware cache in front of KPIService
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Tuple
+
+from app.config import get_settings
+from app import serialization
+
+
+KPI_CATEGORIES = [
+    "dashboard",
+    "financial",
+    "progress",
+    "quality",
+    "suppliers",
+    "payments",
+    "logistics",
+    "scurve",
+]
+
+# Which cached KPI categories a write to each entity type makes stale
+INVALIDATION_MAP: Dict[str, List[str]] = {
+    "purchase_order": KPI_CATEGORIES,
+    "invoice": ["dashboard", "financial", "payments"],
+    "milestone": ["dashboard", "progress", "scurve"],
+    "ncr": ["dashboard", "quality"],
+    "shipment": ["dashboard", "logistics"],
+    "supplier": ["dashboard", "suppliers"],
+}
+
+
+class MemoryCacheBackend:
+    """
+    In-process backend: TTL + LRU eviction bounded by entry count and bytes
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._bytes = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    async def set(self, key: str, payload: bytes, ttl: int) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + ttl, payload)
+        self._bytes += len(payload)
+
+        # Evict least recently used entries until back under budget
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    async def get_version(self, scope: str) -> int:
+        return self._versions.get(scope, 0)
+
+    async def bump_version(self, scope: str) -> int:
+        version = self._versions.get(scope, 0) + 1
+        self._versions[scope] = version
+
+        # Entries under the old version are unreachable now, free them eagerly
+        prefix = f"kpi:{scope}:"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            self._drop(key)
+        return version
+
+    def _drop(self, key: str) -> None:
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "maxEntries": self.max_entries,
+            "maxBytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class RedisCacheBackend:
+    """
+    Redis-protocol backend, shared across workers and instances.
+    Eviction is delegated to the server's maxmemory policy.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("redis package is required for KPI_CACHE_REDIS_URL") from e
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, payload: bytes, ttl: int) -> None:
+        await self._redis.set(key, payload, ex=ttl)
+
+    async def get_version(self, scope: str) -> int:
+        version = await self._redis.get(f"kpi:ver:{scope}")
+        return int(version) if version else 0
+
+    async def bump_version(self, scope: str) -> int:
+        return int(await self._redis.incr(f"kpi:ver:{scope}"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"evictions": None}
+
+
+class KPICache:
+    """
+    KPI result cache keyed by (category, organization, project, date range)
+
+    - Every (organization, category) pair carries a version number that is
+      part of the key; invalidation bumps the version instead of scanning keys
+    - Concurrent misses for the same key share a single in-flight computation
+    """
+
+    def __init__(self, backend: Any, ttl_seconds: int, enabled: bool = True):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def get_or_compute(
+        self,
+        category: str,
+        organization_id: str,
+        project_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        compute: Callable[[], Awaitable[Any]],
+        variant: str = ""
+    ) -> Any:
+        """
+        Return the cached value for a KPI scope, computing it at most once.
+        `variant` separates differently shaped results of the same category
+        (e.g. S-curve granularity) while sharing its invalidation.
+        """
+        if not self.enabled:
+            return await compute()
+
+        try:
+            key = await self._build_key(category, organization_id, project_id, date_from, date_to, variant)
+            payload = await self.backend.get(key)
+        except Exception as e:
+            # A broken cache backend must never take the KPI endpoints down
+            self.errors += 1
+            print(f"[KPI Cache] Backend error: {e}")
+            return await compute()
+
+        if payload is not None:
+            self.hits += 1
+            return serialization.loads(payload)
+
+        # Stampede protection: piggyback on an in-flight computation
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        # The computation runs as its own task so a cancelled leader (client
+        # disconnect) only stops waiting: requests coalesced onto it still get
+        # the result, and it is cached for the next one
+        task = asyncio.ensure_future(self._compute_and_store(key, compute))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._computation_done(key, done))
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = await compute()
+        try:
+            await self.backend.set(key, serialization.dumps(value), self.ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            print(f"[KPI Cache] Backend error: {e}")
+        return value
+
+    def _computation_done(self, key: str, task: "asyncio.Future[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark retrieved so a failure nobody awaited anymore isn't logged by asyncio
+            task.exception()
+
+    async def invalidate(self, organization_id: str, entity_types: Optional[List[str]] = None) -> List[str]:
+        """
+        Invalidate cached KPIs for an organization after writes to the given
+        entity types (all categories if none are given)
+        """
+        if entity_types:
+            unknown = [e for e in entity_types if e not in INVALIDATION_MAP]
+            if unknown:
+                raise ValueError(f"Unknown entity types: {', '.join(unknown)}")
+            categories = sorted({c for e in entity_types for c in INVALIDATION_MAP[e]})
+        else:
+            categories = list(KPI_CATEGORIES)
+
+        for category in categories:
+            await self.backend.bump_version(f"{organization_id}:{category}")
+        return categories
+
+    async def _build_key(
+        self,
+        category: str,
+        organization_id: str,
+        project_id: Optional[str],
+        date_from: Optional[date],
+        date_to: Optional[date],
+        variant: str = ""
+    ) -> str:
+        scope = f"{organization_id}:{category}"
+        version = await self.backend.get_version(scope)
+        return ":".join([
+            "kpi",
+            scope,
+            f"v{version}",
+            project_id or "*",
+            date_from.isoformat() if date_from else "",
+            date_to.isoformat() if date_to else "",
+            variant,
+        ])
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters for tuning the cache budget"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "ttlSeconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "hitRate": (self.hits + self.coalesced) / lookups if lookups else 0,
+            **self.backend.stats(),
+        }
+
+
+def create_kpi_cache() -> KPICache:
+    """Build the KPI cache from settings, preferring Redis when configured"""
+    settings = get_settings()
+    backend: Any = None
+    if settings.kpi_cache_redis_url:
+        try:
+            backend = RedisCacheBackend(settings.kpi_cache_redis_url)
+        except RuntimeError as e:
+            print(f"[KPI Cache] {e}, falling back to in-process cache")
+    if backend is None:
+        backend = MemoryCacheBackend(
+            max_entries=settings.kpi_cache_max_entries,
+            max_bytes=settings.kpi_cache_max_bytes,
+        )
+    return KPICache(
+        backend,
+        ttl_seconds=settings.kpi_cache_ttl_seconds,
+        enabled=settings.kpi_cache_enabled,
+    )
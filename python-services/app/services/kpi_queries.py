@@ -0,0 +1,465 @@
+"""
+KPI Query Layer
+Fixed-shape SQL statements with bound parameters for the KPI engine.
+
+Every statement has exactly one text regardless of which filters are set:
+optional filters are expressed as `(:param IS NULL OR ...)` so asyncpg's
+per-connection prepared-statement cache and Postgres plan reuse apply
+across organizations, projects and date ranges.
+"""
+from datetime import date
+from typing import Optional, Dict, Any
+
+from sqlalchemy import text
+
+
+# Shared filter over purchase_order (aliased `po`); dates compare against
+# the day boundary exactly as the previous literal filters did
+PO_FILTER = """
+    po.organization_id = :org_id
+    AND (CAST(:project_id AS uuid) IS NULL OR po.project_id = CAST(:project_id AS uuid))
+    AND (CAST(:date_from AS date) IS NULL OR po.created_at >= CAST(:date_from AS date))
+    AND (CAST(:date_to AS date) IS NULL OR po.created_at <= CAST(:date_to AS date))
+"""
+
+
+def po_filter_params(
+    organization_id: str,
+    project_id: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+) -> Dict[str, Any]:
+    """Bound parameters for PO_FILTER (every key is always present)"""
+    return {
+        "org_id": organization_id,
+        "project_id": project_id,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+
+
+FINANCIAL_PO = text(f"""
+SELECT
+    COALESCE(SUM(po.total_value::numeric), 0) as total_po_value,
+    COALESCE(SUM(po.retention_percentage::numeric), 0) as total_retention_pct
+FROM purchase_order po
+WHERE {PO_FILTER}
+""")
+
+FINANCIAL_PAID = text(f"""
+SELECT
+    COALESCE(SUM(inv.amount::numeric), 0) as paid_amount
+FROM invoice inv
+INNER JOIN purchase_order po ON inv.purchase_order_id = po.id
+WHERE inv.status = 'PAID'
+    AND {PO_FILTER}
+""")
+
+PROGRESS_PO = text(f"""
+SELECT
+    COUNT(*) as total_pos,
+    COUNT(*) FILTER (WHERE po.status IN ('ACTIVE', 'APPROVED')) as active_pos,
+    COALESCE(SUM(po.total_value::numeric), 0) as total_value
+FROM purchase_order po
+WHERE {PO_FILTER}
+""")
+
+PROGRESS_MILESTONES = text(f"""
+SELECT
+    COUNT(*) as total_milestones,
+    COUNT(*) FILTER (WHERE m.status = 'COMPLETED') as completed,
+    COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date < NOW()) as delayed,
+    COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date >= NOW() AND m.expected_date <= NOW() + INTERVAL '7 days') as at_risk,
+    COALESCE(SUM(CASE WHEN m.status = 'COMPLETED' THEN m.payment_percentage::numeric ELSE 0 END), 0) as completed_pct
+FROM milestone m
+INNER JOIN purchase_order po ON m.purchase_order_id = po.id
+WHERE {PO_FILTER}
+""")
+
+QUALITY_NCR = text(f"""
+SELECT
+    COUNT(*) as total_ncrs,
+    COUNT(*) FILTER (WHERE n.status = 'OPEN') as open_ncrs,
+    COUNT(*) FILTER (WHERE n.status = 'CLOSED') as closed_ncrs,
+    COUNT(*) FILTER (WHERE n.severity = 'CRITICAL') as critical_ncrs
+FROM ncr n
+INNER JOIN purchase_order po ON n.purchase_order_id = po.id
+WHERE {PO_FILTER}
+""")
+
+PO_COUNT = text(f"""
+SELECT COUNT(*) FROM purchase_order po
+WHERE {PO_FILTER}
+""")
+
+SUPPLIER_TOP_EXPOSURE = text(f"""
+SELECT
+    s.id as supplier_id,
+    s.name as supplier_name,
+    COALESCE(s.readiness_score::numeric, 0) as readiness_score,
+    s.status,
+    SUM(po.total_value::numeric) as total_exposure
+FROM supplier s
+INNER JOIN purchase_order po ON s.id = po.supplier_id
+WHERE {PO_FILTER}
+GROUP BY s.id, s.name, s.readiness_score, s.status
+ORDER BY total_exposure DESC
+LIMIT 10
+""")
+
+PAYMENTS = text(f"""
+SELECT
+    COUNT(*) FILTER (WHERE inv.status IN ('PENDING_APPROVAL', 'APPROVED')) as pending_count,
+    COUNT(*) FILTER (WHERE inv.status != 'PAID' AND inv.due_date < NOW()) as overdue_count,
+    COALESCE(SUM(CASE WHEN inv.status != 'PAID' AND inv.due_date < NOW() THEN inv.amount::numeric ELSE 0 END), 0) as overdue_amount,
+    AVG(EXTRACT(EPOCH FROM (inv.paid_at - inv.invoice_date)) / 86400) FILTER (WHERE inv.status = 'PAID') as avg_cycle
+FROM invoice inv
+INNER JOIN purchase_order po ON inv.purchase_order_id = po.id
+WHERE {PO_FILTER}
+""")
+
+LOGISTICS = text(f"""
+SELECT
+    COUNT(*) as total_shipments,
+    COUNT(*) FILTER (WHERE sh.status = 'IN_TRANSIT') as in_transit,
+    COUNT(*) FILTER (WHERE sh.status = 'DELIVERED') as delivered,
+    COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date <= sh.logistics_eta) as on_time,
+    COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date > sh.logistics_eta) as delayed
+FROM shipment sh
+INNER JOIN purchase_order po ON sh.purchase_order_id = po.id
+WHERE {PO_FILTER}
+""")
+
+# Planned vs actual spend per calendar bucket; :granularity is 'day', 'week'
+# or 'month' and is bound like any other parameter so the plan stays cached
+SCURVE_BUCKETED = text(f"""
+SELECT
+    DATE_TRUNC(CAST(:granularity AS text), m.expected_date)::date as bucket,
+    SUM(po.total_value::numeric * m.payment_percentage::numeric / 100) as planned_amount,
+    SUM(
+        CASE
+            WHEN m.status = 'COMPLETED'
+            THEN po.total_value::numeric * m.payment_percentage::numeric / 100
+            ELSE 0
+        END
+    ) as actual_amount
+FROM milestone m
+INNER JOIN purchase_order po ON m.purchase_order_id = po.id
+WHERE m.expected_date IS NOT NULL
+    AND {PO_FILTER}
+GROUP BY 1
+ORDER BY 1
+""")
+
+# Single-scan dashboard plan: the filtered PO set is materialized once and
+# every KPI family aggregates against it. The PO count behind the NCR rate
+# ignores the date range, so it only applies the organization/project filter.
+DASHBOARD_FUSED = text(f"""
+WITH filtered_po AS MATERIALIZED (
+    SELECT
+        po.id,
+        po.supplier_id,
+        po.status,
+        po.total_value::numeric as total_value,
+        po.retention_percentage::numeric as retention_percentage
+    FROM purchase_order po
+    WHERE {PO_FILTER}
+),
+po_stats AS (
+    SELECT
+        COUNT(*) as total_pos,
+        COUNT(*) FILTER (WHERE po.status IN ('ACTIVE', 'APPROVED')) as active_pos,
+        COALESCE(SUM(po.total_value), 0) as total_po_value,
+        COALESCE(SUM(po.retention_percentage), 0) as total_retention_pct
+    FROM filtered_po po
+),
+undated_po_stats AS (
+    SELECT COUNT(*) as undated_pos
+    FROM purchase_order po
+    WHERE po.organization_id = :org_id
+        AND (CAST(:project_id AS uuid) IS NULL OR po.project_id = CAST(:project_id AS uuid))
+),
+inv_stats AS (
+    SELECT
+        COALESCE(SUM(inv.amount::numeric) FILTER (WHERE inv.status = 'PAID'), 0) as paid_amount,
+        COUNT(*) FILTER (WHERE inv.status IN ('PENDING_APPROVAL', 'APPROVED')) as pending_count,
+        COUNT(*) FILTER (WHERE inv.status != 'PAID' AND inv.due_date < NOW()) as overdue_count,
+        COALESCE(SUM(CASE WHEN inv.status != 'PAID' AND inv.due_date < NOW() THEN inv.amount::numeric ELSE 0 END), 0) as overdue_amount,
+        AVG(EXTRACT(EPOCH FROM (inv.paid_at - inv.invoice_date)) / 86400) FILTER (WHERE inv.status = 'PAID') as avg_cycle
+    FROM invoice inv
+    INNER JOIN filtered_po po ON inv.purchase_order_id = po.id
+),
+ms_stats AS (
+    SELECT
+        COUNT(*) as total_milestones,
+        COUNT(*) FILTER (WHERE m.status = 'COMPLETED') as completed,
+        COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date < NOW()) as delayed,
+        COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date >= NOW() AND m.expected_date <= NOW() + INTERVAL '7 days') as at_risk,
+        COALESCE(SUM(CASE WHEN m.status = 'COMPLETED' THEN m.payment_percentage::numeric ELSE 0 END), 0) as completed_pct
+    FROM milestone m
+    INNER JOIN filtered_po po ON m.purchase_order_id = po.id
+),
+ncr_stats AS (
+    SELECT
+        COUNT(*) as total_ncrs,
+        COUNT(*) FILTER (WHERE n.status = 'OPEN') as open_ncrs,
+        COUNT(*) FILTER (WHERE n.status = 'CLOSED') as closed_ncrs,
+        COUNT(*) FILTER (WHERE n.severity = 'CRITICAL') as critical_ncrs
+    FROM ncr n
+    INNER JOIN filtered_po po ON n.purchase_order_id = po.id
+),
+sh_stats AS (
+    SELECT
+        COUNT(*) as total_shipments,
+        COUNT(*) FILTER (WHERE sh.status = 'IN_TRANSIT') as in_transit,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED') as delivered,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date <= sh.logistics_eta) as on_time,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date > sh.logistics_eta) as delayed
+    FROM shipment sh
+    INNER JOIN filtered_po po ON sh.purchase_order_id = po.id
+),
+top_suppliers AS (
+    SELECT
+        s.id as supplier_id,
+        s.name as supplier_name,
+        COALESCE(s.readiness_score::numeric, 0) as readiness_score,
+        s.status,
+        SUM(po.total_value) as total_exposure
+    FROM supplier s
+    INNER JOIN filtered_po po ON s.id = po.supplier_id
+    GROUP BY s.id, s.name, s.readiness_score, s.status
+    ORDER BY total_exposure DESC
+    LIMIT 10
+)
+SELECT
+    po_stats.total_pos,
+    po_stats.active_pos,
+    po_stats.total_po_value,
+    po_stats.total_retention_pct,
+    undated_po_stats.undated_pos,
+    inv_stats.paid_amount,
+    inv_stats.pending_count,
+    inv_stats.overdue_count,
+    inv_stats.overdue_amount,
+    inv_stats.avg_cycle,
+    ms_stats.total_milestones,
+    ms_stats.completed,
+    ms_stats.delayed,
+    ms_stats.at_risk,
+    ms_stats.completed_pct,
+    ncr_stats.total_ncrs,
+    ncr_stats.open_ncrs,
+    ncr_stats.closed_ncrs,
+    ncr_stats.critical_ncrs,
+    sh_stats.total_shipments,
+    sh_stats.in_transit,
+    sh_stats.delivered,
+    sh_stats.on_time,
+    sh_stats.delayed,
+    (
+        SELECT COALESCE(json_agg(json_build_array(
+            t.supplier_id, t.supplier_name, t.readiness_score, t.status, t.total_exposure
+        ) ORDER BY t.total_exposure DESC), '[]'::json)
+        FROM top_suppliers t
+    ) as suppliers
+FROM po_stats, undated_po_stats, inv_stats, ms_stats, ncr_stats, sh_stats
+""")
+
+# Progress and payment aggregates only, for dashboards whose other KPI
+# families are served from rollups (these depend on NOW() and stay live)
+DASHBOARD_LIVE = text(f"""
+WITH filtered_po AS MATERIALIZED (
+    SELECT po.id, po.status
+    FROM purchase_order po
+    WHERE {PO_FILTER}
+),
+po_stats AS (
+    SELECT
+        COUNT(*) as total_pos,
+        COUNT(*) FILTER (WHERE po.status IN ('ACTIVE', 'APPROVED')) as active_pos
+    FROM filtered_po po
+),
+inv_stats AS (
+    SELECT
+        COUNT(*) FILTER (WHERE inv.status IN ('PENDING_APPROVAL', 'APPROVED')) as pending_count,
+        COUNT(*) FILTER (WHERE inv.status != 'PAID' AND inv.due_date < NOW()) as overdue_count,
+        COALESCE(SUM(CASE WHEN inv.status != 'PAID' AND inv.due_date < NOW() THEN inv.amount::numeric ELSE 0 END), 0) as overdue_amount,
+        AVG(EXTRACT(EPOCH FROM (inv.paid_at - inv.invoice_date)) / 86400) FILTER (WHERE inv.status = 'PAID') as avg_cycle
+    FROM invoice inv
+    INNER JOIN filtered_po po ON inv.purchase_order_id = po.id
+),
+ms_stats AS (
+    SELECT
+        COUNT(*) as total_milestones,
+        COUNT(*) FILTER (WHERE m.status = 'COMPLETED') as completed,
+        COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date < NOW()) as delayed,
+        COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date >= NOW() AND m.expected_date <= NOW() + INTERVAL '7 days') as at_risk,
+        COALESCE(SUM(CASE WHEN m.status = 'COMPLETED' THEN m.payment_percentage::numeric ELSE 0 END), 0) as completed_pct
+    FROM milestone m
+    INNER JOIN filtered_po po ON m.purchase_order_id = po.id
+)
+SELECT
+    po_stats.total_pos,
+    po_stats.active_pos,
+    inv_stats.pending_count,
+    inv_stats.overdue_count,
+    inv_stats.overdue_amount,
+    inv_stats.avg_cycle,
+    ms_stats.total_milestones,
+    ms_stats.completed,
+    ms_stats.delayed,
+    ms_stats.at_risk,
+    ms_stats.completed_pct
+FROM po_stats, inv_stats, ms_stats
+""")
+
+# Dashboard KPIs for many (organization, project) scopes in one statement.
+# Scopes are passed as parallel uuid arrays (a NULL project means the whole
+# organization) and every aggregate is grouped per scope, so a PO counts
+# towards each scope it falls in. Columns after scope_idx match DASHBOARD_FUSED.
+DASHBOARD_BATCH = text("""
+WITH scopes AS (
+    SELECT s.scope_idx::int as scope_idx, s.organization_id, s.project_id
+    FROM unnest(CAST(:org_ids AS uuid[]), CAST(:project_ids AS uuid[]))
+        WITH ORDINALITY AS s(organization_id, project_id, scope_idx)
+),
+filtered_po AS MATERIALIZED (
+    SELECT
+        sc.scope_idx,
+        po.id,
+        po.supplier_id,
+        po.status,
+        po.total_value::numeric as total_value,
+        po.retention_percentage::numeric as retention_percentage
+    FROM scopes sc
+    INNER JOIN purchase_order po
+        ON po.organization_id = sc.organization_id
+        AND (sc.project_id IS NULL OR po.project_id = sc.project_id)
+    WHERE (CAST(:date_from AS date) IS NULL OR po.created_at >= CAST(:date_from AS date))
+        AND (CAST(:date_to AS date) IS NULL OR po.created_at <= CAST(:date_to AS date))
+),
+po_stats AS (
+    SELECT
+        po.scope_idx,
+        COUNT(*) as total_pos,
+        COUNT(*) FILTER (WHERE po.status IN ('ACTIVE', 'APPROVED')) as active_pos,
+        SUM(po.total_value) as total_po_value,
+        SUM(po.retention_percentage) as total_retention_pct
+    FROM filtered_po po
+    GROUP BY po.scope_idx
+),
+undated_po_stats AS (
+    SELECT sc.scope_idx, COUNT(*) as undated_pos
+    FROM scopes sc
+    INNER JOIN purchase_order po
+        ON po.organization_id = sc.organization_id
+        AND (sc.project_id IS NULL OR po.project_id = sc.project_id)
+    GROUP BY sc.scope_idx
+),
+inv_stats AS (
+    SELECT
+        po.scope_idx,
+        SUM(inv.amount::numeric) FILTER (WHERE inv.status = 'PAID') as paid_amount,
+        COUNT(*) FILTER (WHERE inv.status IN ('PENDING_APPROVAL', 'APPROVED')) as pending_count,
+        COUNT(*) FILTER (WHERE inv.status != 'PAID' AND inv.due_date < NOW()) as overdue_count,
+        SUM(CASE WHEN inv.status != 'PAID' AND inv.due_date < NOW() THEN inv.amount::numeric ELSE 0 END) as overdue_amount,
+        AVG(EXTRACT(EPOCH FROM (inv.paid_at - inv.invoice_date)) / 86400) FILTER (WHERE inv.status = 'PAID') as avg_cycle
+    FROM invoice inv
+    INNER JOIN filtered_po po ON inv.purchase_order_id = po.id
+    GROUP BY po.scope_idx
+),
+ms_stats AS (
+    SELECT
+        po.scope_idx,
+        COUNT(*) as total_milestones,
+        COUNT(*) FILTER (WHERE m.status = 'COMPLETED') as completed,
+        COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date < NOW()) as delayed,
+        COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date >= NOW() AND m.expected_date <= NOW() + INTERVAL '7 days') as at_risk,
+        SUM(CASE WHEN m.status = 'COMPLETED' THEN m.payment_percentage::numeric ELSE 0 END) as completed_pct
+    FROM milestone m
+    INNER JOIN filtered_po po ON m.purchase_order_id = po.id
+    GROUP BY po.scope_idx
+),
+ncr_stats AS (
+    SELECT
+        po.scope_idx,
+        COUNT(*) as total_ncrs,
+        COUNT(*) FILTER (WHERE n.status = 'OPEN') as open_ncrs,
+        COUNT(*) FILTER (WHERE n.status = 'CLOSED') as closed_ncrs,
+        COUNT(*) FILTER (WHERE n.severity = 'CRITICAL') as critical_ncrs
+    FROM ncr n
+    INNER JOIN filtered_po po ON n.purchase_order_id = po.id
+    GROUP BY po.scope_idx
+),
+sh_stats AS (
+    SELECT
+        po.scope_idx,
+        COUNT(*) as total_shipments,
+        COUNT(*) FILTER (WHERE sh.status = 'IN_TRANSIT') as in_transit,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED') as delivered,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date <= sh.logistics_eta) as on_time,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date > sh.logistics_eta) as delayed
+    FROM shipment sh
+    INNER JOIN filtered_po po ON sh.purchase_order_id = po.id
+    GROUP BY po.scope_idx
+),
+ranked_suppliers AS (
+    SELECT
+        po.scope_idx,
+        s.id as supplier_id,
+        s.name as supplier_name,
+        COALESCE(s.readiness_score::numeric, 0) as readiness_score,
+        s.status,
+        SUM(po.total_value) as total_exposure,
+        ROW_NUMBER() OVER (PARTITION BY po.scope_idx ORDER BY SUM(po.total_value) DESC) as exposure_rank
+    FROM supplier s
+    INNER JOIN filtered_po po ON s.id = po.supplier_id
+    GROUP BY po.scope_idx, s.id, s.name, s.readiness_score, s.status
+),
+top_suppliers AS (
+    SELECT
+        t.scope_idx,
+        json_agg(json_build_array(
+            t.supplier_id, t.supplier_name, t.readiness_score, t.status, t.total_exposure
+        ) ORDER BY t.total_exposure DESC) as suppliers
+    FROM ranked_suppliers t
+    WHERE t.exposure_rank <= 10
+    GROUP BY t.scope_idx
+)
+SELECT
+    sc.scope_idx,
+    COALESCE(po_stats.total_pos, 0),
+    COALESCE(po_stats.active_pos, 0),
+    COALESCE(po_stats.total_po_value, 0),
+    COALESCE(po_stats.total_retention_pct, 0),
+    COALESCE(undated_po_stats.undated_pos, 0),
+    COALESCE(inv_stats.paid_amount, 0),
+    COALESCE(inv_stats.pending_count, 0),
+    COALESCE(inv_stats.overdue_count, 0),
+    COALESCE(inv_stats.overdue_amount, 0),
+    inv_stats.avg_cycle,
+    COALESCE(ms_stats.total_milestones, 0),
+    COALESCE(ms_stats.completed, 0),
+    COALESCE(ms_stats.delayed, 0),
+    COALESCE(ms_stats.at_risk, 0),
+    COALESCE(ms_stats.completed_pct, 0),
+    COALESCE(ncr_stats.total_ncrs, 0),
+    COALESCE(ncr_stats.open_ncrs, 0),
+    COALESCE(ncr_stats.closed_ncrs, 0),
+    COALESCE(ncr_stats.critical_ncrs, 0),
+    COALESCE(sh_stats.total_shipments, 0),
+    COALESCE(sh_stats.in_transit, 0),
+    COALESCE(sh_stats.delivered, 0),
+    COALESCE(sh_stats.on_time, 0),
+    COALESCE(sh_stats.delayed, 0),
+    COALESCE(top_suppliers.suppliers, '[]'::json)
+FROM scopes sc
+LEFT JOIN po_stats ON po_stats.scope_idx = sc.scope_idx
+LEFT JOIN undated_po_stats ON undated_po_stats.scope_idx = sc.scope_idx
+LEFT JOIN inv_stats ON inv_stats.scope_idx = sc.scope_idx
+LEFT JOIN ms_stats ON ms_stats.scope_idx = sc.scope_idx
+LEFT JOIN ncr_stats ON ncr_stats.scope_idx = sc.scope_idx
+LEFT JOIN sh_stats ON sh_stats.scope_idx = sc.scope_idx
+LEFT JOIN top_suppliers ON top_suppliers.scope_idx = sc.scope_idx
+ORDER BY sc.scope_idx
+""")
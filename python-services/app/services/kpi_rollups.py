@@ -0,0 +1,439 @@
+"""
+KPI Rollups
+Incrementally refreshed per-(organization, project, day) aggregate tables.
+
+Rollup rows are keyed on the PO creation day, the same column the KPI date
+filter applies to, so any date range is answered by summing O(days) rows.
+POs created exactly at midnight get their own row per day so the inclusive
+date_to boundary matches the live filter.
+Only time-invariant aggregates are rolled up (financial, quality, logistics
+and supplier exposure). Progress and payment KPIs count milestones and
+invoices relative to NOW() and are always computed live.
+
+Refresh is incremental: every PO whose row, or any of whose invoices,
+milestones, NCRs or shipments, changed since the organization's updated_at
+watermark marks its (project, day) key dirty, and dirty keys are recomputed
+from source. This relies on writers bumping updated_at (the Drizzle schema
+does it on every update); writes that bypass it, hard deletes and POs moving
+between projects are not visible to the watermark and need a full rebuild
+(refresh(full=True)).
+
+Writes reported through /api/kpi/cache/invalidate mark the organization's
+rollups invalidated, and queries go live until the next refresh has picked
+them up, so a dashboard never lags behind an invalidated write.
+"""
+import time
+from datetime import date
+from typing import Optional, Dict, Any, List, TYPE_CHECKING
+
+from sqlalchemy import text
+
+from app.config import get_settings
+from app.services.kpi_queries import PO_FILTER, po_filter_params
+
+if TYPE_CHECKING:
+    from app.services.kpi_service import KPIService
+
+
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS kpi_daily_rollup (
+        organization_id uuid NOT NULL,
+        project_id uuid NOT NULL,
+        day date NOT NULL,
+        at_midnight boolean NOT NULL,
+        po_count bigint NOT NULL DEFAULT 0,
+        po_total_value numeric NOT NULL DEFAULT 0,
+        po_retention_pct_sum numeric NOT NULL DEFAULT 0,
+        paid_amount numeric NOT NULL DEFAULT 0,
+        ncr_count bigint NOT NULL DEFAULT 0,
+        ncr_open bigint NOT NULL DEFAULT 0,
+        ncr_closed bigint NOT NULL DEFAULT 0,
+        ncr_critical bigint NOT NULL DEFAULT 0,
+        shipment_count bigint NOT NULL DEFAULT 0,
+        shipment_in_transit bigint NOT NULL DEFAULT 0,
+        shipment_delivered bigint NOT NULL DEFAULT 0,
+        shipment_on_time bigint NOT NULL DEFAULT 0,
+        shipment_delayed bigint NOT NULL DEFAULT 0,
+        PRIMARY KEY (organization_id, project_id, day, at_midnight)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS kpi_daily_supplier_rollup (
+        organization_id uuid NOT NULL,
+        project_id uuid NOT NULL,
+        day date NOT NULL,
+        at_midnight boolean NOT NULL,
+        supplier_id uuid NOT NULL,
+        exposure numeric NOT NULL DEFAULT 0,
+        PRIMARY KEY (organization_id, project_id, day, at_midnight, supplier_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS kpi_rollup_state (
+        organization_id uuid PRIMARY KEY,
+        watermark timestamp NOT NULL,
+        refreshed_at timestamp NOT NULL DEFAULT NOW(),
+        invalidated_at timestamp
+    )
+    """,
+    # Added after the table first shipped
+    "ALTER TABLE kpi_rollup_state ADD COLUMN IF NOT EXISTS invalidated_at timestamp",
+]
+
+# Entity types whose writes change rolled-up aggregates
+ROLLUP_ENTITY_TYPES = ["purchase_order", "invoice", "ncr", "shipment"]
+
+# Rows written while a refresh runs can commit with an updated_at slightly
+# before our watermark; re-scanning a small overlap window catches them
+WATERMARK_OVERLAP = "INTERVAL '30 seconds'"
+
+CREATE_DIRTY = text("""
+CREATE TEMP TABLE kpi_rollup_dirty (
+    organization_id uuid NOT NULL,
+    project_id uuid NOT NULL,
+    day date NOT NULL
+) ON COMMIT DROP
+""")
+
+# Dirty (project, day) keys for one organization. A NULL watermark marks
+# every key dirty (full build).
+MARK_DIRTY = text(f"""
+INSERT INTO kpi_rollup_dirty (organization_id, project_id, day)
+WITH changed_po AS (
+    SELECT po.id FROM purchase_order po
+    WHERE po.organization_id = :org_id
+        AND (CAST(:watermark AS timestamp) IS NULL OR po.updated_at > CAST(:watermark AS timestamp) - {WATERMARK_OVERLAP})
+    UNION
+    SELECT inv.purchase_order_id FROM invoice inv
+    WHERE CAST(:watermark AS timestamp) IS NOT NULL AND inv.updated_at > CAST(:watermark AS timestamp) - {WATERMARK_OVERLAP}
+    UNION
+    SELECT m.purchase_order_id FROM milestone m
+    WHERE CAST(:watermark AS timestamp) IS NOT NULL AND m.updated_at > CAST(:watermark AS timestamp) - {WATERMARK_OVERLAP}
+    UNION
+    SELECT n.purchase_order_id FROM ncr n
+    WHERE CAST(:watermark AS timestamp) IS NOT NULL AND n.updated_at > CAST(:watermark AS timestamp) - {WATERMARK_OVERLAP}
+    UNION
+    SELECT sh.purchase_order_id FROM shipment sh
+    WHERE CAST(:watermark AS timestamp) IS NOT NULL AND sh.updated_at > CAST(:watermark AS timestamp) - {WATERMARK_OVERLAP}
+)
+SELECT DISTINCT po.organization_id, po.project_id, po.created_at::date as day
+FROM purchase_order po
+INNER JOIN changed_po c ON c.id = po.id
+WHERE po.organization_id = :org_id
+""")
+
+CLEAR_DIRTY = [
+    text("""
+    DELETE FROM kpi_daily_rollup r
+    USING kpi_rollup_dirty d
+    WHERE r.organization_id = d.organization_id AND r.project_id = d.project_id AND r.day = d.day
+    """),
+    text("""
+    DELETE FROM kpi_daily_supplier_rollup r
+    USING kpi_rollup_dirty d
+    WHERE r.organization_id = d.organization_id AND r.project_id = d.project_id AND r.day = d.day
+    """),
+]
+
+# Child tables are pre-aggregated per PO so the joins don't fan out
+REBUILD_DIRTY = text("""
+WITH dirty_po AS MATERIALIZED (
+    SELECT po.*, po.created_at = po.created_at::date as at_midnight
+    FROM purchase_order po
+    INNER JOIN kpi_rollup_dirty d
+        ON po.organization_id = d.organization_id
+        AND po.project_id = d.project_id
+        AND po.created_at::date = d.day
+),
+inv AS (
+    SELECT inv.purchase_order_id,
+        SUM(inv.amount::numeric) FILTER (WHERE inv.status = 'PAID') as paid_amount
+    FROM invoice inv
+    INNER JOIN dirty_po po ON inv.purchase_order_id = po.id
+    GROUP BY inv.purchase_order_id
+),
+ncrs AS (
+    SELECT n.purchase_order_id,
+        COUNT(*) as total,
+        COUNT(*) FILTER (WHERE n.status = 'OPEN') as open,
+        COUNT(*) FILTER (WHERE n.status = 'CLOSED') as closed,
+        COUNT(*) FILTER (WHERE n.severity = 'CRITICAL') as critical
+    FROM ncr n
+    INNER JOIN dirty_po po ON n.purchase_order_id = po.id
+    GROUP BY n.purchase_order_id
+),
+shipments AS (
+    SELECT sh.purchase_order_id,
+        COUNT(*) as total,
+        COUNT(*) FILTER (WHERE sh.status = 'IN_TRANSIT') as in_transit,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED') as delivered,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date <= sh.logistics_eta) as on_time,
+        COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date > sh.logistics_eta) as delayed
+    FROM shipment sh
+    INNER JOIN dirty_po po ON sh.purchase_order_id = po.id
+    GROUP BY sh.purchase_order_id
+),
+supplier_rows AS (
+    INSERT INTO kpi_daily_supplier_rollup (organization_id, project_id, day, at_midnight, supplier_id, exposure)
+    SELECT po.organization_id, po.project_id, po.created_at::date, po.at_midnight, po.supplier_id, SUM(po.total_value::numeric)
+    FROM dirty_po po
+    GROUP BY po.organization_id, po.project_id, po.created_at::date, po.at_midnight, po.supplier_id
+)
+INSERT INTO kpi_daily_rollup (
+    organization_id, project_id, day, at_midnight,
+    po_count, po_total_value, po_retention_pct_sum, paid_amount,
+    ncr_count, ncr_open, ncr_closed, ncr_critical,
+    shipment_count, shipment_in_transit, shipment_delivered, shipment_on_time, shipment_delayed
+)
+SELECT
+    po.organization_id,
+    po.project_id,
+    po.created_at::date,
+    po.at_midnight,
+    COUNT(*),
+    COALESCE(SUM(po.total_value::numeric), 0),
+    COALESCE(SUM(po.retention_percentage::numeric), 0),
+    COALESCE(SUM(inv.paid_amount), 0),
+    COALESCE(SUM(ncrs.total), 0),
+    COALESCE(SUM(ncrs.open), 0),
+    COALESCE(SUM(ncrs.closed), 0),
+    COALESCE(SUM(ncrs.critical), 0),
+    COALESCE(SUM(shipments.total), 0),
+    COALESCE(SUM(shipments.in_transit), 0),
+    COALESCE(SUM(shipments.delivered), 0),
+    COALESCE(SUM(shipments.on_time), 0),
+    COALESCE(SUM(shipments.delayed), 0)
+FROM dirty_po po
+LEFT JOIN inv ON inv.purchase_order_id = po.id
+LEFT JOIN ncrs ON ncrs.purchase_order_id = po.id
+LEFT JOIN shipments ON shipments.purchase_order_id = po.id
+GROUP BY po.organization_id, po.project_id, po.created_at::date, po.at_midnight
+""")
+
+GET_STATE = text("""
+SELECT watermark
+FROM kpi_rollup_state
+WHERE organization_id = :org_id
+""")
+
+# Whether the rollups can answer a scope and date range. They are invalidated
+# once a write was reported after the watermark the last refresh read up to,
+# and a range reaching the watermark day is only covered if no PO in it was
+# created after the watermark (such POs have no rollup row yet).
+GET_COVERAGE = text(f"""
+SELECT
+    EXTRACT(EPOCH FROM (NOW() - s.refreshed_at)) as age_seconds,
+    COALESCE(s.invalidated_at > s.watermark, false) as invalidated,
+    (CAST(:date_to AS date) IS NULL OR CAST(:date_to AS date) >= s.watermark::date)
+    AND EXISTS (
+        SELECT 1 FROM purchase_order po
+        WHERE {PO_FILTER}
+            AND po.created_at > s.watermark - {WATERMARK_OVERLAP}
+    ) as uncovered_pos
+FROM kpi_rollup_state s
+WHERE s.organization_id = :org_id
+""")
+
+SAVE_STATE = text("""
+INSERT INTO kpi_rollup_state (organization_id, watermark, refreshed_at)
+VALUES (:org_id, :watermark, NOW())
+ON CONFLICT (organization_id) DO UPDATE
+SET watermark = EXCLUDED.watermark, refreshed_at = EXCLUDED.refreshed_at
+""")
+
+MARK_INVALIDATED = text("""
+UPDATE kpi_rollup_state SET invalidated_at = NOW()
+WHERE organization_id = :org_id
+""")
+
+ROLLUP_ORGANIZATIONS = text("SELECT organization_id FROM kpi_rollup_state")
+
+# Rollup days are PO creation days: created_at >= date_from is day >= date_from,
+# and created_at <= date_to (midnight) is every earlier day plus the POs created
+# exactly at midnight on date_to, which is why rows are split on at_midnight
+ROLLUP_FILTER = """
+    r.organization_id = :org_id
+    AND (CAST(:project_id AS uuid) IS NULL OR r.project_id = CAST(:project_id AS uuid))
+    AND (CAST(:date_from AS date) IS NULL OR r.day >= CAST(:date_from AS date))
+    AND (
+        CAST(:date_to AS date) IS NULL
+        OR r.day < CAST(:date_to AS date)
+        OR (r.day = CAST(:date_to AS date) AND r.at_midnight)
+    )
+"""
+
+READ_TOTALS = text(f"""
+SELECT
+    COALESCE(SUM(r.po_total_value), 0) as total_po_value,
+    COALESCE(SUM(r.po_retention_pct_sum), 0) as total_retention_pct,
+    COALESCE(SUM(r.paid_amount), 0) as paid_amount,
+    COALESCE(SUM(r.ncr_count), 0) as total_ncrs,
+    COALESCE(SUM(r.ncr_open), 0) as open_ncrs,
+    COALESCE(SUM(r.ncr_closed), 0) as closed_ncrs,
+    COALESCE(SUM(r.ncr_critical), 0) as critical_ncrs,
+    COALESCE(SUM(r.shipment_count), 0) as total_shipments,
+    COALESCE(SUM(r.shipment_in_transit), 0) as in_transit,
+    COALESCE(SUM(r.shipment_delivered), 0) as delivered,
+    COALESCE(SUM(r.shipment_on_time), 0) as on_time,
+    COALESCE(SUM(r.shipment_delayed), 0) as delayed,
+    (
+        SELECT COALESCE(SUM(u.po_count), 0)
+        FROM kpi_daily_rollup u
+        WHERE u.organization_id = :org_id
+            AND (CAST(:project_id AS uuid) IS NULL OR u.project_id = CAST(:project_id AS uuid))
+    ) as undated_pos
+FROM kpi_daily_rollup r
+WHERE {ROLLUP_FILTER}
+""")
+
+READ_SUPPLIERS = text(f"""
+SELECT
+    s.id as supplier_id,
+    s.name as supplier_name,
+    COALESCE(s.readiness_score::numeric, 0) as readiness_score,
+    s.status,
+    SUM(r.exposure) as total_exposure
+FROM kpi_daily_supplier_rollup r
+INNER JOIN supplier s ON s.id = r.supplier_id
+WHERE {ROLLUP_FILTER}
+GROUP BY s.id, s.name, s.readiness_score, s.status
+ORDER BY total_exposure DESC
+LIMIT 10
+""")
+
+
+class KPIRollups:
+    """
+    Rollup maintenance and reads for KPIService
+    """
+
+    def __init__(self, kpi_service: "KPIService"):
+        settings = get_settings()
+        self.kpi_service = kpi_service
+        self.max_staleness_seconds = settings.kpi_rollup_max_staleness_seconds
+        self._schema_ready = False
+
+    async def ensure_schema(self) -> None:
+        """Create the rollup tables if they don't exist yet"""
+        if self._schema_ready:
+            return
+        async with self.kpi_service._begin() as conn:
+            for statement in SCHEMA_STATEMENTS:
+                await conn.execute(text(statement))
+        self._schema_ready = True
+
+    async def refresh(self, organization_id: str, full: bool = False) -> Dict[str, Any]:
+        """
+        Bring an organization's rollups up to date.
+        The first refresh (or full=True) rebuilds every day; later ones only
+        recompute days touched since the stored watermark.
+        """
+        await self.ensure_schema()
+        started = time.perf_counter()
+
+        async with self.kpi_service._begin("rollups") as conn:
+            # Serialize refreshes per organization
+            await conn.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext('kpi_rollup:' || :org_id))"),
+                {"org_id": organization_id}
+            )
+            state = (await conn.execute(GET_STATE, {"org_id": organization_id})).fetchone()
+            watermark = None if full or not state else state[0]
+            new_watermark = (await conn.execute(text("SELECT NOW()::timestamp"))).scalar()
+
+            await conn.execute(CREATE_DIRTY)
+            result = await conn.execute(MARK_DIRTY, {"org_id": organization_id, "watermark": watermark})
+            dirty_days = result.rowcount
+            if full:
+                # Also drop days that no longer have any POs
+                await conn.execute(
+                    text("DELETE FROM kpi_daily_rollup WHERE organization_id = :org_id"),
+                    {"org_id": organization_id}
+                )
+                await conn.execute(
+                    text("DELETE FROM kpi_daily_supplier_rollup WHERE organization_id = :org_id"),
+                    {"org_id": organization_id}
+                )
+            else:
+                for statement in CLEAR_DIRTY:
+                    await conn.execute(statement)
+            await self.kpi_service._execute(conn, "rollups", "rollup_rebuild", REBUILD_DIRTY)
+            await conn.execute(SAVE_STATE, {"org_id": organization_id, "watermark": new_watermark})
+
+        return {
+            "organizationId": organization_id,
+            "full": watermark is None,
+            "dirtyDays": int(dirty_days),
+            "durationMs": (time.perf_counter() - started) * 1000,
+        }
+
+    async def refresh_all(self) -> List[Dict[str, Any]]:
+        """Incrementally refresh every organization that has rollups"""
+        await self.ensure_schema()
+        async with self.kpi_service._begin() as conn:
+            rows = (await conn.execute(ROLLUP_ORGANIZATIONS)).fetchall()
+        return [await self.refresh(str(row[0])) for row in rows]
+
+    async def invalidate(self, organization_id: str, entity_types: Optional[List[str]] = None) -> bool:
+        """
+        Record writes to the given entity types (all if none are given); the
+        organization's rollups stop answering queries until the next refresh.
+        Returns whether the writes affect rollups at all.
+        """
+        if entity_types and not set(entity_types) & set(ROLLUP_ENTITY_TYPES):
+            return False
+        await self.ensure_schema()
+        async with self.kpi_service._begin("rollups") as conn:
+            await conn.execute(MARK_INVALIDATED, {"org_id": organization_id})
+        return True
+
+    async def covers(
+        self,
+        organization_id: str,
+        project_id: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> bool:
+        """
+        True when the rollups can answer this scope and date range: refreshed
+        within the staleness limit, no write invalidated since, and no PO in
+        the range created after the watermark. Checked in the database on
+        every call (only on KPI cache misses) so an invalidation made through
+        any instance takes effect immediately.
+        """
+        await self.ensure_schema()
+        params = po_filter_params(organization_id, project_id, date_from, date_to)
+        async with self.kpi_service._begin("rollups") as conn:
+            coverage = (await self.kpi_service._execute(
+                conn, "rollups", "rollup_coverage", GET_COVERAGE, params
+            )).fetchone()
+        if not coverage:
+            return False
+        age_seconds, invalidated, uncovered_pos = coverage
+        return float(age_seconds) <= self.max_staleness_seconds and not invalidated and not uncovered_pos
+
+    async def read_totals(
+        self,
+        organization_id: str,
+        project_id: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> Any:
+        """Summed financial, quality and logistics aggregates for a scope"""
+        params = po_filter_params(organization_id, project_id, date_from, date_to)
+        async with self.kpi_service._begin("rollups") as conn:
+            return (await self.kpi_service._execute(conn, "rollups", "rollup_totals", READ_TOTALS, params)).fetchone()
+
+    async def read_suppliers(
+        self,
+        organization_id: str,
+        project_id: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> List[Any]:
+        """Top-exposure supplier rows for a scope"""
+        params = po_filter_params(organization_id, project_id, date_from, date_to)
+        async with self.kpi_service._begin("rollups") as conn:
+            return (await self.kpi_service._execute(conn, "rollups", "rollup_suppliers", READ_SUPPLIERS, params)).fetchall()
+
@@ -3,17 +3,30 @@ KPI Calculation Service
 Handles all dashboard KPI calculations using Pandas for efficient data processing
 """
 import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, date
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from decimal import Decimal
 
-import pandas as pd
-import numpy as np
-from sqlalchemy import create_engine, text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Result
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncConnection
 from sqlalchemy.orm import sessionmaker
 
 from app.config import get_settings
+from app.serialization import as_float, as_int, records_frame, to_records
+from app.services import kpi_queries as queries
+from app.services import kpi_rollups
+from app.services import scurve
+from app.services import kpi_tracing as tracing
+from app.services.kpi_rollups import KPIRollups
+
+# Connection record info keys for timing new DBAPI connections
+_CONNECT_STARTED = "kpi_connect_started"
+_CONNECT_SECONDS = "kpi_connect_seconds"
 
 
 class KPIService:
@@ -47,23 +60,179 @@ class KPIService:
             base_url = database_url.split("?")[0]
             database_url = base_url
         
-        # Create engine with SSL enabled for Neon
+        # Per-connection prepared statement cache; every KPI query has a fixed
+        # shape so each is prepared once per connection and then reused
+        database_url += f"?prepared_statement_cache_size={settings.db_statement_cache_size}"
+        
+        # Create engine with SSL enabled for Neon and an explicitly bounded pool,
+        # sized so the dashboard fan-out never queues behind itself
         self.engine = create_async_engine(
             database_url, 
             echo=False,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
             connect_args={"ssl": True}  # Enable SSL for Neon
         )
+        
+        # Pool checkout metrics
+        self._max_overflow = settings.db_max_overflow
+        self._pool_acquisitions = 0
+        self._pool_wait_total = 0.0
+        self._pool_wait_max = 0.0
+        self._pool_timeouts = 0
+        self._pool_connects = 0
+        self._pool_connect_total = 0.0
+        self._pool_connect_max = 0.0
+        
+        # A checkout that has to open a new connection (TCP + TLS + auth) also
+        # pays for that; time it on the connection record so _begin can report
+        # it apart from the actual wait for a free connection
+        event.listen(self.engine.sync_engine, "do_connect", self._on_connect_started)
+        event.listen(self.engine.sync_engine, "connect", self._on_connected)
+        
+        # Pre-aggregated daily rollups (opt-in, they create their own tables)
+        self.rollups = KPIRollups(self) if settings.kpi_rollups_enabled else None
+    
+    @staticmethod
+    def _on_connect_started(dialect, conn_rec, cargs, cparams) -> None:
+        conn_rec.info[_CONNECT_STARTED] = time.perf_counter()
+    
+    @staticmethod
+    def _on_connected(dbapi_connection, connection_record) -> None:
+        started = connection_record.info.pop(_CONNECT_STARTED, None)
+        if started is not None:
+            connection_record.info[_CONNECT_SECONDS] = time.perf_counter() - started
+    
+    @staticmethod
+    def _take_connect_time(conn: AsyncConnection) -> Optional[float]:
+        """Time spent opening a new connection during the last checkout of conn, if any"""
+        return conn.sync_connection.connection.info.pop(_CONNECT_SECONDS, None)
+    
+    @asynccontextmanager
+    async def _begin(self, family: str = "other") -> AsyncIterator[AsyncConnection]:
+        """
+        Check out a pooled connection inside a transaction, recording pool wait
+        time and, separately, the time spent opening a new connection
+        """
+        started = time.perf_counter()
+        try:
+            conn = await self.engine.connect()
+        except PoolTimeoutError:
+            self._pool_timeouts += 1
+            raise
+        acquired = time.perf_counter() - started
+        connect = self._take_connect_time(conn)
+        wait = max(acquired - (connect or 0.0), 0.0)
+        if connect is not None:
+            self._pool_connects += 1
+            self._pool_connect_total += connect
+            self._pool_connect_max = max(self._pool_connect_max, connect)
+            tracing.metrics.record_pool_connect(family, connect)
+        self._pool_acquisitions += 1
+        self._pool_wait_total += wait
+        self._pool_wait_max = max(self._pool_wait_max, wait)
+        tracing.metrics.record_pool_wait(family, wait)
+        
+        try:
+            async with conn.begin():
+                yield conn
+        finally:
+            await conn.close()
+    
+    async def _execute(
+        self,
+        conn: AsyncConnection,
+        family: str,
+        name: str,
+        statement: Any,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Result:
+        """
+        Execute a KPI query, recording its duration and row count for the
+        request trace, the metrics histograms and the slow-query log
+        """
+        started = time.perf_counter()
+        result = await conn.execute(statement, params)
+        if not result.returns_rows:
+            tracing.metrics.record_query(family, name, time.perf_counter() - started, max(result.rowcount, 0), params)
+            return result
+        
+        # Results are already buffered; freezing lets us count rows and hand
+        # back an equivalent Result
+        frozen = result.freeze()
+        tracing.metrics.record_query(family, name, time.perf_counter() - started, len(frozen.data), params)
+        return frozen()
+    
+    async def warm_up(self, connections: int) -> int:
+        """
+        Open and validate pooled connections up front so the first dashboard
+        request after a deploy doesn't pay for the TLS handshakes.
+        Returns the number of connections warmed.
+        """
+        connections = min(connections, self.engine.pool.size())
+        
+        async def open_connection() -> AsyncConnection:
+            conn = await self.engine.connect()
+            # Not a request checkout; don't let it show up in the next one's metrics
+            self._take_connect_time(conn)
+            await conn.execute(text("SELECT 1"))
+            return conn
+        
+        # Hold them all open at once, otherwise the pool would hand the same one back
+        results = await asyncio.gather(
+            *(open_connection() for _ in range(connections)),
+            return_exceptions=True
+        )
+        warmed = 0
+        for result in results:
+            if isinstance(result, BaseException):
+                print(f"[KPI] Pool warm-up connection failed: {result}")
+                continue
+            await result.close()
+            warmed += 1
+        return warmed
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Pool occupancy, checkout wait-time and new-connection metrics"""
+        pool = self.engine.pool
+        return {
+            "size": pool.size(),
+            "checkedIn": pool.checkedin(),
+            "checkedOut": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "maxOverflow": self._max_overflow,
+            "acquisitions": self._pool_acquisitions,
+            "avgWaitMs": (self._pool_wait_total / self._pool_acquisitions * 1000) if self._pool_acquisitions else 0,
+            "maxWaitMs": self._pool_wait_max * 1000,
+            "timeouts": self._pool_timeouts,
+            "connects": self._pool_connects,
+            "avgConnectMs": (self._pool_connect_total / self._pool_connects * 1000) if self._pool_connects else 0,
+            "maxConnectMs": self._pool_connect_max * 1000,
+        }
     
     async def get_dashboard_kpis(
         self,
         organization_id: str,
         project_id: Optional[str] = None,
         date_from: Optional[date] = None,
-        date_to: Optional[date] = None
+        date_to: Optional[date] = None,
+        fused: bool = True
     ) -> Dict[str, Any]:
         """
         Get all dashboard KPIs in one optimized call
+        
+        fused=True resolves the filtered PO set once and computes every KPI
+        family in a single round trip (or reads daily rollups when they are
+        fresh); fused=False fans out to the per-family methods.
         """
+        if fused:
+            if await self._use_rollups(organization_id, project_id, date_from, date_to):
+                return await self._get_dashboard_kpis_rollup(organization_id, project_id, date_from, date_to)
+            return await self._get_dashboard_kpis_fused(organization_id, project_id, date_from, date_to)
+        
         # Run all KPI calculations concurrently
         results = await asyncio.gather(
             self.get_financial_kpis(organization_id, project_id, date_from, date_to),
@@ -84,16 +253,115 @@ class KPIService:
             "timestamp": datetime.now().isoformat()
         }
     
-    def _build_po_filter(self, project_id: Optional[str], date_from: Optional[date], date_to: Optional[date]) -> str:
-        """Build dynamic WHERE clause for PO filtering"""
-        conditions = []
-        if project_id:
-            conditions.append(f"po.project_id = '{project_id}'")
-        if date_from:
-            conditions.append(f"po.created_at >= '{date_from}'")
-        if date_to:
-            conditions.append(f"po.created_at <= '{date_to}'")
-        return " AND ".join(conditions) if conditions else "TRUE"
+    async def _get_dashboard_kpis_fused(
+        self,
+        organization_id: str,
+        project_id: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> Dict[str, Any]:
+        """
+        Single-scan dashboard query plan.
+        The filtered PO set is materialized once as a CTE and every KPI family
+        aggregates against it, so the whole dashboard costs one round trip.
+        """
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
+        
+        async with self._begin("dashboard") as conn:
+            result = await self._execute(conn, "dashboard", "dashboard_fused", queries.DASHBOARD_FUSED, params)
+            row = result.fetchone()
+        
+        return self._format_dashboard_row(row)
+    
+    async def get_dashboard_kpis_batch(
+        self,
+        scopes: List[Tuple[str, Optional[str]]],
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Dashboard KPIs for many (organization_id, project_id) scopes at once.
+        Every scope is aggregated in one grouped statement, so a portfolio of
+        N projects costs one round trip instead of N dashboard calls.
+        Results are returned in the order of `scopes`.
+        """
+        if not scopes:
+            return []
+        
+        params = {
+            "org_ids": [organization_id for organization_id, _ in scopes],
+            "project_ids": [project_id for _, project_id in scopes],
+            "date_from": date_from,
+            "date_to": date_to,
+        }
+        
+        async with self._begin("dashboard") as conn:
+            result = await self._execute(conn, "dashboard", "dashboard_batch", queries.DASHBOARD_BATCH, params)
+            rows = result.fetchall()
+        
+        # Drop the leading scope_idx; the rest matches the fused dashboard row
+        return [self._format_dashboard_row(row[1:]) for row in rows]
+    
+    def _format_dashboard_row(self, row: Any) -> Dict[str, Any]:
+        """Shape a DASHBOARD_FUSED-style row into the dashboard payload"""
+        supplier_rows = row[24] if row else []
+        if isinstance(supplier_rows, str):
+            supplier_rows = json.loads(supplier_rows)
+        
+        return {
+            "financial": self._format_financial_kpis(row[2], row[3], row[5]),
+            "progress": self._format_progress_kpis((row[0], row[1], row[2]), row[10:15]),
+            "quality": self._format_quality_kpis(row[15:19], int(row[4])),
+            "suppliers": self._format_supplier_kpis(supplier_rows),
+            "payments": self._format_payment_kpis((row[6], row[7], row[8], row[9])),
+            "logistics": self._format_logistics_kpis(row[19:24]),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    async def _get_dashboard_kpis_rollup(
+        self,
+        organization_id: str,
+        project_id: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> Dict[str, Any]:
+        """
+        Dashboard served from daily rollups.
+        Financial, quality, supplier and logistics KPIs sum O(days) rollup rows;
+        progress and payments (NOW()-relative) come from one live query.
+        """
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
+        
+        async with self._begin("dashboard") as conn:
+            totals = (await self._execute(conn, "dashboard", "rollup_totals", kpi_rollups.READ_TOTALS, params)).fetchone()
+            supplier_rows = (await self._execute(conn, "dashboard", "rollup_suppliers", kpi_rollups.READ_SUPPLIERS, params)).fetchall()
+            live = (await self._execute(conn, "dashboard", "dashboard_live", queries.DASHBOARD_LIVE, params)).fetchone()
+        
+        return {
+            "financial": self._format_financial_kpis(totals[0], totals[1], totals[2]),
+            "progress": self._format_progress_kpis((live[0], live[1]), live[6:11]),
+            "quality": self._format_quality_kpis(totals[3:7], int(totals[12])),
+            "suppliers": self._format_supplier_kpis(supplier_rows),
+            "payments": self._format_payment_kpis(live[2:6]),
+            "logistics": self._format_logistics_kpis(totals[7:12]),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    async def _use_rollups(
+        self,
+        organization_id: str,
+        project_id: Optional[str] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> bool:
+        """Whether rollups are enabled, fresh and cover this scope and date range"""
+        if self.rollups is None:
+            return False
+        try:
+            return await self.rollups.covers(organization_id, project_id, date_from, date_to)
+        except Exception as e:
+            print(f"[KPI] Rollup coverage check failed, using live queries: {e}")
+            return False
     
     async def get_financial_kpis(
         self,
@@ -109,46 +377,32 @@ class KPIService:
         - Total Unpaid = Committed - Paid
         - Retention Held = Σ(Retention % × Paid Amount)
         """
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        query = f"""
-        SELECT 
-            COALESCE(SUM(po.total_value::numeric), 0) as total_po_value,
-            COALESCE(SUM(po.retention_percentage::numeric), 0) as total_retention_pct
-        FROM purchase_order po
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        """
-        
-        async with self.engine.begin() as conn:
-            result = await conn.execute(
-                text(query),
-                {"org_id": organization_id}
-            )
-            row = result.fetchone()
+        if await self._use_rollups(organization_id, project_id, date_from, date_to):
+            totals = await self.rollups.read_totals(organization_id, project_id, date_from, date_to)
+            return self._format_financial_kpis(totals[0], totals[1], totals[2])
         
-        total_committed = float(row[0]) if row and row[0] else 0
-        retention_pct = float(row[1]) if row and row[1] else 0
-        
-        # Get paid invoices
-        inv_query = f"""
-        SELECT 
-            COALESCE(SUM(inv.amount::numeric), 0) as paid_amount
-        FROM invoice inv
-        INNER JOIN purchase_order po ON inv.purchase_order_id = po.id
-        WHERE po.organization_id = :org_id
-            AND inv.status = 'PAID'
-            AND {extra_filter}
-        """
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(
-                text(inv_query),
-                {"org_id": organization_id}
-            )
+        async with self._begin("financial") as conn:
+            result = await self._execute(conn, "financial", "financial_po", queries.FINANCIAL_PO, params)
+            row = result.fetchone()
+            
+            # Get paid invoices
+            result = await self._execute(conn, "financial", "financial_paid", queries.FINANCIAL_PAID, params)
             inv_row = result.fetchone()
         
-        total_paid = float(inv_row[0]) if inv_row and inv_row[0] else 0
+        return self._format_financial_kpis(
+            row[0] if row else None,
+            row[1] if row else None,
+            inv_row[0] if inv_row else None
+        )
+    
+    @staticmethod
+    def _format_financial_kpis(total_po_value: Any, total_retention_pct: Any, paid_amount: Any) -> Dict[str, Any]:
+        """Shape financial aggregates into the dashboard payload"""
+        total_committed = as_float(total_po_value)
+        retention_pct = as_float(total_retention_pct)
+        total_paid = as_float(paid_amount)
         
         # Return camelCase keys to match TypeScript interface
         return {
@@ -173,50 +427,30 @@ class KPIService:
         - Physical Progress = Σ(Milestone % × Milestone Value) / Total PO Value
         - Financial Progress = Paid / Committed × 100
         """
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        # Get PO stats
-        po_query = f"""
-        SELECT 
-            COUNT(*) as total_pos,
-            COUNT(*) FILTER (WHERE po.status IN ('ACTIVE', 'APPROVED')) as active_pos,
-            COALESCE(SUM(po.total_value::numeric), 0) as total_value
-        FROM purchase_order po
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        """
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(po_query), {"org_id": organization_id})
+        async with self._begin("progress") as conn:
+            # Get PO stats
+            result = await self._execute(conn, "progress", "progress_po", queries.PROGRESS_PO, params)
             po_row = result.fetchone()
-        
-        total_pos = int(po_row[0]) if po_row else 0
-        active_pos = int(po_row[1]) if po_row else 0
-        total_value = float(po_row[2]) if po_row and po_row[2] else 0
-        
-        # Get milestone stats
-        ms_query = f"""
-        SELECT 
-            COUNT(*) as total_milestones,
-            COUNT(*) FILTER (WHERE m.status = 'COMPLETED') as completed,
-            COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date < NOW()) as delayed,
-            COUNT(*) FILTER (WHERE m.status != 'COMPLETED' AND m.expected_date >= NOW() AND m.expected_date <= NOW() + INTERVAL '7 days') as at_risk,
-            COALESCE(SUM(CASE WHEN m.status = 'COMPLETED' THEN m.payment_percentage::numeric ELSE 0 END), 0) as completed_pct
-        FROM milestone m
-        INNER JOIN purchase_order po ON m.purchase_order_id = po.id
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        """
-        
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(ms_query), {"org_id": organization_id})
+            
+            # Get milestone stats
+            result = await self._execute(conn, "progress", "progress_milestones", queries.PROGRESS_MILESTONES, params)
             ms_row = result.fetchone()
         
-        milestones_total = int(ms_row[0]) if ms_row else 0
-        milestones_completed = int(ms_row[1]) if ms_row else 0
-        delayed_count = int(ms_row[2]) if ms_row else 0
-        at_risk_count = int(ms_row[3]) if ms_row else 0
-        completed_pct = float(ms_row[4]) if ms_row and ms_row[4] else 0
+        return self._format_progress_kpis(po_row, ms_row)
+    
+    @staticmethod
+    def _format_progress_kpis(po_row: Any, ms_row: Any) -> Dict[str, Any]:
+        """Shape PO and milestone aggregates into the dashboard payload"""
+        total_pos = as_int(po_row[0]) if po_row else 0
+        active_pos = as_int(po_row[1]) if po_row else 0
+        
+        milestones_total = as_int(ms_row[0]) if ms_row else 0
+        milestones_completed = as_int(ms_row[1]) if ms_row else 0
+        delayed_count = as_int(ms_row[2]) if ms_row else 0
+        at_risk_count = as_int(ms_row[3]) if ms_row else 0
+        completed_pct = as_float(ms_row[4]) if ms_row else 0
         
         on_track_count = max(0, milestones_total - milestones_completed - delayed_count - at_risk_count)
         physical_progress = completed_pct if milestones_total > 0 else 0
@@ -242,47 +476,40 @@ class KPIService:
         date_to: Optional[date] = None
     ) -> Dict[str, Any]:
         """Calculate Quality KPIs (NCRs)"""
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        query = f"""
-        SELECT 
-            COUNT(*) as total_ncrs,
-            COUNT(*) FILTER (WHERE n.status = 'OPEN') as open_ncrs,
-            COUNT(*) FILTER (WHERE n.status = 'CLOSED') as closed_ncrs,
-            COUNT(*) FILTER (WHERE n.severity = 'CRITICAL') as critical_ncrs
-        FROM ncr n
-        INNER JOIN purchase_order po ON n.purchase_order_id = po.id
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        """
+        if await self._use_rollups(organization_id, project_id, date_from, date_to):
+            totals = await self.rollups.read_totals(organization_id, project_id, date_from, date_to)
+            return self._format_quality_kpis(totals[3:7], int(totals[12]))
+        
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(query), {"org_id": organization_id})
+        async with self._begin("quality") as conn:
+            result = await self._execute(conn, "quality", "quality_ncr", queries.QUALITY_NCR, params)
             row = result.fetchone()
         
-        total_ncrs = int(row[0]) if row else 0
         total_pos = await self._get_po_count(organization_id, project_id)
+        return self._format_quality_kpis(row, total_pos)
+    
+    @staticmethod
+    def _format_quality_kpis(row: Any, total_pos: int) -> Dict[str, Any]:
+        """Shape NCR aggregates into the dashboard payload"""
+        total_ncrs = as_int(row[0]) if row else 0
         ncr_rate = (total_ncrs / total_pos * 100) if total_pos > 0 else 0
         
         # Return camelCase keys to match TypeScript interface
         return {
             "totalNCRs": total_ncrs,
-            "openNCRs": int(row[1]) if row else 0,
-            "closedNCRs": int(row[2]) if row else 0,
-            "criticalNCRs": int(row[3]) if row else 0,
+            "openNCRs": as_int(row[1]) if row else 0,
+            "closedNCRs": as_int(row[2]) if row else 0,
+            "criticalNCRs": as_int(row[3]) if row else 0,
             "ncrFinancialImpact": 0,
             "ncrRate": ncr_rate
         }
     
     async def _get_po_count(self, organization_id: str, project_id: Optional[str] = None) -> int:
         """Helper to get PO count for rate calculations"""
-        extra_filter = self._build_po_filter(project_id, None, None)
-        query = f"""
-        SELECT COUNT(*) FROM purchase_order po
-        WHERE po.organization_id = :org_id AND {extra_filter}
-        """
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(query), {"org_id": organization_id})
+        params = queries.po_filter_params(organization_id, project_id)
+        async with self._begin("quality") as conn:
+            result = await self._execute(conn, "quality", "po_count", queries.PO_COUNT, params)
             row = result.fetchone()
         return int(row[0]) if row else 0
     
@@ -294,28 +521,21 @@ class KPIService:
         date_to: Optional[date] = None
     ) -> Dict[str, Any]:
         """Calculate Supplier KPIs"""
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        query = f"""
-        SELECT 
-            s.id as supplier_id,
-            s.name as supplier_name,
-            COALESCE(s.readiness_score::numeric, 0) as readiness_score,
-            s.status,
-            SUM(po.total_value::numeric) as total_exposure
-        FROM supplier s
-        INNER JOIN purchase_order po ON s.id = po.supplier_id
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        GROUP BY s.id, s.name, s.readiness_score, s.status
-        ORDER BY total_exposure DESC
-        LIMIT 10
-        """
+        if await self._use_rollups(organization_id, project_id, date_from, date_to):
+            rows = await self.rollups.read_suppliers(organization_id, project_id, date_from, date_to)
+            return self._format_supplier_kpis(rows)
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(query), {"org_id": organization_id})
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
+        
+        async with self._begin("suppliers") as conn:
+            result = await self._execute(conn, "suppliers", "supplier_top_exposure", queries.SUPPLIER_TOP_EXPOSURE, params)
             rows = result.fetchall()
         
+        return self._format_supplier_kpis(rows)
+    
+    @staticmethod
+    def _format_supplier_kpis(rows: List[Any]) -> Dict[str, Any]:
+        """Shape top-exposure supplier rows into the dashboard payload"""
         if not rows:
             return {
                 "totalSuppliers": 0,
@@ -325,24 +545,25 @@ class KPIService:
                 "topExposure": []
             }
         
-        df = pd.DataFrame(rows, columns=['supplier_id', 'supplier_name', 'readiness_score', 'status', 'total_exposure'])
+        df = records_frame(
+            rows,
+            columns=['supplier_id', 'supplier_name', 'readiness_score', 'status', 'total_exposure'],
+            float_columns=['readiness_score', 'total_exposure'],
+            str_columns=['supplier_id']
+        )
         
-        top_exposure = [
-            {
-                "supplierId": str(row['supplier_id']),
-                "supplierName": row['supplier_name'],
-                "exposure": float(row['total_exposure'])
-            }
-            for _, row in df.head(5).iterrows()
-        ]
+        # Return camelCase keys to match TypeScript interface
+        top_exposure = to_records(
+            df.head(5),
+            rename={'supplier_id': 'supplierId', 'supplier_name': 'supplierName', 'total_exposure': 'exposure'}
+        )
         
-        active_count = len(df[df['status'] == 'ACTIVE'])
+        active_count = int((df['status'] == 'ACTIVE').sum())
         avg_score = float(df['readiness_score'].mean()) if not df['readiness_score'].isna().all() else 0
         
-        # Return camelCase keys to match TypeScript interface
         return {
             "totalSuppliers": len(df),
-            "activeSuppliers": int(active_count),
+            "activeSuppliers": active_count,
             "avgDeliveryScore": avg_score,  # Using readiness_score as proxy
             "avgQualityScore": avg_score,   # Using readiness_score as proxy
             "topExposure": top_exposure
@@ -356,31 +577,24 @@ class KPIService:
         date_to: Optional[date] = None
     ) -> Dict[str, Any]:
         """Calculate Payment KPIs"""
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        query = f"""
-        SELECT 
-            COUNT(*) FILTER (WHERE inv.status IN ('PENDING_APPROVAL', 'APPROVED')) as pending_count,
-            COUNT(*) FILTER (WHERE inv.status != 'PAID' AND inv.due_date < NOW()) as overdue_count,
-            COALESCE(SUM(CASE WHEN inv.status != 'PAID' AND inv.due_date < NOW() THEN inv.amount::numeric ELSE 0 END), 0) as overdue_amount,
-            AVG(EXTRACT(EPOCH FROM (inv.paid_at - inv.invoice_date)) / 86400) FILTER (WHERE inv.status = 'PAID') as avg_cycle
-        FROM invoice inv
-        INNER JOIN purchase_order po ON inv.purchase_order_id = po.id
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        """
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(query), {"org_id": organization_id})
+        async with self._begin("payments") as conn:
+            result = await self._execute(conn, "payments", "payments", queries.PAYMENTS, params)
             row = result.fetchone()
         
+        return self._format_payment_kpis(row)
+    
+    @staticmethod
+    def _format_payment_kpis(row: Any) -> Dict[str, Any]:
+        """Shape invoice aggregates into the dashboard payload"""
         # Return camelCase keys to match TypeScript interface
         return {
-            "avgPaymentCycleDays": float(row[3]) if row and row[3] else 0,
+            "avgPaymentCycleDays": as_float(row[3]) if row else 0,
             "invoiceAccuracyRate": 100,
-            "pendingInvoiceCount": int(row[0]) if row else 0,
-            "overdueInvoiceCount": int(row[1]) if row else 0,
-            "overdueAmount": float(row[2]) if row and row[2] else 0
+            "pendingInvoiceCount": as_int(row[0]) if row else 0,
+            "overdueInvoiceCount": as_int(row[1]) if row else 0,
+            "overdueAmount": as_float(row[2]) if row else 0
         }
     
     async def get_logistics_kpis(
@@ -391,29 +605,25 @@ class KPIService:
         date_to: Optional[date] = None
     ) -> Dict[str, Any]:
         """Calculate Logistics KPIs"""
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        query = f"""
-        SELECT 
-            COUNT(*) as total_shipments,
-            COUNT(*) FILTER (WHERE sh.status = 'IN_TRANSIT') as in_transit,
-            COUNT(*) FILTER (WHERE sh.status = 'DELIVERED') as delivered,
-            COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date <= sh.logistics_eta) as on_time,
-            COUNT(*) FILTER (WHERE sh.status = 'DELIVERED' AND sh.actual_delivery_date > sh.logistics_eta) as delayed
-        FROM shipment sh
-        INNER JOIN purchase_order po ON sh.purchase_order_id = po.id
-        WHERE po.organization_id = :org_id
-            AND {extra_filter}
-        """
+        if await self._use_rollups(organization_id, project_id, date_from, date_to):
+            totals = await self.rollups.read_totals(organization_id, project_id, date_from, date_to)
+            return self._format_logistics_kpis(totals[7:12])
+        
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(query), {"org_id": organization_id})
+        async with self._begin("logistics") as conn:
+            result = await self._execute(conn, "logistics", "logistics", queries.LOGISTICS, params)
             row = result.fetchone()
         
-        total_shipments = int(row[0]) if row else 0
-        delivered = int(row[2]) if row else 0
-        on_time = int(row[3]) if row else 0
-        delayed = int(row[4]) if row else 0
+        return self._format_logistics_kpis(row)
+    
+    @staticmethod
+    def _format_logistics_kpis(row: Any) -> Dict[str, Any]:
+        """Shape shipment aggregates into the dashboard payload"""
+        total_shipments = as_int(row[0]) if row else 0
+        delivered = as_int(row[2]) if row else 0
+        on_time = as_int(row[3]) if row else 0
+        delayed = as_int(row[4]) if row else 0
         
         on_time_rate = (on_time / delivered * 100) if delivered > 0 else 100
         
@@ -422,7 +632,7 @@ class KPIService:
             "totalShipments": total_shipments,
             "deliveredOnTime": on_time,
             "delayedShipments": delayed,
-            "inTransit": int(row[1]) if row else 0,
+            "inTransit": as_int(row[1]) if row else 0,
             "avgDeliveryDelay": 0,
             "onTimeRate": float(on_time_rate)
         }
@@ -432,54 +642,23 @@ class KPIService:
         organization_id: str,
         project_id: Optional[str] = None,
         date_from: Optional[date] = None,
-        date_to: Optional[date] = None
+        date_to: Optional[date] = None,
+        granularity: str = "month",
+        max_points: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         Get S-Curve data for planned vs actual cumulative spend
-        Returns monthly data points
-        """
-        extra_filter = self._build_po_filter(project_id, date_from, date_to)
-        
-        query = f"""
-        SELECT 
-            DATE_TRUNC('month', m.expected_date) as month,
-            SUM(po.total_value::numeric * m.payment_percentage::numeric / 100) as planned_amount,
-            SUM(
-                CASE 
-                    WHEN m.status = 'COMPLETED'
-                    THEN po.total_value::numeric * m.payment_percentage::numeric / 100 
-                    ELSE 0 
-                END
-            ) as actual_amount
-        FROM milestone m
-        INNER JOIN purchase_order po ON m.purchase_order_id = po.id
-        WHERE po.organization_id = :org_id
-            AND m.expected_date IS NOT NULL
-            AND {extra_filter}
-        GROUP BY DATE_TRUNC('month', m.expected_date)
-        ORDER BY month
+        Returns one point per day, week or month, downsampled to max_points
         """
+        if granularity not in scurve.GRANULARITIES:
+            raise ValueError(f"Unsupported granularity: {granularity}")
         
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(query), {"org_id": organization_id})
-            rows = result.fetchall()
-        
-        if not rows:
-            return []
+        params = queries.po_filter_params(organization_id, project_id, date_from, date_to)
+        params["granularity"] = granularity
         
-        df = pd.DataFrame(rows, columns=['month', 'planned_amount', 'actual_amount'])
-        
-        # Calculate cumulative sums (this is where pandas excels!)
-        df['planned_cumulative'] = df['planned_amount'].cumsum()
-        df['actual_cumulative'] = df['actual_amount'].cumsum()
-        df['month'] = pd.to_datetime(df['month']).dt.strftime('%Y-%m')
+        async with self._begin("scurve") as conn:
+            result = await self._execute(conn, "scurve", "scurve_bucketed", queries.SCURVE_BUCKETED, params)
+            rows = result.fetchall()
         
         # Return camelCase keys to match TypeScript interface
-        return [
-            {
-                "month": row['month'],
-                "plannedCumulative": float(row['planned_cumulative']),
-                "actualCumulative": float(row['actual_cumulative'])
-            }
-            for _, row in df.iterrows()
-        ]
+        return scurve.build_scurve(rows, granularity, max_points)
@@ -0,0 +1,165 @@
+"""
+KPI Query Tracing
+Per-request query timings (Server-Timing), slow-query log and Prometheus histograms
+"""
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.config import get_settings
+
+
+# Seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+
+@dataclass
+class QueryTiming:
+    family: str
+    name: str
+    duration: float
+    rows: int
+
+
+@dataclass
+class RequestTrace:
+    """Everything the KPI engine did on behalf of one HTTP request"""
+
+    started: float = field(default_factory=time.perf_counter)
+    queries: List[QueryTiming] = field(default_factory=list)
+    pool_wait: Dict[str, float] = field(default_factory=dict)
+    pool_connect: Dict[str, float] = field(default_factory=dict)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, one entry per KPI family plus pool wait, new connections and total"""
+        families: Dict[str, List[QueryTiming]] = {}
+        for query in self.queries:
+            families.setdefault(query.family, []).append(query)
+
+        entries = []
+        for family, queries in families.items():
+            duration = sum(q.duration for q in queries) * 1000
+            rows = sum(q.rows for q in queries)
+            entries.append(f'db-{family};dur={duration:.1f};desc="{len(queries)} queries, {rows} rows"')
+        if self.pool_wait:
+            entries.append(f"pool-wait;dur={sum(self.pool_wait.values()) * 1000:.1f}")
+        if self.pool_connect:
+            entries.append(f"pool-connect;dur={sum(self.pool_connect.values()) * 1000:.1f}")
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("kpi_trace", default=None)
+
+
+def start_trace() -> RequestTrace:
+    """Begin collecting timings for the current request (inherited by child tasks)"""
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+class Histogram:
+    """Minimal Prometheus-style histogram with label sets"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        # label values -> (per-bucket counts incl. +Inf, sum, count)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            base = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = f'{base},le="{le}"' if base else f'le="{le}"'
+                lines.append(f"{self.name}_bucket{{{labels}}} {cumulative}")
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class KPIMetrics:
+    """Process-wide KPI query metrics"""
+
+    def __init__(self):
+        self.query_duration = Histogram(
+            "kpi_query_duration_seconds", "KPI query execution time",
+            DURATION_BUCKETS, ("family", "query"),
+        )
+        self.query_rows = Histogram(
+            "kpi_query_rows", "Rows returned per KPI query",
+            ROW_BUCKETS, ("family", "query"),
+        )
+        self.pool_wait = Histogram(
+            "kpi_pool_wait_seconds", "Time waiting for a pooled DB connection, excluding connection setup",
+            DURATION_BUCKETS, ("family",),
+        )
+        self.pool_connect = Histogram(
+            "kpi_pool_connect_seconds", "Time opening a new DB connection during checkout",
+            DURATION_BUCKETS, ("family",),
+        )
+        self.slow_queries = 0
+
+    def record_pool_wait(self, family: str, wait: float) -> None:
+        self.pool_wait.observe(wait, family)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.pool_wait[family] = trace.pool_wait.get(family, 0.0) + wait
+
+    def record_pool_connect(self, family: str, duration: float) -> None:
+        self.pool_connect.observe(duration, family)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.pool_connect[family] = trace.pool_connect.get(family, 0.0) + duration
+
+    def record_query(self, family: str, name: str, duration: float, rows: int, params: Optional[Dict[str, Any]]) -> None:
+        self.query_duration.observe(duration, family, name)
+        self.query_rows.observe(rows, family, name)
+
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.queries.append(QueryTiming(family, name, duration, rows))
+
+        threshold_ms = get_settings().kpi_slow_query_ms
+        if threshold_ms and duration * 1000 >= threshold_ms:
+            self.slow_queries += 1
+            print(f"[KPI] Slow query {family}/{name}: {duration * 1000:.1f} ms, {rows} rows, params={params}")
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Prometheus text exposition of the histograms plus any extra gauges"""
+        lines: List[str] = []
+        for histogram in (self.query_duration, self.query_rows, self.pool_wait, self.pool_connect):
+            lines.extend(histogram.render())
+        lines.append("# TYPE kpi_slow_queries_total counter")
+        lines.append(f"kpi_slow_queries_total {self.slow_queries}")
+        for name, value in (gauges or {}).items():
+            if value is None:
+                continue
+            # camelCase stats keys -> snake_case metric names
+            name = re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", name).lower()
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = KPIMetrics()
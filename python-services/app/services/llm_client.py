@@ -0,0 +1,215 @@
+"""
+LLM Client
+Async OpenAI access shared by every extraction: concurrency cap, rate limits, retries
+"""
+import asyncio
+import random
+import time
+from contextlib import aclosing
+from functools import lru_cache
+from typing import Optional, AsyncIterator, Dict, Any, List, Set
+
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, BadRequestError, RateLimitError
+
+from app.config import get_settings
+from app.services.text_compaction import count_tokens
+
+
+class TokenBucket:
+    """
+    Continuously refilling token bucket sized per minute.
+    acquire() waits until the requested amount is available.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        # A single request larger than the whole budget just waits for a full bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class LLMClient:
+    """
+    Thin wrapper around AsyncOpenAI chat completions
+
+    - A global semaphore caps in-flight calls across all requests
+    - Request and token buckets keep us inside the account's RPM/TPM tier
+    - 429s, 5xx and connection errors are retried with full-jitter backoff
+      (the SDK's own retries are disabled so limits apply to every attempt)
+    - stream_json() asks for schema-constrained JSON (structured outputs) and
+      falls back to plain JSON mode on models that do not support it
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            max_retries=0,
+            timeout=settings.openai_timeout_seconds,
+        )
+        self.model = settings.openai_model
+        self.max_retries = settings.openai_max_retries
+        self._semaphore = asyncio.Semaphore(settings.openai_max_concurrency)
+        self._requests = TokenBucket(settings.openai_requests_per_minute)
+        self._tokens = TokenBucket(settings.openai_tokens_per_minute)
+        self.structured_outputs = settings.openai_structured_outputs
+        # Models that rejected a json_schema response format
+        self._no_json_schema: Set[str] = set()
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float = 0.1,
+        model: Optional[str] = None,
+        **kwargs: Any
+    ) -> Any:
+        """Create a chat completion, waiting for capacity and retrying transient failures"""
+        prompt_tokens = sum(count_tokens(m.get("content") or "", model or self.model) for m in messages)
+
+        attempt = 0
+        while True:
+            await self._requests.acquire()
+            await self._tokens.acquire(prompt_tokens + max_tokens)
+            try:
+                async with self._semaphore:
+                    return await self.client.chat.completions.create(
+                        model=model or self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        **kwargs
+                    )
+            except (RateLimitError, APIStatusError, APIConnectionError) as e:
+                if not self._is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                print(f"[LLM] {type(e).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float = 0.1,
+        model: Optional[str] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """
+        Stream a chat completion's content deltas under the same limits as chat().
+        Failures are retried only until the first delta arrives; after that the
+        caller already holds part of the answer and the error is raised.
+        Consume it inside contextlib.aclosing() so the semaphore slot and the
+        HTTP stream are released as soon as the caller stops reading.
+        """
+        prompt_tokens = sum(count_tokens(m.get("content") or "", model or self.model) for m in messages)
+
+        attempt = 0
+        while True:
+            await self._requests.acquire()
+            await self._tokens.acquire(prompt_tokens + max_tokens)
+            received = False
+            try:
+                async with self._semaphore:
+                    stream = await self.client.chat.completions.create(
+                        model=model or self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        **kwargs
+                    )
+                    async with stream:
+                        async for chunk in stream:
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                received = True
+                                yield delta
+                return
+            except (RateLimitError, APIStatusError, APIConnectionError) as e:
+                if received or not self._is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                print(f"[LLM] {type(e).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def stream_json(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        schema_name: str,
+        schema: Dict[str, Any],
+        model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a JSON completion constrained to `schema` (a strict JSON schema).
+        Models without structured outputs get JSON mode instead, where the
+        schema is only as binding as the prompt that describes it.
+        """
+        model = model or self.model
+        if self.structured_outputs and model not in self._no_json_schema:
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": schema_name, "schema": schema, "strict": True},
+            }
+            try:
+                async with aclosing(
+                    self.stream_chat(messages, max_tokens, model=model, response_format=response_format)
+                ) as deltas:
+                    async for delta in deltas:
+                        yield delta
+                return
+            except BadRequestError as e:
+                # Rejected before any output, so falling back cannot duplicate content
+                if "response_format" not in str(e) and "json_schema" not in str(e):
+                    raise
+                print(f"[LLM] {model} does not support json_schema response formats, using JSON mode")
+                self._no_json_schema.add(model)
+
+        async with aclosing(
+            self.stream_chat(messages, max_tokens, model=model, response_format={"type": "json_object"})
+        ) as deltas:
+            async for delta in deltas:
+                yield delta
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (RateLimitError, APIConnectionError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code >= 500
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff, honouring Retry-After when the API sends one"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 1)
+            except ValueError:
+                pass
+        return random.uniform(0, min(60.0, 2.0 ** (attempt + 1)))
+
+
+@lru_cache()
+def get_llm_client() -> LLMClient:
+    """Process-wide client so the concurrency and rate limits are shared"""
+    return LLMClient()
@@ -0,0 +1,141 @@
+"""
+S-Curve Engine
+Bucketed planned vs actual cumulative spend with gap filling and downsampling
+"""
+from datetime import date, datetime
+from typing import Optional, Dict, Any, List, Iterator, Sequence
+
+import numpy as np
+
+from app.serialization import dumps
+
+
+GRANULARITIES = ("day", "week", "month")
+
+# Points per NDJSON chunk when streaming
+STREAM_CHUNK_POINTS = 500
+
+
+def build_scurve(
+    rows: Sequence[Any],
+    granularity: str = "month",
+    max_points: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Turn (bucket, planned_amount, actual_amount) rows into S-curve points.
+
+    Buckets missing from the query (no milestones that period) are filled so
+    the curve has one point per calendar bucket. Cumulative sums are
+    vectorized, and the curve is downsampled with LTTB when `max_points` is
+    smaller than the number of buckets.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    if not rows:
+        return []
+
+    buckets = np.array([_as_date(row[0]) for row in rows], dtype="datetime64[D]")
+    planned = np.array([row[1] or 0 for row in rows], dtype=float)
+    actual = np.array([row[2] or 0 for row in rows], dtype=float)
+
+    # Scatter the sparse buckets onto the full calendar
+    calendar = _calendar(buckets.min(), buckets.max(), granularity)
+    positions = np.searchsorted(calendar, buckets)
+    planned_filled = np.zeros(len(calendar))
+    actual_filled = np.zeros(len(calendar))
+    np.add.at(planned_filled, positions, planned)
+    np.add.at(actual_filled, positions, actual)
+
+    planned_cumulative = np.cumsum(planned_filled)
+    actual_cumulative = np.cumsum(actual_filled)
+
+    if max_points and len(calendar) > max_points:
+        keep = lttb_indices(planned_cumulative, actual_cumulative, max_points)
+        calendar = calendar[keep]
+        planned_cumulative = planned_cumulative[keep]
+        actual_cumulative = actual_cumulative[keep]
+
+    # Monthly points keep the original "YYYY-MM" key the frontend charts use
+    if granularity == "month":
+        key, labels = "month", np.datetime_as_string(calendar, unit="M")
+    else:
+        key, labels = "date", np.datetime_as_string(calendar, unit="D")
+
+    return [
+        {
+            key: label,
+            "plannedCumulative": planned_value,
+            "actualCumulative": actual_value,
+        }
+        for label, planned_value, actual_value in zip(
+            labels.tolist(), planned_cumulative.tolist(), actual_cumulative.tolist()
+        )
+    ]
+
+
+def lttb_indices(planned: np.ndarray, actual: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets point selection over both cumulative series.
+
+    Each interior bucket keeps the point whose triangle with the previously
+    kept point and the next bucket's average is largest, summed across the
+    planned and actual curves so the shape of both survives. The first and
+    last points are always kept.
+    """
+    n = len(planned)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        if next_end <= next_start:
+            next_end = next_start + 1
+
+        avg_x = x[next_start:next_end].mean()
+        candidates = slice(start, max(end, start + 1))
+        cand_x = x[candidates]
+        area = np.zeros(len(cand_x))
+        for series in (planned, actual):
+            avg_y = series[next_start:next_end].mean()
+            area += np.abs(
+                (x[prev] - avg_x) * (series[candidates] - series[prev])
+                - (x[prev] - cand_x) * (avg_y - series[prev])
+            )
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+
+    return selected
+
+
+def iter_ndjson(points: List[Dict[str, Any]], chunk_points: int = STREAM_CHUNK_POINTS) -> Iterator[bytes]:
+    """Yield S-curve points as newline-delimited JSON, a chunk at a time"""
+    for start in range(0, len(points), chunk_points):
+        chunk = points[start:start + chunk_points]
+        yield b"".join(dumps(point) + b"\n" for point in chunk)
+
+
+def _calendar(start: np.datetime64, end: np.datetime64, granularity: str) -> np.ndarray:
+    """Every bucket start between start and end (inclusive) as datetime64[D]"""
+    if granularity == "month":
+        months = np.arange(
+            start.astype("datetime64[M]"),
+            end.astype("datetime64[M]") + 1,
+            dtype="datetime64[M]",
+        )
+        return months.astype("datetime64[D]")
+    step = 7 if granularity == "week" else 1
+    return np.arange(start, end + 1, step, dtype="datetime64[D]")
+
+
+def _as_date(value: Any) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    return value
@@ -0,0 +1,206 @@
+"""
+Shipment Chunking
+Split long packing lists into LLM-sized chunks and merge the per-chunk results
+"""
+import re
+from typing import Optional, Dict, Any, List, Tuple
+
+
+PAGE_MARKER = re.compile(r"(?m)^(?=--- Page \d+/\d+ ---$)")
+
+# Lines that usually open a new article group in packing lists (Swedish/German/English)
+ARTICLE_START = re.compile(r"(?im)^(?=\s*(?:art(?:ikel|icle)?\.?|item|pos(?:ition)?\.?)\s*(?:nr|no)?\.?\s*\d)")
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+HEADER_FIELDS = [
+    "order_number", "project", "invoice_number", "invoice_date", "supplier_name",
+    "customer_name", "delivery_conditions", "delivery_address", "origin",
+    "destination", "currency", "total_excl_vat", "total_incl_vat",
+    "vat_percentage", "total_gross_weight_kg", "total_net_weight_kg",
+]
+
+# Numbers repeated on both sides of a chunk boundary describe the same group,
+# so the larger (complete) figure wins
+ITEM_MAX_FIELDS = ["quantity", "total_price", "weight_kg"]
+
+# Extracted package weights within this share of the declared total count as consistent
+WEIGHT_TOLERANCE = 0.01
+
+
+def split_shipment_text(text: str, max_chars: int) -> List[str]:
+    """
+    Split page-marked text into chunks of at most max_chars.
+    Cuts at page markers first, then at article headings, then paragraphs,
+    and only splits inside a paragraph (at line breaks) as a last resort.
+    """
+    units: List[str] = []
+    for page in _split(text, PAGE_MARKER):
+        units.extend(_fit(page, max_chars, [ARTICLE_START, PARAGRAPH_BREAK]))
+
+    chunks: List[str] = []
+    current = ""
+    for unit in units:
+        if current and len(current) + len(unit) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split(text: str, pattern: "re.Pattern") -> List[str]:
+    return [part for part in pattern.split(text) if part.strip()]
+
+
+def _fit(text: str, max_chars: int, patterns: List["re.Pattern"]) -> List[str]:
+    """Recursively split text with progressively finer boundaries until every piece fits"""
+    if len(text) <= max_chars:
+        return [text]
+    if not patterns:
+        return _split_lines(text, max_chars)
+
+    parts = _split(text, patterns[0])
+    if len(parts) <= 1:
+        return _fit(text, max_chars, patterns[1:])
+
+    pieces: List[str] = []
+    for part in parts:
+        pieces.extend(_fit(part, max_chars, patterns[1:]))
+    return pieces
+
+
+def _split_lines(text: str, max_chars: int) -> List[str]:
+    pieces: List[str] = []
+    current = ""
+    for line in text.split("\n"):
+        # A single line longer than a chunk is cut hard
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def header_context(text: str, max_chars: int = 1500) -> str:
+    """Opening lines of the first page (order/supplier/customer block) for every chunk"""
+    pages = _split(text, PAGE_MARKER)
+    first_page = pages[0] if pages else text
+    return first_page[:max_chars]
+
+
+def merge_shipment_parts(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Deterministically merge per-chunk shipment results (in document order).
+    Header fields take the first non-null value; items are merged by article
+    number and their packages de-duplicated by package number.
+    """
+    merged: Dict[str, Any] = {field: None for field in HEADER_FIELDS}
+    for part in parts:
+        for field in HEADER_FIELDS:
+            if merged[field] is None and part.get(field) is not None:
+                merged[field] = part[field]
+
+    items: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    for part in parts:
+        for item in part.get("items") or []:
+            key = _item_key(item)
+            if key not in items:
+                items[key] = {**item, "packages": []}
+                _merge_packages(items[key], item.get("packages"))
+                continue
+
+            existing = items[key]
+            for field, value in item.items():
+                if field == "packages" or value is None:
+                    continue
+                if existing.get(field) is None:
+                    existing[field] = value
+                elif field in ITEM_MAX_FIELDS and _is_number(value) and _is_number(existing[field]):
+                    existing[field] = max(existing[field], value)
+            _merge_packages(existing, item.get("packages"))
+    merged["items"] = list(items.values())
+
+    confidences = [part["confidence"] for part in parts if _is_number(part.get("confidence"))]
+    merged["confidence"] = min(confidences) if confidences else 0.0
+
+    weight_check = reconcile_gross_weight(merged)
+    if weight_check:
+        merged["weight_check"] = weight_check
+        if not weight_check["matches"]:
+            # Items were probably lost or duplicated at a chunk boundary
+            merged["confidence"] = min(merged["confidence"], 0.5)
+    merged["chunks"] = len(parts)
+    if any(part.get("truncated") for part in parts):
+        # At least one part's reply was cut off, so items are likely missing
+        merged["truncated"] = True
+    return merged
+
+
+def reconcile_gross_weight(shipment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Compare the declared total gross weight with the sum of extracted packages (or items)"""
+    declared = shipment.get("total_gross_weight_kg")
+    if not _is_number(declared) or declared <= 0:
+        return None
+
+    package_weights = [
+        package["gross_weight_kg"]
+        for item in shipment.get("items") or []
+        for package in item.get("packages") or []
+        if _is_number(package.get("gross_weight_kg"))
+    ]
+    if package_weights:
+        extracted = sum(package_weights)
+    else:
+        item_weights = [item["weight_kg"] for item in shipment.get("items") or [] if _is_number(item.get("weight_kg"))]
+        if not item_weights:
+            return None
+        extracted = sum(item_weights)
+
+    difference = extracted - declared
+    return {
+        "declared_kg": declared,
+        "extracted_kg": round(extracted, 3),
+        "difference_kg": round(difference, 3),
+        "matches": abs(difference) <= declared * WEIGHT_TOLERANCE,
+    }
+
+
+def _item_key(item: Dict[str, Any]) -> Tuple[str, ...]:
+    article_number = _normalize(item.get("article_number"))
+    if article_number:
+        return ("article", article_number)
+    return ("description", _normalize(item.get("description")), _normalize(item.get("delivery_note")))
+
+
+def _merge_packages(item: Dict[str, Any], packages: Optional[List[Dict[str, Any]]]) -> None:
+    seen = {_package_key(package) for package in item["packages"]}
+    for package in packages or []:
+        key = _package_key(package)
+        if key not in seen:
+            seen.add(key)
+            item["packages"].append(package)
+
+
+def _package_key(package: Dict[str, Any]) -> Tuple[Any, ...]:
+    package_no = _normalize(package.get("package_no"))
+    if package_no:
+        return ("package", package_no)
+    return tuple(sorted((k, str(v)) for k, v in package.items()))
+
+
+def _normalize(value: Any) -> str:
+    return re.sub(r"\s+", " ", str(value)).strip().lower() if value is not None else ""
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,491 @@
+"""
+Table Parser
+Deterministic spreadsheet parsing: finds the header row, maps columns through
+multilingual synonyms and reads BOQ, invoice and packing rows without the LLM.
+Pure functions over row tuples so it runs inside worker processes.
+"""
+import re
+from datetime import date, datetime
+from itertools import chain, islice
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+
+# Header synonyms per field (English, Swedish, German, Finnish, French, Spanish)
+COLUMN_SYNONYMS: Dict[str, List[str]] = {
+    "item_number": [
+        "item", "item no", "item nr", "item number", "no", "nr", "pos", "pos nr", "position",
+        "line", "line no", "ref", "boq ref", "art", "art nr", "art no", "article", "article no",
+        "article number", "artikel", "artikelnr", "artikelnummer", "positio", "nro", "rivi", "n°",
+    ],
+    "description": [
+        "description", "desc", "item description", "particulars", "specification", "details",
+        "beskrivning", "benämning", "artikelbenämning", "text", "bezeichnung", "beschreibung",
+        "artikelbezeichnung", "kuvaus", "nimitys", "nimike", "désignation", "description article",
+        "descripción", "concepto",
+    ],
+    "unit": [
+        "unit", "units", "uom", "u m", "enhet", "enh", "einheit", "me", "yksikkö", "yks",
+        "unité", "unidad", "ud",
+    ],
+    "quantity": [
+        "qty", "quantity", "quant", "antal", "mängd", "kvantitet", "menge", "anzahl", "määrä",
+        "kpl", "quantité", "qté", "cantidad", "cant",
+    ],
+    "unit_price": [
+        "rate", "unit rate", "unit price", "price", "unit cost", "price per unit", "à pris", "a pris",
+        "apris", "pris", "styckpris", "enhetspris", "einzelpreis", "ep", "preis", "stückpreis",
+        "yksikköhinta", "à hinta", "a hinta", "hinta", "prix unitaire", "pu", "precio unitario",
+        "precio",
+    ],
+    "total_price": [
+        "amount", "total", "total price", "total amount", "line total", "value", "extended",
+        "net amount", "belopp", "summa", "totalt", "totalpris", "gesamtpreis", "gesamt", "gp",
+        "betrag", "summe", "yhteensä", "hinta yhteensä", "summa yhteensä", "montant", "prix total",
+        "importe", "total línea",
+    ],
+    "weight_kg": [
+        "weight", "weight kg", "total weight", "total weight kg", "gross weight", "gross weight kg",
+        "net weight", "vikt", "vikt kg", "bruttovikt", "nettovikt", "gewicht", "bruttogewicht",
+        "paino", "kg", "poids", "peso",
+    ],
+    "hs_code": [
+        "hs code", "hs", "tariff code", "customs code", "commodity code", "tariffkod", "tullkod",
+        "statistiskt nummer", "zolltarifnummer", "warennummer", "tullinimike", "code sh",
+    ],
+    "country_of_origin": [
+        "country of origin", "origin", "coo", "ursprung", "ursprungsland", "herkunftsland",
+        "alkuperämaa", "alkuperä", "pays d origine", "origen",
+    ],
+    "delivery_note": [
+        "delivery note", "delivery note no", "dn", "följesedel", "följesedelnr", "lieferschein",
+        "lieferscheinnummer", "lähete", "bon de livraison",
+    ],
+}
+
+# Columns each document type reads, and the ones that must be present
+TABLE_SCHEMAS: Dict[str, Dict[str, List[str]]] = {
+    "purchase_order": {
+        "fields": ["item_number", "description", "unit", "quantity", "unit_price", "total_price"],
+        "required": ["description", "quantity"],
+    },
+    "invoice": {
+        "fields": ["item_number", "description", "unit", "quantity", "unit_price", "total_price"],
+        "required": ["description", "total_price"],
+    },
+    "shipment": {
+        "fields": [
+            "item_number", "description", "quantity", "unit", "unit_price", "total_price",
+            "weight_kg", "hs_code", "country_of_origin", "delivery_note",
+        ],
+        "required": ["description", "quantity"],
+    },
+}
+
+NUMERIC_FIELDS = {"quantity", "unit_price", "total_price", "weight_kg"}
+
+# Labels of key/value cells above the table (document header block)
+HEADER_LABELS: Dict[str, List[str]] = {
+    "po_number": [
+        "po", "po no", "po nr", "po number", "purchase order", "purchase order no", "order no",
+        "order nr", "order number", "beställningsnummer", "ordernummer", "bestellnummer",
+        "auftragsnummer", "tilausnumero", "n° de commande",
+    ],
+    "invoice_number": [
+        "invoice", "invoice no", "invoice nr", "invoice number", "faktura", "fakturanr",
+        "fakturanummer", "rechnung", "rechnungsnummer", "laskun numero", "lasku", "n° de facture",
+    ],
+    "vendor_name": [
+        "vendor", "supplier", "contractor", "seller", "leverantör", "säljare", "lieferant",
+        "auftragnehmer", "toimittaja", "fournisseur", "proveedor",
+    ],
+    "customer_name": ["customer", "buyer", "client", "kund", "köpare", "kunde", "asiakas", "client final"],
+    "date": [
+        "date", "order date", "invoice date", "po date", "datum", "orderdatum", "fakturadatum",
+        "bestelldatum", "rechnungsdatum", "päivämäärä", "pvm", "fecha",
+    ],
+    "due_date": ["due date", "förfallodatum", "fällig", "fälligkeitsdatum", "eräpäivä"],
+    "currency": ["currency", "valuta", "währung", "valuutta", "devise", "moneda"],
+}
+
+# First cell / description of summary rows below the line items
+TOTAL_LABELS: Dict[str, List[str]] = {
+    "subtotal": ["subtotal", "sub total", "net total", "delsumma", "zwischensumme", "välisumma", "sous total"],
+    "tax": ["vat", "tax", "moms", "mwst", "ust", "alv", "tva", "iva"],
+    "total": [
+        "total", "grand total", "total amount", "totalt", "summa", "att betala", "gesamt",
+        "gesamtsumme", "endsumme", "yhteensä", "total ttc", "total general",
+    ],
+}
+
+CURRENCY_CODES = {"USD", "EUR", "GBP", "SEK", "NOK", "DKK", "CHF", "KES", "UGX", "TZS", "ZAR", "AED", "INR", "CNY", "JPY"}
+
+# Rows scanned for a header; real headers sit near the top of the sheet
+HEADER_SCAN_ROWS = 30
+
+# A row counts as arithmetically consistent when qty * price is within 1% of the amount
+ARITHMETIC_TOLERANCE = 0.01
+
+
+def normalize_label(value: Any) -> str:
+    """Lowercase, strip punctuation and unit brackets: 'Unit Price (EUR):' -> 'unit price eur'"""
+    text = str(value).lower().replace("\n", " ")
+    text = re.sub(r"[.:;#/\\()\[\]_\-–*'\"]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _match_score(label: str, synonyms: List[str]) -> float:
+    """1.0 for an exact synonym, 0.7 when every word of a synonym appears in the label"""
+    if not label:
+        return 0.0
+    words = set(label.split())
+    best = 0.0
+    for synonym in synonyms:
+        if label == synonym:
+            return 1.0
+        synonym_words = synonym.split()
+        # Short bare tokens ("no", "hs", "ep") only count as exact matches
+        if len(synonym) >= 3 and set(synonym_words) <= words:
+            best = max(best, 0.7)
+    return best
+
+
+def map_columns(header: Tuple[Any, ...], fields: List[str]) -> Dict[int, Tuple[str, float]]:
+    """Assign each field to its best matching column (greedy, strongest match first)"""
+    candidates = []
+    for column, cell in enumerate(header):
+        if cell is None:
+            continue
+        label = normalize_label(cell)
+        for field in fields:
+            score = _match_score(label, COLUMN_SYNONYMS[field])
+            if score:
+                candidates.append((-score, column, field))
+
+    mapping: Dict[int, Tuple[str, float]] = {}
+    used_fields = set()
+    for negative_score, column, field in sorted(candidates):
+        if column in mapping or field in used_fields:
+            continue
+        mapping[column] = (field, -negative_score)
+        used_fields.add(field)
+    return mapping
+
+
+def detect_header(
+    rows: List[Tuple[Any, ...]],
+    schema: Dict[str, List[str]]
+) -> Optional[Tuple[int, Dict[int, Tuple[str, float]]]]:
+    """Best header row within the first rows: all required fields and at least three columns"""
+    best = None
+    best_rank = None
+    for index, row in enumerate(rows[:HEADER_SCAN_ROWS]):
+        mapping = map_columns(row, schema["fields"])
+        fields = {field for field, _ in mapping.values()}
+        if len(mapping) < 3 or not set(schema["required"]) <= fields:
+            continue
+        rank = (len(mapping), sum(score for _, score in mapping.values()))
+        if best_rank is None or rank > best_rank:
+            best, best_rank = (index, mapping), rank
+    return best
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """Parse spreadsheet numbers including '1 234,50', '1.234,50', '1,234.50', '€ 12' and accounting negatives '(100)'"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = re.sub(r"[^\d,.\-()]", "", str(value).replace(" ", ""))
+    negative = text.startswith("(") and text.endswith(")")
+    text = text.replace("(", "").replace(")", "")
+    if not re.search(r"\d", text):
+        return None
+    if negative:
+        text = "-" + text.lstrip("-")
+    if "," in text and "." in text:
+        # Whichever separator comes last is the decimal separator
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        head, _, tail = text.rpartition(",")
+        # "1,234" is a thousands separator, "12,5" a decimal comma
+        text = text.replace(",", "") if len(tail) == 3 and head.replace(",", "").isdigit() else text.replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _format_cell(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def _total_label(row: Tuple[Any, ...], mapping: Dict[int, Tuple[str, float]]) -> Optional[str]:
+    """Summary row kind when the row's leading text cell is a total/subtotal/tax label"""
+    # Line items ("Total station survey, 2 days") always carry a quantity
+    for column, (field, _) in mapping.items():
+        if field == "quantity" and column < len(row) and parse_number(row[column]) is not None:
+            return None
+    label = next((normalize_label(cell) for cell in row if isinstance(cell, str) and cell.strip()), "")
+    for kind, labels in TOTAL_LABELS.items():
+        if any(label == candidate or label.startswith(candidate + " ") for candidate in labels):
+            return kind
+    return None
+
+
+def _row_amount(row: Tuple[Any, ...], mapping: Dict[int, Tuple[str, float]]) -> Optional[float]:
+    """Amount on a summary row: the total column, else the last number in the row"""
+    for column, (field, _) in mapping.items():
+        if field == "total_price" and column < len(row):
+            amount = parse_number(row[column])
+            if amount is not None:
+                return amount
+    numbers = [parse_number(cell) for cell in row if isinstance(cell, (int, float)) and not isinstance(cell, bool)]
+    return numbers[-1] if numbers else None
+
+
+def read_header_fields(rows: List[Tuple[Any, ...]]) -> Dict[str, Any]:
+    """Key/value cells above the table: 'PO Number | 4711' or 'PO Number: 4711'"""
+    found: Dict[str, Any] = {}
+    for row in rows:
+        cells = list(row)
+        for column, cell in enumerate(cells):
+            if not isinstance(cell, str) or not cell.strip():
+                continue
+            label, separator, inline_value = cell.partition(":")
+            normalized = normalize_label(label)
+            for field, labels in HEADER_LABELS.items():
+                if field in found or normalized not in labels:
+                    continue
+                value = inline_value.strip() if separator and inline_value.strip() else None
+                if value is None:
+                    value = next((c for c in cells[column + 1:] if c is not None and str(c).strip()), None)
+                if value is not None:
+                    found[field] = _format_cell(value)
+    return found
+
+
+def _detect_currency(rows: List[Tuple[Any, ...]]) -> Optional[str]:
+    for row in rows:
+        for cell in row:
+            if isinstance(cell, str):
+                for token in re.findall(r"[A-Za-z]{3}", cell):
+                    if token.upper() in CURRENCY_CODES and token.isupper():
+                        return token
+    return None
+
+
+def parse_table(rows: Iterable[Tuple[Any, ...]], document_type: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse one sheet's rows (values only) for a document type.
+    Returns {"items", "totals", "header_fields", "confidence", "header_row", "columns"}
+    or None when no header row matches the schema.
+
+    Rows are consumed as a stream: only the header scan window is buffered, and
+    a sheet without a matching header is abandoned after that window.
+    """
+    schema = TABLE_SCHEMAS[document_type]
+    rows = iter(rows)
+    head = list(islice(rows, HEADER_SCAN_ROWS))
+    detected = detect_header(head, schema)
+    if detected is None:
+        return None
+    header_index, mapping = detected
+
+    items: List[Dict[str, Any]] = []
+    totals: Dict[str, float] = {}
+    invalid_rows = 0
+    checked_rows = 0
+    consistent_rows = 0
+
+    for row in chain(head[header_index + 1:], rows):
+        if not any(cell is not None and str(cell).strip() for cell in row):
+            continue
+
+        total_kind = _total_label(row, mapping)
+        if total_kind:
+            amount = _row_amount(row, mapping)
+            if amount is not None and total_kind not in totals:
+                totals[total_kind] = amount
+            continue
+
+        values: Dict[str, Any] = {}
+        row_invalid = False
+        for column, (field, _) in mapping.items():
+            cell = row[column] if column < len(row) else None
+            if field in NUMERIC_FIELDS:
+                number = parse_number(cell)
+                if number is None and cell is not None and str(cell).strip():
+                    row_invalid = True
+                values[field] = number
+            else:
+                values[field] = _format_cell(cell)
+
+        has_numbers = any(values.get(field) is not None for field in ("quantity", "unit_price", "total_price"))
+        if not values.get("description") or not has_numbers:
+            # Section headings and notes (in any text column) carry no numbers and
+            # unlabelled section subtotals only an amount: neither is an item nor
+            # an unreadable row. Anything else is a row we can't read.
+            subtotal = (
+                values.get("total_price") is not None
+                and values.get("quantity") is None
+                and values.get("unit_price") is None
+            )
+            if not row_invalid and (not has_numbers or subtotal):
+                continue
+            invalid_rows += 1
+            continue
+        if row_invalid:
+            invalid_rows += 1
+            continue
+
+        quantity, unit_price, total_price = values.get("quantity"), values.get("unit_price"), values.get("total_price")
+        if quantity is not None and unit_price is not None and total_price is not None:
+            checked_rows += 1
+            if abs(quantity * unit_price - total_price) <= max(abs(total_price) * ARITHMETIC_TOLERANCE, 0.01):
+                consistent_rows += 1
+        items.append(values)
+
+    if not items:
+        return None
+
+    # Header quality x share of readable rows x arithmetic consistency
+    fields = [field for field, _ in mapping.values()]
+    header_score = sum(score for _, score in mapping.values()) / len(mapping)
+    coverage = len(fields) / len(schema["fields"])
+    readable = len(items) / (len(items) + invalid_rows)
+    arithmetic = (consistent_rows / checked_rows) if checked_rows else 0.9
+    confidence = (0.6 * header_score + 0.4 * min(1.0, coverage * 1.5)) * readable * (0.5 + 0.5 * arithmetic)
+
+    above = head[:header_index]
+    header_fields = read_header_fields(above)
+    if "currency" not in header_fields:
+        header_fields["currency"] = _detect_currency(head[:header_index + 1])
+
+    return {
+        "items": items,
+        "totals": totals,
+        "header_fields": header_fields,
+        "confidence": round(min(confidence, 1.0), 2),
+        "header_row": header_index + 1,
+        "columns": {field: column for column, (field, _) in mapping.items()},
+    }
+
+
+def build_document(document_type: str, table: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a parsed table like the LLM output for the document type"""
+    items = table["items"]
+    totals = table["totals"]
+    header = table["header_fields"]
+    line_total = round(sum(item.get("total_price") or 0 for item in items), 2)
+
+    if document_type == "purchase_order":
+        return {
+            "po_number": header.get("po_number"),
+            "vendor_name": header.get("vendor_name"),
+            "date": header.get("date"),
+            "total_value": totals.get("total", line_total),
+            "currency": header.get("currency"),
+            "scope": None,
+            "payment_terms": None,
+            "incoterms": None,
+            "retention_percentage": None,
+            "milestones": [],
+            "boq_items": [
+                {
+                    "item_number": item.get("item_number") or str(index + 1),
+                    "description": item["description"],
+                    "unit": item.get("unit") or "",
+                    "quantity": item.get("quantity") or 0.0,
+                    "unit_price": _unit_price(item),
+                    "total_price": _total_price(item),
+                }
+                for index, item in enumerate(items)
+            ],
+            "confidence": table["confidence"],
+        }
+
+    if document_type == "invoice":
+        subtotal = totals.get("subtotal", line_total)
+        return {
+            "invoice_number": header.get("invoice_number"),
+            "vendor_name": header.get("vendor_name"),
+            "date": header.get("date"),
+            "due_date": header.get("due_date"),
+            "total_amount": totals.get("total", subtotal + totals.get("tax", 0.0)),
+            "currency": header.get("currency"),
+            "subtotal": subtotal,
+            "tax_amount": totals.get("tax"),
+            "line_items": [
+                {
+                    "description": item["description"],
+                    "quantity": item.get("quantity"),
+                    "unit_price": item.get("unit_price"),
+                    "amount": _total_price(item),
+                }
+                for item in items
+            ],
+            "confidence": table["confidence"],
+        }
+
+    return {
+        "order_number": header.get("po_number"),
+        "project": None,
+        "invoice_number": header.get("invoice_number"),
+        "invoice_date": header.get("date"),
+        "supplier_name": header.get("vendor_name"),
+        "customer_name": header.get("customer_name"),
+        "delivery_conditions": None,
+        "delivery_address": None,
+        "origin": None,
+        "destination": None,
+        "currency": header.get("currency"),
+        "total_excl_vat": totals.get("subtotal", totals.get("total")),
+        "total_incl_vat": totals.get("total") if "subtotal" in totals else None,
+        "vat_percentage": None,
+        "total_gross_weight_kg": None,
+        "total_net_weight_kg": None,
+        "items": [
+            {
+                "article_number": item.get("item_number") or str(index + 1),
+                "description": item["description"],
+                "quantity": item.get("quantity") or 0,
+                "unit": item.get("unit") or "",
+                "unit_price": item.get("unit_price"),
+                "total_price": item.get("total_price"),
+                "weight_kg": item.get("weight_kg"),
+                "hs_code": item.get("hs_code"),
+                "country_of_origin": item.get("country_of_origin"),
+                "delivery_note": item.get("delivery_note"),
+                "packages": [],
+            }
+            for index, item in enumerate(items)
+        ],
+        "confidence": table["confidence"],
+    }
+
+
+def _unit_price(item: Dict[str, Any]) -> float:
+    if item.get("unit_price") is not None:
+        return item["unit_price"]
+    if item.get("total_price") is not None and item.get("quantity"):
+        return round(item["total_price"] / item["quantity"], 4)
+    return 0.0
+
+
+def _total_price(item: Dict[str, Any]) -> float:
+    if item.get("total_price") is not None:
+        return item["total_price"]
+    if item.get("unit_price") is not None and item.get("quantity") is not None:
+        return round(item["unit_price"] * item["quantity"], 2)
+    return 0.0
@@ -0,0 +1,182 @@
+"""
+Text Compaction
+Shrinks extracted document text before it is sent to the LLM: repeated page
+headers/footers, empty spreadsheet columns and whitespace runs are removed,
+and the result is fitted to a token budget measured with the model's tiktoken
+encoding
+"""
+import math
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Optional, Dict, List, Set
+
+import tiktoken
+
+
+# Token estimate for models tiktoken has no encoding for (OpenAI averages ~4 chars/token)
+CHARS_PER_TOKEN = 4
+
+PAGE_MARKER = re.compile(r"(?m)^--- Page \d+/\d+ ---$")
+BLANK_LINES = re.compile(r"\n\s*\n")
+HORIZONTAL_SPACE = re.compile(r"[ \t\u00a0]+")
+# Page numbering inside header/footer lines ("Page 3 of 12", "Sida 3/12"), and bare "3/12" or "- 3 -" lines
+PAGE_NUMBER = re.compile(r"(?i)\b(?:page|sida|seite|side|sivu|blad)\s*\d+(?:\s*(?:/|of|av|von|af)\s*\d+)?")
+BARE_PAGE_NUMBER = re.compile(r"^[-\s]*\d+(?:\s*/\s*\d+)?[-\s]*$")
+
+# Excel text rows are cells joined with this separator
+CELL_SEPARATOR = " | "
+
+# Lines this close to the top or bottom of a page are header/footer candidates
+EDGE_LINES = 3
+# A candidate repeated on at least this share of pages (and 3 pages) is boilerplate
+REPEATED_PAGE_SHARE = 0.5
+MIN_REPEATED_PAGES = 3
+
+
+@lru_cache()
+def _encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """The model's tiktoken encoding; None for models tiktoken does not know"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print(f"[Prompt Compaction] No tiktoken encoding for {model}, estimating tokens")
+        return None
+    except Exception as e:
+        # The BPE file is fetched on first use (cached under TIKTOKEN_CACHE_DIR);
+        # warm_tokenizer() surfaces a failed fetch at startup
+        print(f"[Prompt Compaction] tiktoken encoding for {model} could not be loaded, estimating tokens: {e}")
+        return None
+
+
+def warm_tokenizer(model: str) -> bool:
+    """Load the model's encoding ahead of the first extraction; False if token counts will be estimates"""
+    return _encoding(model) is not None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def fit_to_budget(text: str, max_tokens: int, model: str) -> str:
+    """Cut text to at most max_tokens, at a line boundary when one is near the cut"""
+    encoding = _encoding(model)
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= limit:
+            return text
+        cut = text[:limit]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+
+    last_line = cut.rfind("\n")
+    return cut[:last_line] if last_line > len(cut) * 0.9 else cut
+
+
+def compact_text(text: str) -> str:
+    """Whitespace, empty table columns and repeated page headers/footers removed; page markers are kept"""
+    pages = _split_pages(text)
+    pages = [_collapse_table_columns(_normalize_whitespace(page)) for page in pages]
+    pages = _drop_repeated_edges(pages)
+
+    if PAGE_MARKER.search(text):
+        return "\n".join(page for page in pages if page)
+    return "\n\n".join(page for page in pages if page)
+
+
+def _split_pages(text: str) -> List[str]:
+    """Pages by marker (shipments), otherwise blank-line separated blocks (PDF pages, sheets)"""
+    if PAGE_MARKER.search(text):
+        starts = [match.start() for match in PAGE_MARKER.finditer(text)]
+        if starts[0] > 0:
+            starts.insert(0, 0)
+        return [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    return BLANK_LINES.split(text)
+
+
+def _normalize_whitespace(page: str) -> str:
+    lines = (HORIZONTAL_SPACE.sub(" ", line).strip() for line in page.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def _collapse_table_columns(page: str) -> str:
+    """Drop columns that are empty in every row of a run of same-width table rows"""
+    lines = page.split("\n")
+    output: List[str] = []
+    block: List[List[str]] = []
+
+    def flush() -> None:
+        if not block:
+            return
+        width = len(block[0])
+        keep = [col for col in range(width) if any(row[col] for row in block)]
+        for row in block:
+            output.append(CELL_SEPARATOR.join(row[col] for col in keep).strip())
+        block.clear()
+
+    for line in lines:
+        # Whitespace normalisation already trimmed " | " at the row edges to "|"
+        cells = [cell.strip() for cell in line.split("|")] if CELL_SEPARATOR.strip() in line else None
+        if cells is None or len(cells) < 2:
+            flush()
+            output.append(line)
+            continue
+        if block and len(cells) != len(block[0]):
+            flush()
+        block.append(cells)
+    flush()
+    return "\n".join(line for line in output if line)
+
+
+def _drop_repeated_edges(pages: List[str]) -> List[str]:
+    """
+    Remove header/footer lines that repeat at the top or bottom of many pages
+    (page numbers ignored), keeping their first occurrence. Lines in the body
+    of a page are never touched.
+    """
+    if sum(1 for page in pages if page) < MIN_REPEATED_PAGES:
+        return pages
+
+    page_lines = [page.split("\n") for page in pages]
+    edges = [_edge_indices(lines) for lines in page_lines]
+    seen_on: Dict[str, Set[int]] = defaultdict(set)
+    for page_idx, (lines, edge) in enumerate(zip(page_lines, edges)):
+        for line_idx in edge:
+            seen_on[_line_key(lines[line_idx])].add(page_idx)
+
+    threshold = max(MIN_REPEATED_PAGES, math.ceil(sum(1 for page in pages if page) * REPEATED_PAGE_SHARE))
+    repeated = {key for key, page_set in seen_on.items() if len(page_set) >= threshold}
+    if not repeated:
+        return pages
+
+    kept: Set[str] = set()
+    compacted = []
+    for lines, edge in zip(page_lines, edges):
+        output = []
+        for line_idx, line in enumerate(lines):
+            if line_idx in edge:
+                key = _line_key(line)
+                if key in repeated:
+                    if key in kept:
+                        continue
+                    kept.add(key)
+            output.append(line)
+        compacted.append("\n".join(output))
+    return compacted
+
+
+def _edge_indices(lines: List[str]) -> Set[int]:
+    body = [idx for idx, line in enumerate(lines) if not PAGE_MARKER.match(line)]
+    return set(body[:EDGE_LINES] + body[-EDGE_LINES:])
+
+
+def _line_key(line: str) -> str:
+    if BARE_PAGE_NUMBER.match(line):
+        return "#"
+    return PAGE_NUMBER.sub("page #", line.lower())
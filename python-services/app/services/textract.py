@@ -0,0 +1,329 @@
+"""
+Textract Engine
+Async wrapper around AWS Textract text detection: bounded concurrent jobs,
+backoff polling or SNS/SQS completion notifications, and result pages
+prefetched while earlier pages are assembled
+"""
+import asyncio
+import json
+import random
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, AsyncIterator
+
+import boto3
+
+from app.config import get_settings
+from app.services.executors import get_executors
+
+
+class TextractBackend(ABC):
+    """Blocking Textract calls; the engine runs them on the I/O thread pool"""
+
+    @abstractmethod
+    def start_text_detection(self, bucket: str, key: str, notification: Optional[Dict[str, str]] = None) -> str:
+        ...
+
+    @abstractmethod
+    def get_text_detection(self, job_id: str, next_token: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def detect_text(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+
+class BotoTextractBackend(TextractBackend):
+    def __init__(self, client: Any):
+        self.client = client
+
+    def start_text_detection(self, bucket: str, key: str, notification: Optional[Dict[str, str]] = None) -> str:
+        params: Dict[str, Any] = {"DocumentLocation": {"S3Object": {"Bucket": bucket, "Name": key}}}
+        if notification:
+            params["NotificationChannel"] = notification
+        return self.client.start_document_text_detection(**params)["JobId"]
+
+    def get_text_detection(self, job_id: str, next_token: Optional[str] = None) -> Dict[str, Any]:
+        params = {"JobId": job_id}
+        if next_token:
+            params["NextToken"] = next_token
+        return self.client.get_document_text_detection(**params)
+
+    def detect_text(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        return self.client.detect_document_text(Document=document)
+
+
+class StubTextractBackend(TextractBackend):
+    """
+    Local stand-in for tests and development (TEXTRACT_BACKEND=stub).
+    Jobs report IN_PROGRESS for `polls_until_done` polls, then return one LINE
+    block per line, `blocks_per_page` blocks per result page.
+    """
+
+    def __init__(
+        self,
+        documents: Optional[Dict[str, List[str]]] = None,
+        polls_until_done: int = 1,
+        blocks_per_page: int = 1000
+    ):
+        self.documents = documents or {}
+        self.polls_until_done = polls_until_done
+        self.blocks_per_page = blocks_per_page
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.calls = {"start": 0, "get": 0, "detect": 0}
+
+    def _lines(self, key: str) -> List[str]:
+        return self.documents.get(key, [f"Stub Textract text for {key}"])
+
+    def start_text_detection(self, bucket: str, key: str, notification: Optional[Dict[str, str]] = None) -> str:
+        self.calls["start"] += 1
+        job_id = f"stub-{len(self.jobs) + 1}"
+        self.jobs[job_id] = {"key": key, "polls": 0}
+        return job_id
+
+    def get_text_detection(self, job_id: str, next_token: Optional[str] = None) -> Dict[str, Any]:
+        self.calls["get"] += 1
+        job = self.jobs[job_id]
+        if next_token is None:
+            job["polls"] += 1
+            if job["polls"] <= self.polls_until_done:
+                return {"JobStatus": "IN_PROGRESS"}
+
+        lines = self._lines(job["key"])
+        start = int(next_token or 0)
+        end = start + self.blocks_per_page
+        response: Dict[str, Any] = {
+            "JobStatus": "SUCCEEDED",
+            "Blocks": [
+                {"BlockType": "LINE", "Text": line, "Page": 1}
+                for line in lines[start:end]
+            ],
+        }
+        if end < len(lines):
+            response["NextToken"] = str(end)
+        return response
+
+    def detect_text(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls["detect"] += 1
+        s3_object = document.get("S3Object")
+        key = s3_object["Name"] if s3_object else "bytes"
+        return {"Blocks": [{"BlockType": "LINE", "Text": line} for line in self._lines(key)]}
+
+
+class SQSCompletionNotifier:
+    """
+    Completion notifications from Textract's SNS topic, delivered through an
+    SQS queue subscribed to it. A single background task long-polls the queue
+    and wakes the jobs waiting on it; messages for other jobs are left alone.
+    """
+
+    def __init__(self, sqs: Any, queue_url: str, topic_arn: str, role_arn: str):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.channel = {"SNSTopicArn": topic_arn, "RoleArn": role_arn}
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, job_id: str) -> None:
+        self._waiters[job_id] = asyncio.get_running_loop().create_future()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[str]:
+        """Job status from its notification, or None if none arrived within timeout"""
+        waiter = self._waiters.get(job_id)
+        if waiter is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def unregister(self, job_id: str) -> None:
+        self._waiters.pop(job_id, None)
+
+    async def _listen(self) -> None:
+        executors = get_executors()
+        while self._waiters:
+            try:
+                response = await executors.run_io(
+                    self.sqs.receive_message,
+                    QueueUrl=self.queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=20,
+                )
+            except Exception as e:
+                print(f"[Textract] SQS receive failed: {e}")
+                await asyncio.sleep(5)
+                continue
+
+            for message in response.get("Messages", []):
+                try:
+                    body = json.loads(message["Body"])
+                    # SNS -> SQS wraps the Textract payload in a "Message" string
+                    payload = json.loads(body["Message"]) if "Message" in body else body
+                except (ValueError, KeyError):
+                    continue
+                waiter = self._waiters.get(payload.get("JobId"))
+                if waiter is None:
+                    continue
+                if not waiter.done():
+                    waiter.set_result(payload.get("Status"))
+                await executors.run_io(
+                    self.sqs.delete_message,
+                    QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"],
+                )
+
+
+class TextractEngine:
+    """
+    Asynchronous text detection
+
+    - at most `max_jobs` Textract jobs in flight across all requests
+    - completion via SNS/SQS notification when configured, otherwise polling
+      with exponential backoff (short jobs finish fast, long ones cost few polls)
+    - result pages follow NextToken sequentially, but the next page is fetched
+      while the current one is being assembled
+    """
+
+    def __init__(
+        self,
+        backend: TextractBackend,
+        max_jobs: int = 4,
+        poll_initial: float = 1.0,
+        poll_max: float = 10.0,
+        timeout: float = 300.0,
+        notifier: Optional[SQSCompletionNotifier] = None
+    ):
+        self.backend = backend
+        self.max_jobs = max_jobs
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.timeout = timeout
+        self.notifier = notifier
+        self._jobs = asyncio.Semaphore(max_jobs)
+        self.jobs_started = 0
+        self.jobs_in_flight = 0
+        self.polls = 0
+
+    async def extract_text(self, bucket: str, key: str) -> Optional[str]:
+        """Run text detection on an S3 document and return its LINE text, or None on failure/timeout"""
+        lines: List[str] = []
+        async for page_lines in self.iter_result_pages(bucket, key):
+            lines.extend(page_lines)
+        return "\n".join(lines) if lines else None
+
+    async def iter_result_pages(self, bucket: str, key: str) -> AsyncIterator[List[str]]:
+        """LINE texts of each Textract result page, in order, as soon as each page arrives"""
+        executors = get_executors()
+        async with self._jobs:
+            self.jobs_in_flight += 1
+            try:
+                notification = self.notifier.channel if self.notifier else None
+                job_id = await executors.run_io(self.backend.start_text_detection, bucket, key, notification)
+                self.jobs_started += 1
+                print(f"[Textract] Job started: {job_id} ({bucket}/{key})")
+
+                response = await self._wait_for_job(job_id)
+            finally:
+                self.jobs_in_flight -= 1
+
+        if response is None:
+            return
+
+        blocks_seen = 0
+        while True:
+            next_token = response.get("NextToken")
+            # Prefetch the next result page while this one is assembled and consumed
+            prefetch = (
+                asyncio.ensure_future(executors.run_io(self.backend.get_text_detection, job_id, next_token))
+                if next_token else None
+            )
+            try:
+                blocks = response.get("Blocks", [])
+                blocks_seen += len(blocks)
+                yield [block["Text"] for block in blocks if block["BlockType"] == "LINE"]
+                if prefetch is None:
+                    break
+                response = await prefetch
+            finally:
+                if prefetch is not None and not prefetch.done():
+                    prefetch.cancel()
+        print(f"[Textract] Job {job_id}: {blocks_seen} blocks")
+
+    async def _wait_for_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """First GetDocumentTextDetection response of a succeeded job (None if failed or timed out)"""
+        executors = get_executors()
+        started = time.monotonic()
+        delay = self.poll_initial
+        if self.notifier:
+            self.notifier.register(job_id)
+        try:
+            while time.monotonic() - started < self.timeout:
+                if self.notifier:
+                    # Notifications normally arrive first; slow polls are only a safety net
+                    await self.notifier.wait(job_id, timeout=self.poll_max)
+                else:
+                    await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+                    delay = min(delay * 2, self.poll_max)
+
+                self.polls += 1
+                response = await executors.run_io(self.backend.get_text_detection, job_id)
+                status = response["JobStatus"]
+                if status in ("SUCCEEDED", "PARTIAL_SUCCESS"):
+                    return response
+                if status == "FAILED":
+                    print(f"[Textract] Job {job_id} failed: {response.get('StatusMessage')}")
+                    return None
+        finally:
+            if self.notifier:
+                self.notifier.unregister(job_id)
+
+        print(f"[Textract] Job {job_id} timed out after {self.timeout:.0f}s")
+        return None
+
+    async def detect_lines(self, document: Dict[str, Any]) -> List[str]:
+        """Synchronous DetectDocumentText (single page image, S3Object or Bytes)"""
+        response = await get_executors().run_io(self.backend.detect_text, document)
+        return [block.get("Text", "") for block in response.get("Blocks", []) if block["BlockType"] == "LINE"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "maxJobs": self.max_jobs,
+            "jobsInFlight": self.jobs_in_flight,
+            "jobsStarted": self.jobs_started,
+            "polls": self.polls,
+        }
+
+
+@lru_cache()
+def get_textract_engine() -> TextractEngine:
+    """Process-wide engine so the job limit is shared by every extraction"""
+    settings = get_settings()
+    aws = {
+        "region_name": settings.aws_region,
+        "aws_access_key_id": settings.aws_access_key_id,
+        "aws_secret_access_key": settings.aws_secret_access_key,
+    }
+
+    if settings.textract_backend == "stub":
+        backend: TextractBackend = StubTextractBackend()
+    else:
+        backend = BotoTextractBackend(boto3.client("textract", **aws))
+
+    notifier = None
+    if settings.textract_sqs_queue_url and settings.textract_sns_topic_arn and settings.textract_backend != "stub":
+        notifier = SQSCompletionNotifier(
+            boto3.client("sqs", **aws),
+            settings.textract_sqs_queue_url,
+            settings.textract_sns_topic_arn,
+            settings.textract_sns_role_arn,
+        )
+
+    return TextractEngine(
+        backend,
+        max_jobs=settings.textract_max_concurrent_jobs,
+        poll_initial=settings.textract_poll_initial_seconds,
+        poll_max=settings.textract_poll_max_seconds,
+        timeout=settings.textract_timeout_seconds,
+        notifier=notifier,
+    )
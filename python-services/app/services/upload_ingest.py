@@ -0,0 +1,118 @@
+"""
+Upload Ingest
+Copies an uploaded file into a DocumentBuffer in chunks. The type is sniffed
+from the first bytes rather than the filename, the size cap is checked chunk
+by chunk and the content hash is computed on the way through. The upload
+itself has already been spooled by Starlette; what bounds the request body
+is the Content-Length check in app.main.
+"""
+import hashlib
+import zipfile
+from pathlib import Path
+from typing import Optional
+
+from fastapi import UploadFile
+
+from app.services.ai_extraction import EXCEL_EXTENSIONS, WORD_EXTENSIONS, IMAGE_EXTENSIONS
+from app.services.document_buffer import DocumentBuffer
+from app.services.executors import get_executors
+
+
+CHUNK_BYTES = 1024 * 1024
+
+# PDF readers accept a little junk before the header, so look for it in the first KB
+PDF_HEADER_WINDOW = 1024
+
+ZIP_MAGIC = b"PK\x03\x04"
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"  # Legacy .xls / .doc
+
+# Marker for zip containers, resolved to .xlsx/.docx from the archive listing
+OOXML = "ooxml"
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds upload_max_bytes"""
+
+
+class UnsupportedUploadError(ValueError):
+    """Raised when an upload's content is not a supported document type"""
+
+
+def sniff_extension(head: bytes, filename: str = "") -> Optional[str]:
+    """Document extension from the leading bytes, or None for unsupported content"""
+    claimed = Path(filename).suffix.lower()
+    if b"%PDF-" in head[:PDF_HEADER_WINDOW]:
+        return ".pdf"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(ZIP_MAGIC):
+        return OOXML
+    if head.startswith(OLE2_MAGIC) and claimed in (".xls", ".doc"):
+        return claimed
+    return None
+
+
+def ooxml_extension(path: str) -> Optional[str]:
+    """.xlsx or .docx from the parts of an Office Open XML package (reads the central directory only)"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return None
+    if "xl/workbook.xml" in names:
+        return ".xlsx"
+    if "word/document.xml" in names:
+        return ".docx"
+    return None
+
+
+async def ingest_upload(file: UploadFile, max_bytes: int = 0) -> DocumentBuffer:
+    """
+    Copy an upload (already spooled by Starlette) into a document buffer
+    chunk by chunk, never holding more than one chunk in memory.
+    Unsupported content is rejected after the first chunk and oversized files
+    as soon as they cross max_bytes (0 = no limit). The returned buffer's
+    suffix is the sniffed type and its content_hash is already set.
+    """
+    filename = file.filename or "document"
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(_too_large(filename, max_bytes))
+
+    executors = get_executors()
+    await file.seek(0)
+    chunk = await file.read(CHUNK_BYTES)
+    extension = sniff_extension(chunk, filename)
+    if extension is None:
+        raise UnsupportedUploadError(f"{filename}: unsupported file type")
+
+    supported = EXCEL_EXTENSIONS + WORD_EXTENSIONS + IMAGE_EXTENSIONS + [".pdf"]
+    claimed = Path(filename).suffix.lower()
+    suffix = extension if extension != OOXML else (claimed if claimed in supported else ".zip")
+    buffer = await executors.run_io(DocumentBuffer.create, suffix)
+    try:
+        digest = hashlib.sha256()
+        while chunk:
+            if max_bytes and buffer.size + len(chunk) > max_bytes:
+                raise UploadTooLargeError(_too_large(filename, max_bytes))
+            digest.update(chunk)
+            await executors.run_io(buffer.write, chunk)
+            chunk = await file.read(CHUNK_BYTES)
+        buffer.seal()
+        buffer.content_hash = digest.hexdigest()
+
+        if extension == OOXML:
+            extension = await executors.run_io(ooxml_extension, buffer.path)
+            if extension is None:
+                raise UnsupportedUploadError(f"{filename}: zip archive is not an Excel or Word document")
+            if extension != suffix:
+                await executors.run_io(buffer.rename_suffix, extension)
+        return buffer
+    except BaseException:
+        buffer.close()
+        raise
+
+
+def _too_large(filename: str, max_bytes: int) -> str:
+    return f"{filename} is larger than the {max_bytes / 1024 / 1024:.0f} MB upload limit"